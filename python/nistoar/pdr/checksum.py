@@ -0,0 +1,658 @@
+"""
+Tools for calculating the checksums of data files efficiently.
+
+The central class in this module is the ChecksumEngine which can calculate
+the checksums for a list of files in parallel, using either a pool of threads
+or of processes.  The amount of data being read at any one time is bounded
+by a configurable number of bytes so that a list containing a few very large
+files does not swamp the filesystem.
+
+The ChecksumCache class provides a persistent store of previously calculated
+checksums that can be shared across processes.  Entries are keyed on the 
+file's device, inode, size, and modification time so that an unchanged file
+need not be read again.  
+
+For very large files, the engine can also calculate a "tree hash":  the file
+is divided into fixed-size chunks, each chunk is hashed separately, and the
+chunk digests are combined pair-wise into a single root digest.  Because 
+each chunk can be verified independently, a file can be verified by many 
+workers at once, and a corrupted region of the file can be located.
+"""
+import os, logging, time, threading, sqlite3, hashlib, shutil
+from binascii import unhexlify
+from collections import OrderedDict
+from collections import deque
+from multiprocessing.pool import ThreadPool, Pool as ProcessPool
+
+from .utils import checksum_of, digests_of, SNIFF_SIZE
+
+log = logging.getLogger(__name__)
+
+DEF_MAX_INFLIGHT_BYTES = 1024 * 1024 * 1024    # 1 GB
+DEF_CACHE_MAX_ENTRIES = 500000
+DEF_CHECKSUM_CACHE_FILE = "_checksums.sqlite"
+COPY_BUFFER_SIZE = 10240000   # 10 MB
+DEF_ALGORITHM = "sha256"
+DEF_CHUNK_SIZE = 256 * 1024 * 1024   # 256 MB
+
+def copy_with_digests(srcpath, destpath, algorithms=(DEF_ALGORITHM,)):
+    """
+    copy a file while calculating its checksums so that the file need only be
+    read once.  Like shutil.copy(), the file's permission bits are copied 
+    as well.  
+
+    :param srcpath str:   the path to the file to copy
+    :param destpath str:  the path to write the copy to
+    :param algorithms list:  the names of the checksum algorithms to apply
+    :return tuple:  a dictionary mapping each algorithm name to the hash of 
+                    the file's contents, the number of bytes copied, and 
+                    the file's leading bytes (up to SNIFF_SIZE, for 
+                    surmising its media type)
+    """
+    sums = [(alg, hashlib.new(alg)) for alg in algorithms]
+    size = 0
+    head = None
+    with open(srcpath, 'rb') as ifd:
+        with open(destpath, 'wb') as ofd:
+            while True:
+                buf = ifd.read(COPY_BUFFER_SIZE)
+                if not buf: break
+                if head is None:
+                    head = buf[:SNIFF_SIZE]
+                for alg, sum in sums:
+                    sum.update(buf)
+                ofd.write(buf)
+                size += len(buf)
+    shutil.copymode(srcpath, destpath)
+    return (dict([(alg, sum.hexdigest()) for alg, sum in sums]), size,
+            head or '')
+
+def chunk_ranges(size, chunk_size):
+    """
+    return the list of (offset, length) pairs that divide a file of a given 
+    size into chunks.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+    return [(off, min(chunk_size, size - off))
+            for off in xrange(0, size, chunk_size)]
+
+def chunk_digest(filepath, offset, length, algorithm=DEF_ALGORITHM):
+    """
+    return the checksum of a region of a file.
+
+    :param filepath str:  the path to the file
+    :param offset   int:  the position of the first byte of the region
+    :param length   int:  the number of bytes in the region
+    :param algorithm str: the name of the checksum algorithm to apply
+    """
+    sum = hashlib.new(algorithm)
+    with open(filepath, 'rb') as fd:
+        fd.seek(offset)
+        while length > 0:
+            buf = fd.read(min(length, COPY_BUFFER_SIZE))
+            if not buf: break
+            sum.update(buf)
+            length -= len(buf)
+    return sum.hexdigest()
+
+def tree_root(chunks, algorithm=DEF_ALGORITHM):
+    """
+    combine a list of chunk digests (as hex strings) into a single root 
+    digest.  Adjacent digests are hashed together level by level; an odd 
+    digest at the end of a level is promoted unchanged to the next level.
+    """
+    level = list(chunks)
+    if not level:
+        return hashlib.new(algorithm).hexdigest()
+    while len(level) > 1:
+        nxt = []
+        for i in xrange(0, len(level)-1, 2):
+            nxt.append(hashlib.new(algorithm, unhexlify(level[i]) +
+                                              unhexlify(level[i+1])).hexdigest())
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+def make_tree_hash(size, chunk_size, chunks, algorithm=DEF_ALGORITHM):
+    """
+    assemble a tree hash description from a list of chunk digests
+
+    :return dict:  the tree hash, including its root digest
+    """
+    return OrderedDict([
+        ("algorithm", algorithm),
+        ("chunkSize", chunk_size),
+        ("size",      size),
+        ("root",      tree_root(chunks, algorithm)),
+        ("chunks",    list(chunks))
+    ])
+
+def tree_digests_of(filepath, chunk_size=DEF_CHUNK_SIZE,
+                    algorithms=(DEF_ALGORITHM,), tree_algorithm=DEF_ALGORITHM):
+    """
+    calculate both the whole-file checksums and the tree hash of a file 
+    from a single read of the file.
+
+    :param filepath str:    the path to the file to hash
+    :param chunk_size int:  the size of the tree hash chunks in bytes
+    :param algorithms list: the names of the whole-file algorithms to apply
+    :param tree_algorithm str:  the name of the algorithm to apply to chunks
+    :return tuple:  a mapping of algorithm names to whole-file hash values
+                    and the tree hash (as returned by make_tree_hash())
+    """
+    sums = [(alg, hashlib.new(alg)) for alg in algorithms]
+    chunks = []
+    size = 0
+    csum = None
+    with open(filepath, 'rb') as fd:
+        while True:
+            if csum is None or size % chunk_size == 0:
+                if csum:
+                    chunks.append(csum.hexdigest())
+                csum = hashlib.new(tree_algorithm)
+            buf = fd.read(min(COPY_BUFFER_SIZE, chunk_size - size % chunk_size))
+            if not buf: break
+            for alg, sum in sums:
+                sum.update(buf)
+            csum.update(buf)
+            size += len(buf)
+    if size % chunk_size:
+        chunks.append(csum.hexdigest())
+
+    return (dict([(alg, sum.hexdigest()) for alg, sum in sums]),
+            make_tree_hash(size, chunk_size, chunks, tree_algorithm))
+
+def _digests_job(filepath, algorithms):
+    # this must be a module-level function so that it can be sent to a
+    # process pool.
+    return digests_of(filepath, algorithms)
+
+class ChecksumEngine(object):
+    """
+    a class for calculating the checksums of many files at the same time.
+
+    The engine submits its files to a pool of workers and returns the results
+    in the same order that the files were submitted.  Files are submitted as
+    long as the total size of the files currently being hashed does not exceed
+    a configured limit (though at least one file will always be processed,
+    regardless of its size).  When several checksum algorithms are requested,
+    all of them are calculated from a single read of each file.
+
+    This class can take a configuration dictionary on construction; the
+    following properties are supported:
+    :prop workers int (1):  the number of files to hash simultaneously.  If
+                              this is 1 or less, files are hashed serially
+                              within the calling thread.
+    :prop pool_type str ("thread"):  the type of worker pool to use, either
+                              "thread" or "process".  Because the hashing
+                              functions release the interpreter lock while
+                              they crunch on data, threads are usually
+                              sufficient.
+    :prop max_inflight_bytes int (1073741824):  the maximum total size of the
+                              files that may be hashed at the same time.
+    """
+
+    def __init__(self, config=None, cache=None, algorithms=None):
+        """
+        create the engine
+
+        :param config dict:  the configuration for the engine (see class 
+                             documentation for supported parameters).
+        :param cache ChecksumCache:  a cache to consult before reading any 
+                             file and to update with newly calculated 
+                             checksums.  If None, files will always be read.
+        :param algorithms list:  the names of the checksum algorithms that 
+                             digests_of() and iter_digests() should apply 
+                             by default; if None, only sha256 is applied.
+        """
+        if config is None:
+            config = {}
+        self.cfg = config
+        self.cache = cache
+
+        if not algorithms:
+            algorithms = [DEF_ALGORITHM]
+        for alg in algorithms:
+            # raises ValueError if the algorithm is not supported
+            hashlib.new(alg)
+        self.algorithms = list(algorithms)
+
+        self.workers = self.cfg.get('workers', 1)
+        self.pool_type = self.cfg.get('pool_type', 'thread')
+        if self.pool_type not in ('thread', 'process'):
+            raise ValueError("ChecksumEngine: unsupported pool_type: " +
+                             str(self.pool_type))
+        self.max_inflight = self.cfg.get('max_inflight_bytes',
+                                         DEF_MAX_INFLIGHT_BYTES)
+
+    def checksum_of(self, filepath):
+        """
+        return the (SHA-256) checksum of a single file
+        """
+        return self.digests_of(filepath, [DEF_ALGORITHM])[DEF_ALGORITHM]
+
+    def digests_of(self, filepath, algorithms=None):
+        """
+        return the checksums of a single file for each of a set of algorithms.
+
+        :param filepath str:     the path to the file to hash
+        :param algorithms list:  the names of the algorithms to apply; if 
+                                 None, this engine's default set is applied.
+        :return dict:  a mapping of algorithm names to hash values
+        """
+        if not algorithms:
+            algorithms = self.algorithms
+        if self.cache is not None:
+            return self.cache.digests_of(filepath, algorithms)
+        return digests_of(filepath, algorithms)
+
+    def copy_file(self, srcpath, destpath, algorithms=None):
+        """
+        copy a file, calculating its checksums as the bytes are copied.  If 
+        this engine has a cache, the checksums are saved for the copy (and for
+        the original if it did not change during the copy).
+
+        :param algorithms list:  the names of the algorithms to apply; if 
+                                 None, this engine's default set is applied.
+        :return tuple:  a mapping of algorithm names to hash values, the 
+                        number of bytes copied, and the file's leading bytes
+                        (see copy_with_digests())
+        """
+        if not algorithms:
+            algorithms = self.algorithms
+        st = os.stat(srcpath)
+        out = copy_with_digests(srcpath, destpath, algorithms)
+        if self.cache is not None:
+            self.cache.put_digests(destpath, out[0])
+            if _unchanged(st, os.stat(srcpath)):
+                self.cache.put_digests(srcpath, out[0], st=st)
+        return out
+
+    def checksums_of(self, filepaths):
+        """
+        return the (SHA-256) checksums of the given files as a list, in the 
+        same order as the input list.
+
+        :param filepaths list:  the paths to the files to calculate checksums
+                                  for.
+        :return list:  the list of checksum hash values
+        """
+        return [cs for fp, cs in self.iter_checksums(filepaths)]
+
+    def iter_checksums(self, filepaths):
+        """
+        iterate through the given files, returning each file's (SHA-256) 
+        checksum.  The files are hashed in parallel (according to this 
+        engine's configuration), but the results are returned in the same 
+        order as the input list.
+
+        :param filepaths list:  the paths to the files to calculate checksums
+                                  for.
+        :return generator:  each iteration returns a 2-tuple containing a
+                            filepath and its checksum hash value.
+        """
+        for fp, dg in self.iter_digests(filepaths, [DEF_ALGORITHM]):
+            yield (fp, dg[DEF_ALGORITHM])
+
+    def iter_digests(self, filepaths, algorithms=None):
+        """
+        iterate through the given files, returning each file's checksums for
+        a set of algorithms.  Each file is read only once, and the files are 
+        hashed in parallel (according to this engine's configuration), but 
+        the results are returned in the same order as the input list.
+
+        :param filepaths list:   the paths to the files to calculate checksums
+                                   for.
+        :param algorithms list:  the names of the algorithms to apply; if 
+                                 None, this engine's default set is applied.
+        :return generator:  each iteration returns a 2-tuple containing a
+                            filepath and a dictionary mapping algorithm names
+                            to hash values.
+        """
+        if not algorithms:
+            algorithms = self.algorithms
+        filepaths = list(filepaths)
+        if self.workers <= 1 or len(filepaths) < 2:
+            for fp in filepaths:
+                yield (fp, self.digests_of(fp, algorithms))
+            return
+
+        pool = self._make_pool(min(self.workers, len(filepaths)))
+        try:
+            inflight = deque()
+            nbytes = 0
+            for fp in filepaths:
+                st = os.stat(fp)
+                if self.cache is not None:
+                    dg = self.cache.get_digests(fp, algorithms, st=st)
+                    if dg:
+                        inflight.append( (fp, 0, _Done(dg), None) )
+                        continue
+
+                # wait for earlier files to finish if this one would put us
+                # over the limit
+                while inflight and nbytes + st.st_size > self.max_inflight:
+                    nbytes -= inflight[0][1]
+                    yield self._collect(inflight.popleft())
+
+                inflight.append( (fp, st.st_size,
+                                  self._submit(pool, fp, algorithms), st) )
+                nbytes += st.st_size
+
+            while inflight:
+                yield self._collect(inflight.popleft())
+
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def tree_digests_of(self, filepath, chunk_size=DEF_CHUNK_SIZE,
+                        algorithms=None):
+        """
+        calculate both the whole-file checksums and the tree hash of a file 
+        from a single (sequential) read of the file.  
+
+        :param filepath str:    the path to the file to hash
+        :param chunk_size int:  the size of the tree hash chunks in bytes
+        :param algorithms list: the names of the whole-file algorithms to 
+                                apply; if None, this engine's default set is 
+                                applied.
+        :return tuple:  a mapping of algorithm names to whole-file hash values
+                        and the tree hash (see make_tree_hash())
+        """
+        if not algorithms:
+            algorithms = self.algorithms
+        st = os.stat(filepath)
+        out = tree_digests_of(filepath, chunk_size, algorithms)
+        if self.cache is not None:
+            self.cache.put_digests(filepath, out[0], st=st)
+        return out
+
+    def tree_hash_of(self, filepath, chunk_size=DEF_CHUNK_SIZE,
+                     algorithm=DEF_ALGORITHM):
+        """
+        calculate the tree hash of a file, hashing its chunks in parallel.
+
+        :param filepath str:    the path to the file to hash
+        :param chunk_size int:  the size of the chunks in bytes
+        :param algorithm str:   the name of the algorithm to apply to chunks
+        :return dict:  the tree hash (see make_tree_hash())
+        """
+        size = os.stat(filepath).st_size
+        chunks = list(self._iter_chunk_digests(filepath,
+                                               chunk_ranges(size, chunk_size),
+                                               algorithm))
+        return make_tree_hash(size, chunk_size, chunks, algorithm)
+
+    def verify_tree_hash(self, filepath, treehash):
+        """
+        check a file against a previously calculated tree hash, verifying its
+        chunks in parallel.  
+
+        :param filepath str:  the path to the file to check
+        :param treehash dict: the tree hash (as returned by tree_hash_of())
+        :return list:  the (offset, length) pairs identifying the regions of 
+                       the file that do not match the tree hash; an empty 
+                       list indicates that the file is intact.
+        """
+        chunk_size = treehash['chunkSize']
+        size = os.stat(filepath).st_size
+        if size != treehash['size'] or \
+           tree_root(treehash['chunks'], treehash['algorithm']) != \
+                                                         treehash['root']:
+            # the chunk list cannot be trusted
+            return [(0, max(size, treehash['size']))]
+
+        ranges = chunk_ranges(size, chunk_size)
+        calcd = self._iter_chunk_digests(filepath, ranges,
+                                         treehash['algorithm'])
+        return [r for r, want, got in zip(ranges, treehash['chunks'], calcd)
+                  if want != got]
+
+    def _iter_chunk_digests(self, filepath, ranges, algorithm):
+        if self.workers <= 1 or len(ranges) < 2:
+            for off, ln in ranges:
+                yield chunk_digest(filepath, off, ln, algorithm)
+            return
+
+        pool = self._make_pool(min(self.workers, len(ranges)))
+        try:
+            inflight = deque()
+            nbytes = 0
+            for off, ln in ranges:
+                while inflight and nbytes + ln > self.max_inflight:
+                    nbytes -= inflight[0][0]
+                    yield inflight.popleft()[1].get()
+                inflight.append( (ln, pool.apply_async(chunk_digest,
+                                                 (filepath, off, ln, algorithm))) )
+                nbytes += ln
+
+            while inflight:
+                yield inflight.popleft()[1].get()
+
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _collect(self, job):
+        dg = job[2].get()
+        if self.cache is not None and job[3]:
+            self.cache.put_digests(job[0], dg, st=job[3])
+        return (job[0], dg)
+
+    def _make_pool(self, nworkers):
+        if self.pool_type == 'process':
+            return ProcessPool(nworkers)
+        return ThreadPool(nworkers)
+
+    def _submit(self, pool, filepath, algorithms):
+        return pool.apply_async(_digests_job, (filepath, algorithms))
+
+
+class _Done(object):
+    # a stand-in for an AsyncResult for a value that is already known
+    def __init__(self, value):
+        self._value = value
+    def get(self):
+        return self._value
+
+def _mtime_ns(st):
+    out = getattr(st, 'st_mtime_ns', None)
+    if out is None:
+        out = int(round(st.st_mtime * 1000000000))
+    return out
+
+def _unchanged(st1, st2):
+    return st1.st_size == st2.st_size and _mtime_ns(st1) == _mtime_ns(st2)
+
+class ChecksumCache(object):
+    """
+    a persistent, shareable cache of file checksums.  
+
+    Checksums are stored in an SQLite database file keyed on the file's 
+    device, inode, size, and modification time (along with the checksum 
+    algorithm); thus, a cached value is only returned if the file has 
+    apparently not changed since the checksum was calculated.  The database
+    can be shared by multiple threads and processes.  When the number of 
+    entries exceeds a configured maximum, the least recently used entries 
+    are evicted.  
+
+    This class can take a configuration dictionary on construction; the 
+    following properties are supported:
+    :prop max_entries int (500000):  the maximum number of checksums to 
+                              retain in the cache.
+    :prop evict_check_interval int (1000):  the number of new entries to add
+                              between checks on the size of the cache.  
+    :prop timeout float (30.0):  the number of seconds to wait for another 
+                              process to release its lock on the database.
+    """
+    # don't bother updating the access time of an entry more often than this
+    _access_resolution = 3600
+
+    def __init__(self, dbfile, config=None):
+        """
+        open the cache, creating its database file if necessary
+
+        :param dbfile str:   the path to the SQLite database file
+        :param config dict:  the configuration for the cache (see class 
+                             documentation for supported parameters).
+        """
+        if config is None:
+            config = {}
+        self.cfg = config
+        self.dbfile = dbfile
+        self.max_entries = self.cfg.get('max_entries', DEF_CACHE_MAX_ENTRIES)
+        self._evict_intv = self.cfg.get('evict_check_interval', 1000)
+        self._nput = 0
+        self._local = threading.local()
+
+        self._db().execute("""CREATE TABLE IF NOT EXISTS checksums (
+                                  dev INTEGER, ino INTEGER, size INTEGER, 
+                                  mtime INTEGER, alg TEXT, hash TEXT, 
+                                  accessed REAL,
+                                  PRIMARY KEY (dev, ino, size, mtime, alg) )""")
+        self._db().execute("""CREATE INDEX IF NOT EXISTS checksums_accessed 
+                                  ON checksums (accessed)""")
+
+    def _db(self):
+        # SQLite connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.dbfile, self.cfg.get('timeout', 30.0),
+                                   isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _key(self, filepath, st=None):
+        if st is None:
+            st = os.stat(filepath)
+        return (st.st_dev, st.st_ino, st.st_size, _mtime_ns(st))
+
+    def get(self, filepath, algorithm='sha256', st=None):
+        """
+        return the cached checksum for the given file or None if the file 
+        has not been cached or has changed since it was.
+
+        :param filepath str:  the path to the file of interest
+        :param algorithm str: the name of the checksum algorithm 
+        :param st:            the result of os.stat() on the file; if not
+                              provided, the file will be stat-ed.
+        """
+        key = self._key(filepath, st) + (algorithm,)
+        row = self._db().execute("""SELECT hash, accessed FROM checksums WHERE 
+                                    dev=? AND ino=? AND size=? AND mtime=? AND 
+                                    alg=?""", key).fetchone()
+        if not row:
+            return None
+
+        now = time.time()
+        if now - row[1] > self._access_resolution:
+            self._db().execute("""UPDATE checksums SET accessed=? WHERE 
+                                  dev=? AND ino=? AND size=? AND mtime=? AND 
+                                  alg=?""", (now,) + key)
+        return str(row[0])
+
+    def put(self, filepath, hash, algorithm='sha256', st=None):
+        """
+        save a checksum for the given file
+
+        :param filepath str:  the path to the file of interest
+        :param hash     str:  the checksum hash value for the file
+        :param algorithm str: the name of the checksum algorithm 
+        :param st:            the result of os.stat() on the file taken before
+                              its checksum was calculated; if not provided, 
+                              the file will be stat-ed.
+        """
+        key = self._key(filepath, st) + (algorithm,)
+        self._db().execute("""INSERT OR REPLACE INTO checksums 
+                              (dev, ino, size, mtime, alg, hash, accessed) 
+                              VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                           key + (hash, time.time()))
+        self._nput += 1
+        if self._nput >= self._evict_intv:
+            self._nput = 0
+            self.evict()
+
+    def get_digests(self, filepath, algorithms, st=None):
+        """
+        return the cached checksums for the given file for a set of 
+        algorithms or None if any of them are not available.  
+
+        :param filepath str:     the path to the file of interest
+        :param algorithms list:  the names of the checksum algorithms
+        :param st:               the result of os.stat() on the file; if not
+                                 provided, the file will be stat-ed.
+        :return dict:  a mapping of algorithm names to hash values
+        """
+        if st is None:
+            st = os.stat(filepath)
+        out = {}
+        for alg in algorithms:
+            out[alg] = self.get(filepath, alg, st)
+            if not out[alg]:
+                return None
+        return out
+
+    def put_digests(self, filepath, digests, st=None):
+        """
+        save a set of checksums for the given file
+
+        :param filepath str:  the path to the file of interest
+        :param digests dict:  a mapping of algorithm names to hash values
+        :param st:            the result of os.stat() on the file taken before
+                              its checksums were calculated; if not provided, 
+                              the file will be stat-ed.
+        """
+        if st is None:
+            st = os.stat(filepath)
+        for alg, hash in digests.items():
+            self.put(filepath, hash, alg, st)
+
+    def checksum_of(self, filepath, algorithm='sha256'):
+        """
+        return the checksum for the given file, calculating it (and caching
+        the result) only if necessary.
+        """
+        return self.digests_of(filepath, [algorithm])[algorithm]
+
+    def digests_of(self, filepath, algorithms):
+        """
+        return the checksums for the given file for a set of algorithms,
+        reading the file (once) only if any of them are not cached.
+
+        :return dict:  a mapping of algorithm names to hash values
+        """
+        st = os.stat(filepath)
+        out = self.get_digests(filepath, algorithms, st)
+        if not out:
+            out = digests_of(filepath, algorithms)
+            self.put_digests(filepath, out, st)
+        return out
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM checksums").fetchone()[0]
+
+    def evict(self, max_entries=None):
+        """
+        remove the least recently used entries so that the cache holds no 
+        more than a given number of entries.  
+
+        :param max_entries int:  the number of entries to retain; if None, 
+                                 the configured maximum is used.
+        """
+        if max_entries is None:
+            max_entries = self.max_entries
+        excess = len(self) - max_entries
+        if excess > 0:
+            log.debug("Evicting %d entries from checksum cache", excess)
+            self._db().execute("""DELETE FROM checksums WHERE rowid IN 
+                                  (SELECT rowid FROM checksums 
+                                   ORDER BY accessed LIMIT ?)""", (excess,))
+
+    def clear(self):
+        """
+        remove all entries from the cache
+        """
+        self._db().execute("DELETE FROM checksums")
@@ -155,14 +155,28 @@ class IngestClient(object):
         write the given NERDm record to a file in JSON format in the staging
         area for later submission to the ingest service.
 
-        :param record dict:   the NERDm record object to be ingested
+        The record can be given either as an object or already serialized
+        as an iterable of JSON strings (e.g. as produced by 
+        NISTBag.iter_nerdm_record()); in the latter case, the chunks are 
+        written out as they are produced, and a name must be provided.  
+
+        :param record dict or iterable:   the NERDm record to be ingested
         :param name    str:   a name to give to the record filename (without
                               an extension).  If None, a name will be
-                              generated.
+                              generated (only if record is a dict).
         """
+        if not isinstance(record, Mapping) and \
+           not isinstance(record, (str, unicode)) and \
+           hasattr(record, '__iter__'):
+            if not name:
+                raise ValueError("stage(): a name is required for a record "+
+                                 "given as serialized chunks")
+            self._stage_chunks(record, name)
+            return
+
         if not isinstance(record, Mapping):
             raise TypeError("stage(): record not a JSON object; got "+
-                            type(record))
+                            str(type(record)))
         if not record.get('@id'):
             raise ValueError("Input does not look like a valid NERDm record; "+
                              "missing @id")
@@ -172,6 +186,22 @@ class IngestClient(object):
         outfile = os.path.join(self._stagedir, name+".json")
         write_json(record, outfile)
 
+    def _stage_chunks(self, chunks, name):
+        # write the serialized record to a hidden file first so that it is
+        # not visible as staged until it is complete
+        outfile = os.path.join(self._stagedir, name+".json")
+        tmpfile = os.path.join(self._stagedir, "_"+name+".json")
+        try:
+            with open(tmpfile, 'w') as fd:
+                for chunk in chunks:
+                    fd.write(chunk)
+            os.rename(tmpfile, outfile)
+        except Exception, ex:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise StateException("{0}: Failed to write JSON data to file: {1}"
+                                 .format(outfile, str(ex)), cause=ex)
+
     def staged_names(self):
         """
         return the names of records that are currently staged for ingest
@@ -0,0 +1,260 @@
+"""
+This module provides tools for keeping track of the files found in an SIP's
+input directories.
+
+The SIPInventory class keeps a snapshot of the files below a set of input
+directories (their sizes and modification times along with the modification
+times of the directories that contain them) that can be saved to disk.  When
+it is refreshed, only those directories whose modification times have
+changed are listed again, and the differences from the previous snapshot are
+reported.  This avoids a full walk of large SIPs on slow (e.g. NFS)
+filesystems every time a bag is updated.
+"""
+import os, json, logging, stat, time
+
+from .. import PreservationSystem, sys as _sys
+from .. import StateException
+
+log = logging.getLogger(_sys.system_abbrev).getChild(_sys.subsystem_abbrev)
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# a directory modified more recently than this many seconds ago may yet
+# change within the resolution of its modification time
+MTIME_SETTLE_TIME = 2
+
+def _ignorable(name):
+    # dot-files and files with leading underscores are not considered part
+    # of the SIP
+    return name.startswith('.') or name.startswith('_')
+
+class SIPInventory(PreservationSystem):
+    """
+    an inventory of the files below a list of input root directories that can
+    be updated incrementally.
+
+    When a file with the same path relative to its root appears below more
+    than one root directory, the one under the root appearing later in the
+    list takes precedence.  Files and directories whose names start with a
+    '.' or '_' are ignored.
+
+    This class can take a configuration dictionary on construction; the
+    following parameters are supported:
+    :prop check_file_changes bool (True):  if True, the files in directories
+                     that have not changed will be checked (via stat) for
+                     changes to their size or modification time; if False,
+                     only files in directories whose modification times
+                     have changed are checked.  The latter is faster but
+                     will not notice files that were updated in place.
+    """
+
+    def __init__(self, roots, snapfile=None, exclude=None, config=None):
+        """
+        create the inventory, restoring its last snapshot if available.
+
+        :param roots list:    the input root directories to inventory
+        :param snapfile str:  the path to the file where the snapshot should
+                              be saved; if None, the snapshot will not be
+                              persisted.
+        :param exclude list:  a list of root-relative file paths that should
+                              not be included in the inventory.
+        :param config dict:   the configuration for the inventory (see class
+                              documentation for supported parameters).
+        """
+        if config is None:
+            config = {}
+        self.cfg = config
+        self.roots = [r.rstrip('/') for r in roots]
+        self.snapfile = snapfile
+        self.exclude = set(exclude or [])
+
+        # root -> reldir -> { "mtime": float, "dirs": [], "files": {} }
+        self._dirs = {}
+        self._files = None
+        self.restored = self._load()
+
+    def _load(self):
+        if not self.snapfile or not os.path.exists(self.snapfile):
+            return False
+        try:
+            with open(self.snapfile) as fd:
+                data = json.load(fd)
+            if data.get('version') != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError("unsupported snapshot version: " +
+                                 str(data.get('version')))
+            self._dirs = dict([(r, d) for r, d in data['roots'].items()
+                                      if r in self.roots])
+        except (ValueError, KeyError, IOError), ex:
+            log.warning("Unable to restore inventory snapshot (%s); "
+                        "will rescan: %s", self.snapfile, str(ex))
+            self._dirs = {}
+            return False
+
+        self._files = self._collate()
+        return True
+
+    def save(self):
+        """
+        save the current snapshot to the snapshot file (if one was given
+        at construction).
+        """
+        if not self.snapfile:
+            return
+        data = { "version": SNAPSHOT_FORMAT_VERSION, "roots": self._dirs }
+        tmpfile = self.snapfile + ".tmp"
+        try:
+            with open(tmpfile, 'w') as fd:
+                json.dump(data, fd, separators=(',', ':'))
+            os.rename(tmpfile, self.snapfile)
+        except (IOError, OSError), ex:
+            raise StateException("Unable to save inventory snapshot: " +
+                                 self.snapfile + ": " + str(ex), cause=ex,
+                                 sys=self)
+
+    def discard(self):
+        """
+        forget the current snapshot and remove the snapshot file.  The next
+        call to refresh() will rescan all of the input directories.
+        """
+        self._dirs = {}
+        self._files = None
+        self.restored = False
+        if self.snapfile and os.path.exists(self.snapfile):
+            os.remove(self.snapfile)
+
+    def files(self):
+        """
+        return the current inventory as a dictionary mapping root-relative
+        file paths to the full paths of the files.  refresh() should be
+        called at least once before calling this function.
+        """
+        if self._files is None:
+            self.refresh()
+        return dict([(fp, e[0]) for fp, e in self._files.items()])
+
+    def stat_of(self, filepath):
+        """
+        return the size and modification time recorded for the file with the
+        given root-relative path as a 2-tuple, or None if the file is not
+        in the inventory.
+        """
+        if self._files is None:
+            self.refresh()
+        e = self._files.get(filepath)
+        return (e and tuple(e[1:])) or None
+
+    def dir_mtimes(self):
+        """
+        return a dictionary mapping the full path of each inventoried
+        directory to its recorded modification time.
+        """
+        out = {}
+        for root, dirs in self._dirs.items():
+            for reldir, ent in dirs.items():
+                out[os.path.join(root, reldir).rstrip('/')] = ent['mtime']
+        return out
+
+    def refresh(self):
+        """
+        update the inventory to reflect the current contents of the input
+        directories.  Only directories whose modification times have changed
+        since the last snapshot are listed again.
+
+        :return dict:  the changes since the last snapshot with keys "added",
+                       "removed", and "modified", each giving a set of
+                       root-relative file paths.
+        """
+        old = self._files or {}
+        for root in self.roots:
+            self._refresh_root(root)
+        for root in self._dirs.keys():
+            if root not in self.roots:
+                del self._dirs[root]
+        self._files = self._collate()
+
+        out = { "added": set(), "removed": set(), "modified": set() }
+        for fp, e in self._files.items():
+            if fp not in old:
+                out['added'].add(fp)
+            elif e != old[fp]:
+                out['modified'].add(fp)
+        out['removed'] = set([fp for fp in old if fp not in self._files])
+
+        log.debug("Inventory refreshed: %d added, %d removed, %d modified",
+                  len(out['added']), len(out['removed']), len(out['modified']))
+        return out
+
+    def _refresh_root(self, root):
+        olddirs = self._dirs.get(root, {})
+        newdirs = {}
+        if os.path.isdir(root):
+            self._refresh_dir(root, "", olddirs, newdirs)
+        self._dirs[root] = newdirs
+
+    def _refresh_dir(self, root, reldir, olddirs, newdirs):
+        path = os.path.join(root, reldir)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            # disappeared since its parent was listed
+            return
+
+        ent = olddirs.get(reldir)
+        if ent is not None and ent['mtime'] == mtime:
+            # the list of entries has not changed
+            if self.cfg.get('check_file_changes', True):
+                self._restat(path, ent['files'])
+        else:
+            ent = self._list_dir(path, mtime)
+            if ent is None:
+                return
+
+        newdirs[reldir] = ent
+        for d in ent['dirs']:
+            self._refresh_dir(root, os.path.join(reldir, d), olddirs, newdirs)
+
+    def _list_dir(self, path, mtime):
+        if time.time() - mtime < MTIME_SETTLE_TIME:
+            # don't trust this mtime next time
+            mtime = None
+        ent = { "mtime": mtime, "dirs": [], "files": {} }
+        try:
+            names = os.listdir(path)
+        except OSError, ex:
+            log.warning("Unable to list input directory, %s: %s", path, str(ex))
+            return None
+
+        for name in names:
+            if _ignorable(name):
+                continue
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                ent['dirs'].append(name)
+            elif stat.S_ISREG(st.st_mode):
+                ent['files'][name] = [st.st_size, st.st_mtime]
+        ent['dirs'].sort()
+        return ent
+
+    def _restat(self, path, files):
+        for name in files.keys():
+            try:
+                st = os.stat(os.path.join(path, name))
+                files[name] = [st.st_size, st.st_mtime]
+            except OSError:
+                del files[name]
+
+    def _collate(self):
+        # merge the roots' contents into a single view; later roots take
+        # precedence
+        out = {}
+        for root in self.roots:
+            for reldir, ent in self._dirs.get(root, {}).items():
+                for name, stat in ent['files'].items():
+                    fp = os.path.join(reldir, name)
+                    if fp in self.exclude:
+                        continue
+                    out[fp] = [os.path.join(root, fp)] + list(stat)
+        return out
@@ -9,12 +9,16 @@ process for the preservation service.
 
 The implementations use the BagBuilder class to populate the output bag.   
 """
-import os, errno, logging, re, json, shutil
+import os, errno, logging, re, json, shutil, hashlib, time
+from collections import Mapping
+from multiprocessing.pool import ThreadPool
 from abc import ABCMeta, abstractmethod, abstractproperty
 
 from .base import SIPBagger, moddate_of, checksum_of, read_nerd, read_pod
 from .base import sys as _sys
+from .inventory import SIPInventory, MTIME_SETTLE_TIME
 from ..bagit.builder import BagBuilder, NERDMD_FILENAME, FILEMD_FILENAME
+from ...checksum import ChecksumCache, DEF_CHECKSUM_CACHE_FILE, _mtime_ns
 from ... import def_merge_etcdir, utils
 from .. import (SIPDirectoryError, SIPDirectoryNotFound, AIPValidationError,
                 ConfigurationException, StateException, PODError)
@@ -38,6 +42,41 @@ def _midadid_to_dirname(midasid, log=None):
         log.warn("Unexpected MIDAS ID (too short): "+midasid)
     return out
 
+def _open_checksum_cache(workdir, config):
+    # open the persistent checksum cache shared by the metadata and 
+    # preservation baggers; return None if it has been disabled.
+    if config is None:
+        config = {}
+    if not config.get('enabled', True) or not os.path.isdir(workdir):
+        return None
+    dbfile = os.path.join(workdir, config.get('dbfile', DEF_CHECKSUM_CACHE_FILE))
+    return ChecksumCache(dbfile, config)
+
+def fingerprint_of(sippaths, bagpaths):
+    """
+    return a hash of the status (size, modification time, and inode) of the
+    given files and directories (see MIDASMetadataBagger.sip_fingerprint()),
+    or None if one of the SIP paths was modified too recently for its status
+    to be trusted.
+    """
+    now = time.time()
+    fp = hashlib.sha256()
+    for path, insip in [(p, True) for p in sippaths] + \
+                       [(p, False) for p in bagpaths]:
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        try:
+            st = os.stat(path)
+        except OSError:
+            fp.update("{0} -\n".format(path))
+            continue
+        if insip and now - st.st_mtime < MTIME_SETTLE_TIME:
+            # this may yet change without changing its mtime
+            return None
+        fp.update("{0} {1} {2} {3}\n".format(path, st.st_size, _mtime_ns(st),
+                                             st.st_ino))
+    return fp.hexdigest()
+
 class MIDASMetadataBagger(SIPBagger):
     """
     This class will migrate metadata provided by MIDAS into a working bag
@@ -64,7 +103,31 @@ class MIDASMetadataBagger(SIPBagger):
                                  found, in order of preference.  
     :prop update_by_checksum_size_lim int (0):  a size limit in bytes for which 
                                  files less than this will be checked to see 
-                                 if it has changed (not yet implemented).
+                                 if it has changed by comparing its checksum 
+                                 with the recorded one (even when its 
+                                 modification time is not later than its 
+                                 metadata's).  Larger files are only 
+                                 considered changed if their size differs.
+    :prop examine_workers int (1):  the number of threads to use to examine
+                                 the input data files when updating their 
+                                 metadata; the updated metadata is still 
+                                 written to the bag in a deterministic order.
+    :prop checksum_cache dict ({}):  a set of parameters for the persistent 
+                                 cache of data file checksums kept in the 
+                                 metadata working directory (see 
+                                 nistoar.pdr.checksum.ChecksumCache); in 
+                                 addition, "enabled" (default: True) turns 
+                                 the cache on or off and "dbfile" (default:
+                                 "_checksums.sqlite") sets the name of the 
+                                 cache's database file.
+    :prop sip_inventory dict ({}):  a set of parameters for the inventory of
+                                 the files in the input directories (see 
+                                 nistoar.pdr.preserv.bagger.inventory.
+                                 SIPInventory); in addition, "snapshot" 
+                                 (default: True) controls whether a snapshot
+                                 of the inventory is saved next to the output
+                                 bag so that only changed input directories
+                                 need be rescanned.
     :prop conponent_merge_convention str ("dev"): the merge convention name to 
                                  use to merge MIDAS-provided component metadata
                                  with the PDR's initial component metadata.
@@ -131,10 +194,13 @@ class MIDASMetadataBagger(SIPBagger):
                 raise SIPDirectoryNotFound(msg="No matching SIP available",
                                            sys=self)
 
+        self.cksumcache = _open_checksum_cache(self.bagparent,
+                                               self.cfg.get('checksum_cache'))
         self.bagbldr = BagBuilder(self.bagparent, self.name,
                                   self.cfg.get('bag_builder', {}),
                                   minter=minter,
-                                  logger=log.getChild(self.name[:8]+'...'))
+                                  logger=log.getChild(self.name[:8]+'...'),
+                                  cksumcache=self.cksumcache)
         mergeetc = self.cfg.get('merge_etc', def_merge_etcdir)
         if not mergeetc:
             raise StateException("Unable to locate the merge configuration "+
@@ -145,6 +211,9 @@ class MIDASMetadataBagger(SIPBagger):
         self.inpodfile = None
         self.resmd = None
         self.datafiles = None
+        self.datafile_changes = None
+        self._inventory = None
+        self._compidx = {}
 
         self.ensure_bag_parent_dir()
 
@@ -191,7 +260,9 @@ class MIDASMetadataBagger(SIPBagger):
         if not update:
             # we'll double check with the checksum in case mod dates are
             # not accurate
-            update = checksum_of(self.inpodfile) != checksum_of(outpod)
+            cksum = self.bagbldr.checksummer
+            update = cksum.checksum_of(self.inpodfile) != \
+                     cksum.checksum_of(outpod)
             if update:
                 log.info("Detected change in POD file (by checksum); updating.")
 
@@ -204,43 +275,125 @@ class MIDASMetadataBagger(SIPBagger):
                                                  savefilemd=True)
         else:
             self.resmd = read_nerd(outnerd)
+        self._compidx = self._index_components(self.resmd)
+
+    def _index_components(self, resmd):
+        # map filepaths to the components in the given resource metadata
+        out = {}
+        if resmd:
+            for comp in resmd.get('components', []):
+                if 'filepath' in comp:
+                    out.setdefault(comp['filepath'], comp)
+        return out
+
+    def component_for(self, filepath):
+        """
+        return the component metadata from the resource metadata that 
+        describes the file with the given filepath, or None if there is no 
+        such component.  This reflects any updates made to the component 
+        during preparation.
+        """
+        return self._compidx.get(filepath)
+
+    @property
+    def inventory_file(self):
+        """
+        The path to the file where the snapshot of the input directories' 
+        inventory is saved.
+        """
+        return self.bagdir + ".inventory.json"
+
+    @property
+    def inventory(self):
+        """
+        The SIPInventory instance tracking the files in the input directories
+        """
+        if not self._inventory:
+            cfg = self.cfg.get('sip_inventory', {})
+            snapfile = None
+            if cfg.get('snapshot', True):
+                snapfile = self.inventory_file
+            podlocs = self.cfg.get('pod_locations', [ DEF_MIDAS_POD_FILE ])
+            self._inventory = SIPInventory(self._indirs, snapfile, podlocs, cfg)
+        return self._inventory
+
+    def recall_preparation(self):
+        """
+        restore the results of the last preparation of the bag--namely, the 
+        datafiles property--from the saved inventory of the input directories
+        without examining the SIP again.  This is appropriate when the bag is 
+        known to have just been prepared (e.g. by another process).  
+
+        :return bool:  False if there is no saved preparation to recall
+        """
+        if not os.path.isdir(self.bagdir) or not self.inventory.restored:
+            return False
+        self.datafiles = self.inventory.files()
+        return True
+
+    def sip_fingerprint(self):
+        """
+        return a hash that summarizes the state of the SIP and of the bag
+        prepared from it.  It is calculated from the status (size, 
+        modification time, and inode) of the POD file, of the input 
+        directories and data files recorded in the saved inventory, and of 
+        the bag's resource metadata and component index.  Thus, it will 
+        change when files are added to, removed from, or rewritten in the 
+        SIP or when the POD file or bag is updated.  Note that checking a 
+        fingerprint requires a stat of each data file.  
+
+        :return str:  the fingerprint, or None if a reliable one cannot be 
+                      formed (e.g. the bag has not been prepared yet or a 
+                      directory was modified too recently).
+        """
+        paths = self.sip_fingerprint_paths()
+        if not paths:
+            return None
+        return fingerprint_of(*paths)
+
+    def sip_fingerprint_paths(self):
+        """
+        return the paths whose status go into the SIP fingerprint (see 
+        sip_fingerprint()) as a 2-tuple:  the list of paths from the SIP 
+        and the list of paths from the bag.  Because any change to the SIP's
+        contents changes the status of one of these paths, the fingerprint 
+        can be checked later just by passing these to fingerprint_of().  
+        None is returned if the bag has not been prepared yet.
+        """
+        snapfile = self.inventory.snapfile
+        if not os.path.isdir(self.bagdir) or \
+           not (snapfile and os.path.exists(snapfile)):
+            return None
+        try:
+            sippaths = [ self.find_pod_file() ]
+        except PODError:
+            return None
+        sippaths += sorted(set(self.inventory.roots) |
+                           set(self.inventory.dir_mtimes().keys()))
+        sippaths += sorted(self.inventory.files().values())
+        bagpaths = [ self.bagbldr.nerdm_file_for(""),
+                     self.bagbldr.comp_index.indexfile ]
+        return (sippaths, bagpaths)
 
     def data_file_inventory(self):
         """
         get a list of the data files available to be part of this dataset.
-        This will include any accompanying hash files.
+        This will include any accompanying hash files.  As a side effect, 
+        the changes to the input directories since the last time the bag was
+        prepared are saved to the datafile_changes property (as returned by
+        SIPInventory.refresh()).  
 
         :return dict: a mapping of logical filepaths relative to the dataset 
                       root to full paths to the input data file for all data
                       files found in the SIP.
         """
-        podlocs = self.cfg.get('pod_locations', [ DEF_MIDAS_POD_FILE ])
-        datafiles = {}
-
-        # check each of the possible locations; locations found later take
-        # precedence
-        for root in self._indirs:
-            root = root.rstrip('/')
-            for dir, subdirs, files in os.walk(root):
-                reldir = dir[len(root)+1:]
-                for f in files:
-                    # don't descend into subdirectories with ignorable names
-                    for d in range(len(subdirs)-1, -1, -1):
-                        if subdirs[d].startswith('.') or \
-                           subdirs[d].startswith('_'):
-                            del subdirs[d]
-                    
-                    if f.startswith('.') or f.startswith('_') or \
-                       os.path.join(reldir,f) in podlocs:
-                        # skip dot-files and pod files written by MIDAS
-                        continue
-
-                    datafiles[os.path.join(reldir, f)] = os.path.join(dir, f)
-
-        return datafiles
+        # files found in later locations take precedence; dot-files and the
+        # pod files written by MIDAS are skipped.  
+        self.datafile_changes = self.inventory.refresh()
+        return self.inventory.files()
 
     def ensure_file_metadata(self, inpath, destpath, resmd=None,
-                             disttype="DataFile"):
+                             disttype="DataFile", checksum=None):
         """
         examine the given file and update the file metadata if necessary.
 
@@ -260,48 +413,107 @@ class MIDASMetadataBagger(SIPBagger):
                               the file (with the default default being 
                               "DataFile"); if examine is True, the type may 
                               change based on inspection of the file.  
-        """
+        :param checksum str or dict:  a previously calculated SHA-256 hash 
+                              of the input file (or a dictionary mapping 
+                              algorithm names to hashes); if provided, the 
+                              file will not be read again to calculate it.
+        """
+        hash = checksum
+        if isinstance(hash, Mapping):
+            hash = hash.get(DEF_CHECKSUM_ALG)
+        update, nerd = self._check_file_metadata(inpath, destpath, resmd,
+                                                 checksum=hash)
+        if update:
+            self._update_file_metadata(inpath, destpath, nerd, disttype,
+                                       checksum)
+
+    def _check_file_metadata(self, inpath, destpath, resmd=None, changed=True,
+                             checksum=None):
+        # determine whether the metadata for a file needs to be updated.
+        # Returned is a 2-tuple of the answer (bool) and the applicable
+        # component metadata from resmd (or None if there is none).  If 
+        # changed=False, the input file is known not to have changed since
+        # its metadata was last updated.  checksum, if given, is the already
+        # calculated (sha256) hash of the input file.  Even then, the 
+        # recorded size and checksum are checked so that metadata that is 
+        # incomplete or wrong gets repaired.
         nerdfile = self.bagbldr.nerdm_file_for(destpath)
 
         update = False
         if not os.path.exists(nerdfile):
             update = True
             log.info("Initializing metadata for datafile, %s", destpath)
-        elif moddate_of(inpath) > moddate_of(nerdfile):
+        elif changed and moddate_of(inpath) > moddate_of(nerdfile):
             # data file is newer; update its metadata
             update = True
             log.info("Detected change in data file (by date); updating %s",
                      destpath)
-        elif os.stat(inpath).st_size \
-             < self.cfg.get('update_by_checksum_size_lim', 0):
-            # not implemented yet
-            pass
+        else:
+            # the file's date may have been preserved from an earlier
+            # version (e.g. by rsync -t); compare against what was recorded
+            recorded = self.bagbldr.comp_index.get(destpath, {})
+            size = os.stat(inpath).st_size
+            if 'size' not in recorded or not recorded.get('checksum'):
+                update = True
+                log.info("Completing metadata for data file, %s", destpath)
+            elif size != recorded['size']:
+                update = True
+                log.info("Detected change in data file (by size); updating %s",
+                         destpath)
+            elif changed and \
+                 size < self.cfg.get('update_by_checksum_size_lim', 0):
+                if not checksum:
+                    checksum = self.bagbldr.checksummer.checksum_of(inpath)
+                if checksum != recorded.get('checksum'):
+                    update = True
+                    log.info("Detected change in data file (by checksum); "+
+                             "updating %s", destpath)
 
         nerd = None
         if resmd:
             # look for applicable metadata in the resource metadata
-            comps = resmd.get('components', [])
-            match = [c for c in comps if 'filepath' in c and
-                                         c['filepath'] == destpath]
-            if match:
-                nerd = match[0]
+            if resmd is self.resmd:
+                nerd = self.component_for(destpath)
+            else:
+                nerd = self._index_components(resmd).get(destpath)
+            if nerd:
                 missing = [k for k in "size mediaType checksum".split()
                              if k not in nerd.keys()]
                 if missing:
                     update = True
                     log.info("Extending file metadata for %s", destpath)
-        
-        if update:
-            init = self.bagbldr.init_filemd_for(destpath, examine=inpath,
-                                                disttype=disttype)
-            if nerd:
-                conv = self.cfg.get('component_merge_convention', 'dev')
-                merger = self._merger_for(conv, "DataFile")
-                nerd = merger.merge(nerd, init)
-            else:
-                nerd = init
 
-            self.bagbldr.add_metadata_for_file(destpath, nerd, disttype=disttype)
+        return (update, nerd)
+
+    def _update_file_metadata(self, inpath, destpath, nerd, disttype,
+                              checksum=None):
+        nerd, tree = self._make_file_metadata(inpath, destpath, nerd, disttype,
+                                              checksum)
+        self._save_file_metadata(destpath, nerd, disttype, tree)
+
+    def _make_file_metadata(self, inpath, destpath, nerd, disttype,
+                            checksum=None):
+        # examine the input file and merge the result with the given
+        # metadata; nothing is written to the bag (or its log), so this can
+        # be done concurrently for different files.  Returned with the 
+        # metadata is the tree hash to save with it, if any.
+        init, tree = self.bagbldr.examine_filemd_for(destpath, inpath,
+                                                     disttype, checksum)
+        if nerd:
+            conv = self.cfg.get('component_merge_convention', 'dev')
+            merger = self._merger_for(conv, "DataFile")
+            nerd = merger.merge(nerd, init)
+        else:
+            nerd = init
+        return (nerd, tree)
+
+    def _save_file_metadata(self, destpath, nerd, disttype, tree=None):
+        self.bagbldr.record("Initializing metadata for file %s", destpath)
+        if tree:
+            self.bagbldr.save_tree_hash(destpath, tree)
+        self.bagbldr.add_metadata_for_file(destpath, nerd, disttype=disttype)
+        if self.resmd is not None:
+            self._compidx[destpath] = nerd
 
     def _merger_for(self, convention, objtype):
         return self._merger_factory.make_merger(convention, objtype)
@@ -345,6 +557,10 @@ class MIDASMetadataBagger(SIPBagger):
         """
         self.bagbldr.ensure_bag_structure()
 
+        # pick up any changes made to the component metadata outside of the
+        # builder before relying on the component index
+        self.bagbldr.comp_index.validate()
+
         # get the list of data files found in the input directories
         self.datafiles = self.data_file_inventory()
 
@@ -353,29 +569,35 @@ class MIDASMetadataBagger(SIPBagger):
         # for this we need a list of data files described in the POD record;
         # distribution records have not necessarily been created for files
         # currently in the input directories (i.e. those in self.datafiles)
-        fdists = self.pod_file_distribs()
+        fdists = set(self.pod_file_distribs())
 
         # what files are in the bag now but not in the input area and
         # were not enumerated in the input POD file?
         remove = set()
-        mdatadir = os.path.join(self.bagdir,"metadata")
-        for dir, subdirs, files in os.walk(mdatadir):
-            if dir == mdatadir:
-                continue
-            if NERDMD_FILENAME in files:
-                filepath = dir[len(mdatadir)+1:]
-                if filepath not in self.datafiles and \
-                   filepath not in fdists:
-                    # found a component with this filepath, but is it a datafile?
-                    mdata = read_nerd(os.path.join(dir,NERDMD_FILENAME))
-                    comptypes = mdata.get("@type", [])
-                    if any([":DownloadableFile" in t for t in comptypes]):
-                        # yes, it is a data file
-                        log.debug("Will remove dropped data file: %s", filepath)
-                        remove.add(filepath)
-
-        # add all the files from the input area
-        for destpath, inpath in self.datafiles.items():
+        for filepath in \
+                self.bagbldr.comp_index.filepaths_of_type(":DownloadableFile"):
+            if filepath not in self.datafiles and filepath not in fdists:
+                log.debug("Will remove dropped data file: %s", filepath)
+                remove.add(filepath)
+
+        # determine which of the files from the input area need their
+        # metadata updated; unless this is the first time we've seen the 
+        # input directories, only the new and modified files need checking.
+        changed = self.datafiles
+        if self.inventory.restored:
+            changed = self.datafile_changes['added'] | \
+                      self.datafile_changes['modified']
+        # files small enough to be checked for changes by their checksums
+        # get hashed up front, all at once
+        lim = self.cfg.get('update_by_checksum_size_lim', 0)
+        batch = [inpath for destpath, inpath in self.datafiles.items()
+                        if destpath in changed and
+                           os.stat(inpath).st_size < lim and
+                           os.path.exists(self.bagbldr.nerdm_file_for(destpath))]
+        sums = dict(self.bagbldr.checksummer.iter_digests(batch))
+
+        todo = []
+        for destpath, inpath in sorted(self.datafiles.items()):
             disttype = "DataFile"
             if destpath.endswith('.'+DEF_CHECKSUM_ALG) and \
                os.path.splitext(destpath)[0] in self.datafiles:
@@ -388,9 +610,24 @@ class MIDASMetadataBagger(SIPBagger):
             else:
                 log.debug("Adding submitted data file: %s", destpath)
 
-            self.ensure_file_metadata(inpath, destpath, self.resmd, disttype)
+            hash = sums.get(inpath, {}).get(DEF_CHECKSUM_ALG)
+            update, nerd = self._check_file_metadata(inpath, destpath,
+                                                     self.resmd,
+                                                     destpath in changed, hash)
+            todo.append( (destpath, inpath, disttype, update, nerd) )
+
+        # calculate the checksums of the updated files all at once
+        # (files needing tree hashes are left to be hashed individually)
+        batch = [t[1] for t in todo if t[3] and t[1] not in sums and
+                 not self.bagbldr.wants_tree_hash(os.stat(t[1]).st_size)]
+        sums.update(self.bagbldr.checksummer.iter_digests(batch))
 
-            if not nodata:
+        # update the metadata for the files that need it
+        self._update_files_metadata([t for t in todo if t[3]], sums)
+
+        # add all the files from the input area
+        if not nodata:
+            for destpath, inpath, disttype, update, nerd in todo:
                 self.bagbldr.add_data_file(destpath, inpath,
                                            self.hardlinkdata, initmd=False)
 
@@ -400,16 +637,44 @@ class MIDASMetadataBagger(SIPBagger):
 
         self._check_checksum_files()
 
+        # the bag now reflects the current inventory; save it for next time
+        self.inventory.save()
+
+    def _update_files_metadata(self, todo, sums):
+        # examine the files described in todo and save their updated
+        # metadata.  With more than one worker configured, the files are 
+        # examined concurrently while the results--the metadata and any tree
+        # hashes--are saved (by this thread) in the same order as todo, so 
+        # that the bag comes out the same as it would when done serially.
+        def examine(t):
+            return self._make_file_metadata(t[1], t[0], t[4], t[2],
+                                            sums.get(t[1]))
+
+        nworkers = min(self.cfg.get('examine_workers', 1), len(todo))
+        if nworkers < 2:
+            for t in todo:
+                nerd, tree = examine(t)
+                self._save_file_metadata(t[0], nerd, t[2], tree)
+            return
+
+        pool = ThreadPool(nworkers)
+        try:
+            for t, (nerd, tree) in zip(todo, pool.imap(examine, todo)):
+                self._save_file_metadata(t[0], nerd, t[2], tree)
+        finally:
+            pool.terminate()
+            pool.join()
+
     def _check_checksum_files(self):
         # This file will look all of the files that have been identified as
         # ChecksumFiles to see if the value they contain matches the value
         # stored in the metadata for the datafile it is associated with.  If
         # they do not match, the valid metadata flag for the checksum file
         # will be set to false.
+        compidx = self.bagbldr.comp_index
         for df in self.datafiles:
-            csnerdf = self.bagbldr.nerdm_file_for(df)
-            csnerd = read_nerd(csnerdf)
-            if any([":ChecksumFile" in t for t in csnerd.get("@type",[])]):
+            csent = compidx.get(df)
+            if csent and any([":ChecksumFile" in t for t in csent["@type"]]):
                 dfpath = self.datafiles[df]
                 try:
                     with open(dfpath) as fd:
@@ -420,18 +685,19 @@ class MIDASMetadataBagger(SIPBagger):
                     continue
 
                 # this data file is a checksum file
-                described = csnerd.get("describes","cmps/")[5:]
+                described = csent.get("describes","cmps/")[5:]
                 if described in self.datafiles:
-                    nerdf = self.bagbldr.nerdm_file_for(described)
-                    nerd = read_nerd(nerdf)
-
-                    if nerd.get('checksum',{}).get('hash','') == cs:
+                    valid = compidx.get(described, {}).get('checksum','') == cs
+                    if valid:
                         log.debug(df+": hash value looks valid")
-                        csnerd['valid'] = True
                     else:
                         log.warn(df+": hash value in file looks invalid")
-                        csnerd['valid'] = False
-                    self.bagbldr._write_json(csnerd, csnerdf)
+
+                    if csent.get('valid') != valid:
+                        csnerdf = self.bagbldr.nerdm_file_for(df)
+                        csnerd = read_nerd(csnerdf)
+                        csnerd['valid'] = valid
+                        self.bagbldr._write_json(csnerd, csnerdf)
 
     def pod_file_distribs(self):
         """
@@ -478,7 +744,31 @@ class PreservationBagger(SIPBagger):
                                  found, in order of preference.  
     :prop update_by_checksum_size_lim int (0):  a size limit in bytes for which 
                                  files less than this will be checked to see 
-                                 if it has changed (not yet implemented).
+                                 if it has changed by comparing its checksum 
+                                 with the recorded one (even when its 
+                                 modification time is not later than its 
+                                 metadata's).  Larger files are only 
+                                 considered changed if their size differs.
+    :prop examine_workers int (1):  the number of threads to use to examine
+                                 the input data files when updating their 
+                                 metadata; the updated metadata is still 
+                                 written to the bag in a deterministic order.
+    :prop checksum_cache dict ({}):  a set of parameters for the persistent 
+                                 cache of data file checksums kept in the 
+                                 metadata working directory (see 
+                                 nistoar.pdr.checksum.ChecksumCache); in 
+                                 addition, "enabled" (default: True) turns 
+                                 the cache on or off and "dbfile" (default:
+                                 "_checksums.sqlite") sets the name of the 
+                                 cache's database file.
+    :prop sip_inventory dict ({}):  a set of parameters for the inventory of
+                                 the files in the input directories (see 
+                                 nistoar.pdr.preserv.bagger.inventory.
+                                 SIPInventory); in addition, "snapshot" 
+                                 (default: True) controls whether a snapshot
+                                 of the inventory is saved next to the output
+                                 bag so that only changed input directories
+                                 need be rescanned.
     :prop conponent_merge_convention str ("dev"): the merge convention name to 
                                  use to merge MIDAS-provided component metadata
                                  with the PDR's initial component metadata.
@@ -548,11 +838,15 @@ class PreservationBagger(SIPBagger):
             self.bagparent = os.path.join(self.indir, self.bagparent)
         self.ensure_bag_parent_dir()
 
+        # share the checksum cache kept alongside the metadata bag
+        self.cksumcache = _open_checksum_cache(self.mddir,
+                                               self.cfg.get('checksum_cache'))
         self.bagbldr = BagBuilder(self.bagparent,
                                   self.form_bag_name(self.name),
                                   self.cfg.get('bag_builder', {}),
                                   minter=minter,
-                                  logger=log.getChild(self.name[:8]+'...'))
+                                  logger=log.getChild(self.name[:8]+'...'),
+                                  cksumcache=self.cksumcache)
         
 
     @property
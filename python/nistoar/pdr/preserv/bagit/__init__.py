@@ -4,5 +4,6 @@ Support for the NIST Bagit Profile
 from .. import (PDRException, SIPDirectoryError, SIPDirectoryNotFound, 
                 ConfigurationException, StateException, PODError, NERDError)
 from bag import NISTBag
+from zipbag import ZipNISTBag
 from builder import BagBuilder
 
@@ -4,21 +4,28 @@ Tools for reading data from a bag
 
 import os, logging, re, json, hashlib
 from collections import OrderedDict
+from copy import deepcopy
 
-from .. import PreservationSystem, read_nerd, read_pod
+from .. import PreservationSystem, read_nerd, read_pod, sys as _sys
 from .. import NERDError, PODError, StateException
 from .exceptions import BadBagRequest, ComponentNotFound, BagFormatError
 from ... import def_jq_libdir, def_merge_etcdir
 from ....nerdm.merge import MergerFactory, Merger
-from ....nerdm.convert import ComponentCounter, HierarchyBuilder
+from .inventory import ComponentInventory
+from ...checksum import _mtime_ns
 
 POD_FILENAME = "pod.json"
 NERDMD_FILENAME = "nerdm.json"
 ANNOTS_FILENAME = "annot.json"
 DEFAULT_MERGE_CONVENTION = "dev"
+RECORD_CACHE_FILENAME = "nerdm_record_cache.json"
+RECORD_CACHE_FORMAT_VERSION = 1
+STREAM_CHUNK_SIZE = 64 * 1024
 
 JQLIB = def_jq_libdir
 
+log = logging.getLogger(_sys.system_abbrev).getChild(_sys.subsystem_abbrev)
+
 class NISTBag(PreservationSystem):
     """
     an interface for reading data in a NIST-compliant BagIt bag.
@@ -26,7 +33,31 @@ class NISTBag(PreservationSystem):
 
     # NOTE: this is an incomplete implementation 
 
-    def __init__(self, rootdir, merge_annots=False):
+    def __init__(self, rootdir, merge_annots=False, cache_record=False,
+                 index=False):
+        """
+        open the bag for reading
+
+        :param rootdir       str:  the root directory of the bag
+        :param merge_annots bool:  the default value for the merge_annots 
+                                   argument to nerd_metadata_for() and
+                                   nerdm_record()
+        :param cache_record bool:  if True, nerdm_record() will save the 
+                                   record it assembles along with the 
+                                   component metadata it was assembled from
+                                   into a tag file (named by 
+                                   RECORD_CACHE_FILENAME) for reuse by later
+                                   calls.  This should only be used with 
+                                   bags that are still being built.  
+        :param index        bool:  if True, the structure of the bag's data 
+                                   and metadata trees will be loaded into 
+                                   memory (when first needed) so that 
+                                   comp_exists(), is_data_file(), is_subcoll(),
+                                   and subcoll_children() do not need to 
+                                   consult the filesystem.  The caller must
+                                   call invalidate_index() after changing the
+                                   contents of the bag.  
+        """
         if not os.path.isdir(rootdir):
             raise StateException("Bag directory does not exist as a directory: "+
                                  rootdir, sys=self)
@@ -40,6 +71,9 @@ class NISTBag(PreservationSystem):
         self._mbagdir = None
 
         self._mergeannots = merge_annots
+        self._cacherec = cache_record
+        self._useindex = index
+        self._index = None
 
     @property
     def dir(self):
@@ -120,6 +154,17 @@ class NISTBag(PreservationSystem):
         """
         return bool(self.get_baginfo().get("Multibag-Head-Version",[""])[-1])
 
+    def _exists(self, path):
+        # return True if the given file exists in the bag
+        return os.path.exists(path)
+
+    def _walk(self, top):
+        # iterate through a directory tree in the bag (as with os.walk())
+        return os.walk(top)
+
+    def _walk_metadata(self):
+        return self._walk(self._metadir)
+
     def pod_file(self):
         return os.path.join(self._metadir, POD_FILENAME)
 
@@ -142,7 +187,7 @@ class NISTBag(PreservationSystem):
                                    annotations.
         """
         nerdfile = self.nerd_file_for(filepath)
-        if not os.path.exists(nerdfile):
+        if not self._exists(nerdfile):
           raise ComponentNotFound("Component not found: " + filepath, 
                                   os.path.basename(self._name))
         out = self.read_nerd(nerdfile)
@@ -150,7 +195,7 @@ class NISTBag(PreservationSystem):
         if merge_annots is None:
             merge_annots = self._mergeannots
         annotfile = os.path.join(os.path.dirname(nerdfile), ANNOTS_FILENAME)
-        if merge_annots and os.path.exists(annotfile):
+        if merge_annots and self._exists(annotfile):
             if merge_annots is True:
                 merge_annots = DEFAULT_MERGE_CONVENTION
             compmerger = MergerFactory.make_merger(merge_annots, 'Component')
@@ -169,6 +214,12 @@ class NISTBag(PreservationSystem):
         """
         return a full NERDm resource record for the data in this bag.
 
+        If this bag was opened with cache_record=True, the record will be 
+        assembled with the help of the record cache file:  metadata files 
+        that have not changed since the cache was written will not be read 
+        again, and if none have changed, the inventory and hierarchy will not
+        be recalculated.  
+
         :param merge_annots bool:  merge in any annotation data found in the bag.
                                    (Default is the value of the 'merge_annots'
                                    constructor argument.)  For a complete bag,
@@ -181,12 +232,15 @@ class NISTBag(PreservationSystem):
             merge_annots = self._mergeannots
         if merge_annots is True:
             merge_annots = DEFAULT_MERGE_CONVENTION
+        if self._cacherec:
+            return self._cached_nerdm_record(merge_annots)
+
         compmerger = None
         if merge_annots:
             compmerger = MergerFactory.make_merger(merge_annots, 'Component')
 
         out = None
-        for root, subdirs, files in os.walk(self._metadir):
+        for root, subdirs, files in self._walk_metadata():
             if root == self._metadir:
                 out = self.nerd_metadata_for("")
                 if 'components' not in out:
@@ -194,9 +248,9 @@ class NISTBag(PreservationSystem):
 
                 if merge_annots:
                     annotfile = os.path.join(root,ANNOTS_FILENAME)
-                    if os.path.exists(annotfile):
+                    if self._exists(annotfile):
                         annots = self.read_nerd(annotfile)
-                        merger = MergerFactory.make_merger(merger_annots,
+                        merger = MergerFactory.make_merger(merge_annots,
                                                            'Resource')
                         out = merger.merge(out, annots)
 
@@ -205,7 +259,7 @@ class NISTBag(PreservationSystem):
 
                 if merge_annots:
                     annotfile = os.path.join(root,ANNOTS_FILENAME)
-                    if os.path.exists(annotfile):
+                    if self._exists(annotfile):
                         annots = self.read_nerd(annotfile)
                         comp = compmerger.merge(comp, annots)
 
@@ -217,6 +271,229 @@ class NISTBag(PreservationSystem):
         
         return out
 
+    def iter_nerdm_record(self, merge_annots=None, comp_filter=None,
+                          chunksize=STREAM_CHUNK_SIZE):
+        """
+        return an iterator that produces the full NERDm resource record for
+        the data in this bag serialized as compact JSON in a series of 
+        string chunks.  Concatenated, the chunks are the same as the output 
+        of nerdm_record() serialized with json.dumps() (with 
+        separators=(',',':')); however, only one component's metadata is 
+        held in memory at a time.  The resource-level properties are 
+        produced first, then the components (in the order they are read 
+        from the bag), and finally the inventory and the data hierarchy.  
+
+        :param merge_annots bool:  merge in any annotation data found in the 
+                                   bag (see nerdm_record()).
+        :param comp_filter callable:  a function that, if provided, is 
+                                   called with the metadata (a dict) for each
+                                   component just before it is serialized; it
+                                   may update the metadata in place.  
+        :param chunksize int:      the minimum size of each chunk (except the
+                                   last)
+        """
+        if merge_annots is None:
+            merge_annots = self._mergeannots
+        if merge_annots is True:
+            merge_annots = DEFAULT_MERGE_CONVENTION
+        compmerger = None
+        if merge_annots:
+            compmerger = MergerFactory.make_merger(merge_annots, 'Component')
+
+        res = self.nerd_metadata_for("", False)
+        if 'components' not in res:
+            res['components'] = []
+        annotfile = os.path.join(self._metadir, ANNOTS_FILENAME)
+        if merge_annots and self._exists(annotfile):
+            merger = MergerFactory.make_merger(merge_annots, 'Resource')
+            res = merger.merge(res, self.read_nerd(annotfile))
+        if 'dataHierarchy' in res:
+            del res['dataHierarchy']
+
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        inv = ComponentInventory()
+        buf = []
+        bufsize = 0
+        sep = '{'
+        for prop, val in res.items():
+            buf.append(sep + encode(prop) + ':')
+            sep = ','
+            if prop != 'components':
+                buf.append(encode(val))
+                continue
+
+            # components are read and serialized one at a time
+            compsep = '['
+            for comp in self._iter_components(val, compmerger):
+                if comp_filter:
+                    comp_filter(comp)
+                inv.add(comp)
+                buf.append(compsep + encode(comp))
+                compsep = ','
+                bufsize += len(buf[-1])
+                if bufsize >= chunksize:
+                    yield "".join(buf)
+                    buf = []
+                    bufsize = 0
+            if compsep == '[':
+                buf.append(compsep)
+            buf.append(']')
+
+        if 'inventory' not in res:
+            buf.append(',"inventory":' + encode(inv.inventory()))
+        hier = inv.hierarchy()
+        if hier:
+            buf.append(',"dataHierarchy":' + encode(hier))
+        buf.append('}')
+        yield "".join(buf)
+
+    def _iter_components(self, rootcomps, merger):
+        # iterate through the components listed in the resource-level 
+        # metadata followed by those described in the metadata directory
+        for comp in rootcomps:
+            yield comp
+        for root, subdirs, files in self._walk_metadata():
+            if root != self._metadir and NERDMD_FILENAME in files:
+                yield self._read_merged(root, merger)
+
+    @property
+    def record_cache_file(self):
+        """
+        the path to the file where the consolidated NERDm record is cached
+        """
+        return os.path.join(self._dir, RECORD_CACHE_FILENAME)
+
+    def _stat_vector(self, mdir, merge_annots):
+        # the (mtime, size, inode, ctime) of the metadata files for a
+        # component; like the ChecksumCache, this uses nanosecond mtimes,
+        # and the inode and ctime catch files that were replaced or
+        # rewritten with their times restored.
+        out = []
+        names = [NERDMD_FILENAME]
+        if merge_annots:
+            names.append(ANNOTS_FILENAME)
+        for name in names:
+            try:
+                st = os.stat(os.path.join(mdir, name))
+                out.append([_mtime_ns(st), st.st_size, st.st_ino,
+                            st.st_ctime])
+            except OSError:
+                out.append(None)
+        return out
+
+    def _load_record_cache(self, merge_annots):
+        try:
+            with open(self.record_cache_file) as fd:
+                cache = json.load(fd, object_pairs_hook=OrderedDict)
+            if cache.get('version') == RECORD_CACHE_FORMAT_VERSION and \
+               cache.get('merge_annots') == (merge_annots or None):
+                return cache
+        except (IOError, ValueError):
+            pass
+        return None
+
+    def _save_record_cache(self, cache):
+        tmpfile = "{0}.{1}.tmp".format(self.record_cache_file, os.getpid())
+        try:
+            with open(tmpfile, 'w') as fd:
+                json.dump(cache, fd, separators=(',', ':'))
+            os.rename(tmpfile, self.record_cache_file)
+        except (IOError, OSError), ex:
+            log.warning("Unable to write NERDm record cache for bag, %s: %s",
+                        self.name, str(ex))
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+
+    def _read_merged(self, mdir, merger):
+        # read the metadata in the given metadata directory, merging in its
+        # annotations if a merger is provided
+        out = self.read_nerd(os.path.join(mdir, NERDMD_FILENAME))
+        if merger:
+            annotfile = os.path.join(mdir, ANNOTS_FILENAME)
+            if self._exists(annotfile):
+                out = merger.merge(out, self.read_nerd(annotfile))
+        return out
+
+    def _cached_nerdm_record(self, merge_annots):
+        # assemble the NERDm record with the help of the record cache.  The
+        # cache holds the resource-level metadata, the metadata for each 
+        # component (keyed by its metadata directory), the status of the 
+        # files each was read from, and the computed inventory and hierarchy.
+        cache = self._load_record_cache(merge_annots)
+        if not cache:
+            cache = OrderedDict([("version", RECORD_CACHE_FORMAT_VERSION),
+                                 ("merge_annots", merge_annots or None),
+                                 ("resource", None), ("components", {}),
+                                 ("inventory", None), ("dataHierarchy", None)])
+        oldcomps = cache['components']
+
+        changed = False
+        mergers = {}
+        def merger_for(typ):
+            if not merge_annots:
+                return None
+            if typ not in mergers:
+                mergers[typ] = MergerFactory.make_merger(merge_annots, typ)
+            return mergers[typ]
+
+        # resource-level metadata
+        vec = self._stat_vector(self._metadir, merge_annots)
+        if not cache['resource'] or cache['resource']['stat'] != vec:
+            cache['resource'] = { "stat": vec,
+                                  "data": self.nerd_metadata_for("", False) }
+            if merge_annots and vec[1]:
+                cache['resource']['data'] = merger_for('Resource').merge(
+                    cache['resource']['data'],
+                    self.read_nerd(os.path.join(self._metadir,ANNOTS_FILENAME)))
+            changed = True
+
+        # component metadata:  only changed files are read
+        comps = OrderedDict()
+        for root, subdirs, files in self._walk_metadata():
+            if root == self._metadir or NERDMD_FILENAME not in files:
+                continue
+            key = os.path.relpath(root, self._metadir)
+            vec = self._stat_vector(root, merge_annots)
+            old = oldcomps.get(key)
+            if old and old['stat'] == vec:
+                comps[key] = old
+            else:
+                comps[key] = { "stat": vec,
+                               "data": self._read_merged(root,
+                                                     merger_for('Component')) }
+                changed = True
+        if len(comps) != len(oldcomps):
+            # something was removed
+            changed = True
+
+        out = deepcopy(cache['resource']['data'])
+        if 'components' not in out:
+            out['components'] = []
+        out['components'].extend([c['data'] for c in comps.values()])
+
+        if changed or cache['dataHierarchy'] is None:
+            if 'inventory' not in out:
+                self.update_inventory_in(out)
+            self.update_hierarchy_in(out)
+            cache['components'] = comps
+            cache['inventory'] = out.get('inventory')
+            cache['dataHierarchy'] = out.get('dataHierarchy', [])
+            self._save_record_cache(cache)
+        else:
+            if 'inventory' not in out:
+                out['inventory'] = cache['inventory']
+            if cache['dataHierarchy']:
+                out['dataHierarchy'] = cache['dataHierarchy']
+
+        return out
+
+    def discard_record_cache(self):
+        """
+        remove the cached NERDm record (if it exists)
+        """
+        if os.path.exists(self.record_cache_file):
+            os.remove(self.record_cache_file)
+
     @classmethod
     def update_inventory_in(cls, resmd):
         """
@@ -226,9 +503,8 @@ class NISTBag(PreservationSystem):
         resmd['inventory'] = {}
 
         if 'components' in resmd:
-            components = resmd['components']
-            cc = ComponentCounter(JQLIB)
-            resmd['inventory'] = cc.inventory(components)
+            inv = ComponentInventory(resmd['components'])
+            resmd['inventory'] = inv.inventory()
 
         return resmd
 
@@ -245,13 +521,43 @@ class NISTBag(PreservationSystem):
         if 'dataHierarchy' in resmd:
             del resmd['dataHierarchy']
         if 'components' in resmd:
-            hb = HierarchyBuilder(JQLIB)
-            hier = hb.build_hierarchy(resmd['components'])
+            hier = ComponentInventory(resmd['components']).hierarchy()
         if hier:
             resmd['dataHierarchy'] = hier
 
         return resmd
 
+    @property
+    def _structure(self):
+        # the index of the bag's structure, or None if indexing is not enabled
+        if not self._useindex:
+            return None
+        if self._index is None:
+            self._index = _BagStructure(self._datadir, self._metadir,
+                                        self._walk)
+        return self._index
+
+    def invalidate_index(self, comppath=None, subtree=True):
+        """
+        update the in-memory index of the bag's structure (if enabled) to 
+        reflect changes made to the bag.  This should be called after any 
+        data file, directory, or NERDm metadata file is added to or removed 
+        from the bag.  
+
+        :param comppath str:  the path to the component that was changed; 
+                              what is known about its ancestor collections 
+                              is updated as well.  If None, the entire index
+                              is discarded (to be rebuilt when next needed).
+        :param subtree bool:  if True, everything below the given component
+                              is also re-examined.  Set this to False if 
+                              only the component itself changed (e.g. a file
+                              or its metadata was written).  
+        """
+        if comppath is None:
+            self._index = None
+        elif self._index is not None:
+            self._index.refresh(comppath, subtree)
+
     def comp_exists(self, comppath):
         """
         return True if the given path points to an existing component.
@@ -261,6 +567,8 @@ class NISTBag(PreservationSystem):
         """
         if comppath == "":
             return True
+        if self._structure:
+            return self._structure.exists(comppath)
 
         path = self._full_dpath(comppath)
         if os.path.exists(path):
@@ -280,6 +588,13 @@ class NISTBag(PreservationSystem):
         if not comppath:
             return False
 
+        idx = self._structure
+        if idx:
+            if idx.is_file(comppath):
+                return True
+            types = idx.types_of(comppath, self.read_nerd)
+            return any([t for t in types if ':DataFile' in t])
+
         path = self._full_dpath(comppath)
         if os.path.isfile(path):
             return True
@@ -302,6 +617,13 @@ class NISTBag(PreservationSystem):
         if not comppath:
             return False
 
+        idx = self._structure
+        if idx:
+            if idx.is_dir(comppath):
+                return True
+            types = idx.types_of(comppath, self.read_nerd)
+            return any([t for t in types if ':Subcollection' in t])
+
         path = self._full_dpath(comppath)
         if os.path.isdir(path):
             return True
@@ -322,6 +644,9 @@ class NISTBag(PreservationSystem):
         if not self.is_subcoll(comppath):
             raise BadBagRequest("Does not point to a subcollection: "+comppath,
                                 bagname=self.name, sys=self)
+        if self._structure:
+            return [c for c in self._structure.children_of(comppath)
+                      if not c.startswith('.') and not c.startswith('_')]
 
         children = set()
         cdir = self._full_dpath(comppath)
@@ -352,7 +677,7 @@ class NISTBag(PreservationSystem):
 
         :return generator:  
         """
-        for dir, subdirs, files in os.walk(self.data_dir):
+        for dir, subdirs, files in self._walk(self.data_dir):
             reldir = dir[len(self.data_dir)+1:]
             for f in files:
                 # if f.startswith('.'):
@@ -367,14 +692,13 @@ class NISTBag(PreservationSystem):
         bag's base directory.  
         """
         fetchfile = os.path.join(self.dir, "fetch.txt")
-        if os.path.exists(fetchfile):
-            with open(fetchfile) as fd:
-                for line in fd:
-                    out = line.strip().split()
-                    if len(out) != 3 or len([i for i in out if len(i) > 0]) != 3:
-                        raise BagFormatError('Bad fetch.txt line syntax: "' +
-                                             line + '"')
-                    yield tuple(out)
+        if self._exists(fetchfile):
+            for line in self.iter_tagfile_lines(fetchfile):
+                out = line.strip().split()
+                if len(out) != 3 or len([i for i in out if len(i) > 0]) != 3:
+                    raise BagFormatError('Bad fetch.txt line syntax: "' +
+                                         line + '"')
+                yield tuple(out)
 
     def iter_tagfile_lines(self, filepath):
         """
@@ -401,7 +725,7 @@ class NISTBag(PreservationSystem):
         infofile = altfile
         if not infofile:
             infofile = os.path.join(self.dir, "bag-info.txt")
-        if not os.path.exists(infofile):
+        if not self._exists(infofile):
             return out
 
         leadspc = re.compile("^\s+")
@@ -431,3 +755,154 @@ class NISTBag(PreservationSystem):
                     
         return out
     
+
+
+class _BagStructure(object):
+    # an in-memory summary of the contents of a bag's data and metadata 
+    # trees.  Paths are relative to the data (or metadata) directory, and
+    # the root collection is "".  The trees are examined with the given walk
+    # function, which must behave like os.walk().
+
+    def __init__(self, datadir, metadir, walk=os.walk):
+        self._datadir = datadir
+        self._metadir = metadir
+        self._walk = walk
+
+        self.datafiles = set()
+        self.datadirs = set()
+        self.metadirs = set()
+        self.nerdfiles = set()     # components with a nerdm.json file
+        self.datachildren = {}     # collection -> names found under data
+        self.nerdchildren = {}     # collection -> names with metadata
+        self._types = {}           # component -> its @type values
+
+        self._scan_data("")
+        self._scan_metadata("")
+
+    @classmethod
+    def _key(cls, comppath):
+        comppath = os.path.normpath(comppath)
+        if comppath == '.':
+            return ""
+        return comppath
+
+    @classmethod
+    def _split(cls, comppath):
+        if '/' in comppath:
+            return comppath.rsplit('/', 1)
+        return "", comppath
+
+    def exists(self, comppath):
+        comppath = self._key(comppath)
+        return comppath in self.datafiles or comppath in self.datadirs or \
+               comppath in self.metadirs
+
+    def is_file(self, comppath):
+        return self._key(comppath) in self.datafiles
+
+    def is_dir(self, comppath):
+        return self._key(comppath) in self.datadirs
+
+    def types_of(self, comppath, read_nerd):
+        comppath = self._key(comppath)
+        if comppath not in self.nerdfiles:
+            return []
+        if comppath not in self._types:
+            nerdfile = os.path.join(self._metadir, comppath, NERDMD_FILENAME)
+            self._types[comppath] = read_nerd(nerdfile).get('@type', [])
+        return self._types[comppath]
+
+    def children_of(self, comppath):
+        comppath = self._key(comppath)
+        return list(self.datachildren.get(comppath, set()) |
+                    self.nerdchildren.get(comppath, set()))
+
+    def _scan_data(self, top):
+        top = os.path.join(self._datadir, top)
+        for dir, subdirs, files in self._walk(top):
+            reldir = self._key(os.path.relpath(dir, self._datadir))
+            children = self.datachildren.setdefault(reldir, set())
+            for name in subdirs:
+                self.datadirs.add(os.path.join(reldir, name))
+                children.add(name)
+            for name in files:
+                self.datafiles.add(os.path.join(reldir, name))
+                children.add(name)
+
+    def _scan_metadata(self, top):
+        top = os.path.join(self._metadir, top)
+        for dir, subdirs, files in self._walk(top):
+            reldir = self._key(os.path.relpath(dir, self._metadir))
+            if reldir:
+                self.metadirs.add(reldir)
+            if NERDMD_FILENAME in files:
+                self.nerdfiles.add(reldir)
+                if reldir:
+                    parent, name = self._split(reldir)
+                    self.nerdchildren.setdefault(parent, set()).add(name)
+
+    def _forget(self, comppath, subtree):
+        # remove what is known about a component (and, optionally, its 
+        # descendants)
+        paths = set([comppath])
+        if subtree:
+            prefix = comppath + '/'
+            for coll in (self.datafiles, self.datadirs, self.metadirs,
+                         self.nerdfiles, self.datachildren, self.nerdchildren,
+                         self._types):
+                paths.update([p for p in coll if p.startswith(prefix)])
+
+        for path in paths:
+            for coll in (self.datafiles, self.datadirs, self.metadirs,
+                         self.nerdfiles):
+                coll.discard(path)
+            self._types.pop(path, None)
+            if subtree:
+                self.datachildren.pop(path, None)
+                self.nerdchildren.pop(path, None)
+
+        parent, name = self._split(comppath)
+        self.datachildren.get(parent, set()).discard(name)
+        self.nerdchildren.get(parent, set()).discard(name)
+
+    def _examine(self, comppath):
+        # look at a single component on disk (without descending into it)
+        parent, name = self._split(comppath)
+        path = os.path.join(self._datadir, comppath)
+        if os.path.isdir(path):
+            self.datadirs.add(comppath)
+            self.datachildren.setdefault(comppath, set())
+        elif os.path.exists(path):
+            self.datafiles.add(comppath)
+        else:
+            path = None
+        if path and comppath:
+            self.datachildren.setdefault(parent, set()).add(name)
+
+        path = os.path.join(self._metadir, comppath)
+        if os.path.isdir(path):
+            if comppath:
+                self.metadirs.add(comppath)
+            if os.path.exists(os.path.join(path, NERDMD_FILENAME)):
+                self.nerdfiles.add(comppath)
+                if comppath:
+                    self.nerdchildren.setdefault(parent, set()).add(name)
+
+    def refresh(self, comppath, subtree=True):
+        comppath = self._key(comppath)
+        if comppath == "" and subtree:
+            self.__init__(self._datadir, self._metadir, self._walk)
+            return
+
+        self._forget(comppath, subtree)
+        if subtree:
+            self._scan_data(comppath)
+            self._scan_metadata(comppath)
+        self._examine(comppath)
+
+        # the ancestors may have been created along the way
+        while comppath:
+            comppath = self._split(comppath)[0]
+            if comppath:
+                self._forget(comppath, False)
+            self._examine(comppath)
@@ -13,13 +13,16 @@ from .. import (SIPDirectoryError, SIPDirectoryNotFound,
                 ConfigurationException, StateException, PODError)
 from .exceptions import BagProfileError, BagWriteError
 from .. import PreservationSystem, read_nerd, read_pod, write_json
-from ...utils import build_mime_type_map, checksum_of
+from ...utils import (build_mime_type_map, checksum_of, sniff_media_type,
+                      SNIFF_SIZE)
+from ...checksum import ChecksumEngine, DEF_CHUNK_SIZE
 from ....nerdm.exceptions import (NERDError, NERDTypeError)
 from ....nerdm.convert import PODds2Res
 from ....id import PDRMinter
 from ... import def_jq_libdir, def_etc_dir
 from ...config import load_from_file, merge_config
 from .bag import NISTBag
+from .compindex import ComponentIndex, COMPINDEX_FILENAME
 from .exceptions import BadBagRequest
 from .validate.nist import NISTAIPValidator
 
@@ -30,6 +33,7 @@ log = logging.getLogger(__name__)
 DEF_BAGLOG_FORMAT = "%(asctime)s %(levelname)s: %(message)s"
 
 DEF_MBAG_VERSION = "0.2"
+DEF_CHECKSUM_ALG = "sha256"
 
 POD_FILENAME = "pod.json"
 NERDMD_FILENAME = "nerdm.json"
@@ -42,6 +46,9 @@ FILEANNOT_FILENAME = ANNOT_FILENAME
 RESANNOT_FILENAME  = ANNOT_FILENAME
 COLLANNOT_FILENAME = ANNOT_FILENAME
 
+TREEHASH_FILENAME = "treehash.json"
+DEF_TREE_HASH_MIN_SIZE = 16 * 1024 * 1024 * 1024   # 16 GB
+
 NERD_PRE = "nrd"
 NERDPUB_PRE = "nrdp"
 NERDM_SCH_ID_BASE = "https://data.nist.gov/od/dm/nerdm-schema/"
@@ -86,10 +93,28 @@ class BagBuilder(PreservationSystem):
                               data
     :prop ensure_nerdm_type_on_add bool (True):  if True, make sure that the 
                          resource metadata has a recognized value for "_schema".
+    :prop checksum_engine dict ({}):  a set of parameters for configuring the 
+                         ChecksumEngine used to calculate the checksums of 
+                         many files at once (see 
+                         nistoar.pdr.checksum.ChecksumEngine).
+    :prop checksum_algorithms list of str (["sha256"]):  the checksum 
+                         algorithms to apply to data files.  A manifest file
+                         is written for each one, and digests for algorithms
+                         other than sha256 are recorded in the file's 
+                         metadata under "altChecksums".  sha256 is always 
+                         applied.  
+    :prop tree_hash dict (None):  if set, a chunked tree hash will be 
+                         calculated for each large data file and saved (as
+                         treehash.json) alongside the file's NERDm metadata; 
+                         this allows the file to be verified in parallel and
+                         any corrupted regions to be located.  Supported 
+                         sub-properties are "min_size" (the minimum file size
+                         in bytes; default: 16 GB) and "chunk_size" (default:
+                         256 MB).
     """
 
     def __init__(self, parentdir, bagname, config=None, id=None, minter=None,
-                 logger=None):
+                 logger=None, cksumcache=None):
         """
         create the Builder to build a bag with a given name
 
@@ -106,6 +131,9 @@ class BagBuilder(PreservationSystem):
         :param logger Logger:  a Logger object to send messages to.  This will 
                                  used to send messages to a preservation log
                                  inside the bag.  
+        :param cksumcache ChecksumCache:  a persistent cache of previously 
+                                 calculated checksums to consult before 
+                                 reading data files.  
         """
         if not os.path.exists(parentdir):
             raise StateException("Bag Workspace dir does not exist: " +
@@ -146,6 +174,14 @@ class BagBuilder(PreservationSystem):
         jqlib = self.cfg.get('jq_lib', def_jq_libdir)
         self.pod2nrd = PODds2Res(jqlib)
 
+        self.checksum_algs = [DEF_CHECKSUM_ALG] + \
+                             [a for a in self.cfg.get('checksum_algorithms', [])
+                                if a != DEF_CHECKSUM_ALG]
+        self.checksummer = ChecksumEngine(self.cfg.get('checksum_engine', {}),
+                                          cksumcache, self.checksum_algs)
+        self._treecfg = self.cfg.get('tree_hash')
+        self._compidx = None
+
 # Not sure why this was added originally, but it causes problems to create
 # the bag directory and log in the constructor, and breaks assumptions of
 # ensure_bagdir().
@@ -283,7 +319,8 @@ class BagBuilder(PreservationSystem):
             self._set_logfile()
         if didit:
             self.record("Created bag with name, %s", self.bagname)
-        self._bag = NISTBag(self.bagdir)
+        if didit or not self._bag:
+            self._bag = NISTBag(self.bagdir, index=True)
         if os.path.exists(self._bag.nerd_file_for("")):
             # load the resource-level metadata that's already there
             md = self._bag.nerd_metadata_for("")
@@ -351,7 +388,12 @@ class BagBuilder(PreservationSystem):
         try:
             if not os.path.exists(path):
                 os.makedirs(path)
+                self._bag_changed(destpath, False)
         except Exception, ex:
+            if os.path.isdir(path):
+                # created concurrently by another thread
+                self._bag_changed(destpath, False)
+                return
             pdir = os.path.join(os.path.basename(self.bagdir),
                                 "metadata", destpath)
             raise BagWriteError("Failed to create directory tree ({0}): {1}"
@@ -390,6 +432,7 @@ class BagBuilder(PreservationSystem):
             try:
                 if not os.path.exists(path):
                     os.makedirs(path)
+                    self._bag_changed(pdir, False)
             except Exception, ex:
                 pdir = os.path.join(os.path.basename(self.bagdir), "data", pdir)
                 raise BagWriteError("Failed to create directory tree ({0}): {1}"
@@ -435,10 +478,17 @@ class BagBuilder(PreservationSystem):
         :param initmd bool:    If True and a file is provided, the file will 
                                be examined and extraction of metadata will be 
                                attempted.  Resulting metadata will be written 
-                               into the metadata directory. 
+                               into the metadata directory.  If the file must
+                               be copied, its checksum, size, and leading
+                               bytes are taken from the copy and the copy 
+                               is examined instead of the source file.
         """
         self.ensure_datafile_dirs(destpath)
         outfile = os.path.join(self.bagdir, 'data', destpath)
+        examine = srcpath
+        checksum = None
+        size = None
+        head = None
 
         msg = "Adding file, " + destpath
         if initmd:
@@ -461,16 +511,20 @@ class BagBuilder(PreservationSystem):
                         raise BagWriteError(msg, sys=self)
             if not hardlink:
                 try:
-                    filecopy(srcpath, outfile)
+                    (checksum, size, head) = \
+                        self.checksummer.copy_file(srcpath, outfile)
+                    examine = outfile
                     self.record("Added data file at "+destpath)
                 except Exception, ex:
                     msg = "Unable to copy data file (" + srcpath + \
                           ") into bag (" + outfile + "): " + str(ex)
                     self.log.exception(msg, exc_info=True)
                     raise BagWriteError(msg, cause=ex, sys=self)
+            self._bag_changed(destpath, False)
     
         if initmd:
-            self.init_filemd_for(destpath, write=True, examine=srcpath)
+            self.init_filemd_for(destpath, write=True, examine=examine,
+                                 checksum=checksum, head=head, size=size)
 
     def ensure_colls_for(self, destpath):
         """
@@ -590,8 +644,17 @@ class BagBuilder(PreservationSystem):
         return os.path.join(self.bagdir, "metadata", destpath,
                             FILEANNOT_FILENAME)
 
+    def treehash_file_for(self, destpath):
+        """
+        return the path to the tree hash file that corresponds to a data file
+        with the given collection path.
+        """
+        return os.path.join(self.bagdir, "metadata", destpath,
+                            TREEHASH_FILENAME)
+
     def init_filemd_for(self, destpath, write=False, examine=None,
-                        disttype="DataFile"):
+                        disttype="DataFile", checksum=None, head=None,
+                        size=None):
         """
         create some initial file metadata for a file at a given path.
 
@@ -610,28 +673,72 @@ class BagBuilder(PreservationSystem):
                               the file (with the default default being 
                               "DataFile"); if examine is True, the type may 
                               change based on inspection of the file.  
+        :param checksum str or dict:  a previously calculated SHA-256 hash of 
+                              the file's contents or a dictionary mapping 
+                              algorithm names to hashes; if provided (and 
+                              examine is True), the file will not be read 
+                              again to calculate them.
+        :param head str:      the leading bytes of the file, if they have 
+                              already been read; if examine is True, the 
+                              media type of a file with an unrecognized 
+                              extension is surmised from them (reading them
+                              from the file if they are not provided).
+        :param size int:      the size of the file, if already known
         """
         self.record("Initializing metadata for file %s", destpath)
-        mdata = self._create_init_filemd_for(destpath, disttype=disttype)
         if examine:
             if isinstance(examine, (str, unicode)):
                 datafile = examine
             else:
                 datafile = os.path.join(self.bagdir, "data", destpath)
-                
-            self._add_mediatype(datafile, mdata, {})
-            if os.path.exists(datafile):
-                self._add_extracted_metadata(datafile, mdata,
-                                             self.cfg.get('file_md_extract'))
-            else:
-                log.warning("Unable to examine data file: doesn't exist (yet): "+
-                            destpath)
+            mdata, tree = self.examine_filemd_for(destpath, datafile, disttype,
+                                                  checksum, head, size)
+            if tree:
+                self.save_tree_hash(destpath, tree)
+        else:
+            mdata = self._create_init_filemd_for(destpath, disttype=disttype)
         if write:
             self.add_metadata_for_file(destpath, mdata)
             self.ensure_ansc_collmd(destpath)
 
         return mdata
 
+    def examine_filemd_for(self, destpath, datafile, disttype="DataFile",
+                           checksum=None, head=None, size=None):
+        """
+        create initial file metadata for a file at a given path by examining
+        a copy of the file.  Unlike init_filemd_for(), nothing is written to
+        the bag or recorded in its log, so this may be called concurrently
+        for different files.  If the file warrants a tree hash (see 
+        wants_tree_hash()), one is calculated and returned for the caller to
+        save with the metadata (via save_tree_hash()).  
+
+        :param destpath str:  the path to the data file relative to the 
+                              dataset's root.
+        :param datafile str:  the path to a copy of the data file to examine
+        :param disttype str:  the default file distribution type to assign to 
+                              the file (see init_filemd_for()).
+        :param checksum str or dict:  a previously calculated SHA-256 hash of 
+                              the file's contents or a dictionary mapping 
+                              algorithm names to hashes.
+        :param head str:      the leading bytes of the file, if they have 
+                              already been read.
+        :param size int:      the size of the file, if already known
+        :return tuple:  the file metadata and either the tree hash to save 
+                        for the file or None if one need not be saved.
+        """
+        mdata = self._create_init_filemd_for(destpath, disttype=disttype)
+        self._add_mediatype(datafile, mdata, {}, head)
+        tree = None
+        if os.path.exists(datafile):
+            tree = self._add_extracted_metadata(datafile, mdata,
+                                                self.cfg.get('file_md_extract'),
+                                                checksum, size)
+        else:
+            log.warning("Unable to examine data file: doesn't exist (yet): "+
+                        destpath)
+        return (mdata, tree)
+
     def init_collmd_for(self, destpath, write=False, examine=False):
         """
         create some initial subcollection metadata for a folder at a given path.
@@ -669,24 +776,141 @@ class BagBuilder(PreservationSystem):
         indent = self.cfg.get('json_indent', 4)
         write_json(jsdata, destfile, indent)
 
-    def _add_extracted_metadata(self, dfile, mdata, config):
-        self._add_osfile_metadata(dfile, mdata, config)
-        self._add_checksum(dfile, mdata, config)
+        # keep the component and structure indexes up to date
+        mdir = os.path.join(self.bagdir, "metadata")
+        if os.path.basename(destfile) == NERDMD_FILENAME and \
+           destfile.startswith(mdir+'/'):
+            filepath = os.path.dirname(destfile)[len(mdir)+1:]
+            self._bag_changed(filepath, False)
+            if filepath:
+                self.comp_index.update(filepath, jsdata,
+                                       os.stat(destfile).st_mtime)
+
+    def _bag_changed(self, destpath, subtree=True):
+        # keep the NISTBag's index of the bag's structure up to date (see 
+        # NISTBag.invalidate_index()); a destpath of None means that 
+        # arbitrary changes were made.
+        if self._bag:
+            self._bag.invalidate_index(destpath, subtree)
 
-    def _add_osfile_metadata(self, dfile, mdata, config):
-        mdata['size'] = os.stat(dfile).st_size
-    def _add_checksum(self, dfile, mdata, config):
-        mdata['checksum'] = {
-            'algorithm': { '@type': "Thing", 'tag': 'sha256' },
-            'hash': checksum_of(dfile)
-        }
-    def _add_mediatype(self, dfile, mdata, config):
+    @property
+    def comp_index(self):
+        """
+        the ComponentIndex summarizing the component metadata in the bag.  
+        This index is kept up to date as component metadata is written.
+        """
+        if not self._compidx:
+            self._compidx = ComponentIndex(os.path.join(self.bagdir,
+                                                        COMPINDEX_FILENAME),
+                                           os.path.join(self.bagdir,
+                                                        "metadata"))
+        return self._compidx
+
+    def _add_extracted_metadata(self, dfile, mdata, config, checksum=None,
+                                size=None):
+        # returns a newly calculated tree hash that should be saved, if any
+        self._add_osfile_metadata(dfile, mdata, config, size)
+        return self._add_checksum(dfile, mdata, config, checksum)
+
+    def _add_osfile_metadata(self, dfile, mdata, config, size=None):
+        if size is None:
+            size = os.stat(dfile).st_size
+        mdata['size'] = size
+    def _add_checksum(self, dfile, mdata, config, hash=None):
+        # hash can be a single sha256 hash or a dictionary of digests.  If a
+        # tree hash is calculated, it is returned (but not saved).
+        digests = {}
+        tree = None
+        if isinstance(hash, Mapping):
+            digests.update(hash)
+        elif hash:
+            digests[DEF_CHECKSUM_ALG] = hash
+        need = [a for a in self.checksum_algs if a not in digests]
+        if mdata.get('filepath') and \
+           self.wants_tree_hash(mdata['size']) and \
+           (need or not self._get_tree_hash(mdata['filepath'],
+                                            digests[DEF_CHECKSUM_ALG])):
+            # a tree hash is only trusted if it was calculated from the same
+            # read as the whole-file checksum it is saved with.
+            given = digests
+            digests, tree = self._tree_digests_of(mdata['filepath'], dfile,
+                                                  given)
+            digests.update(given)
+        elif need:
+            digests.update(self.checksummer.digests_of(dfile, need))
+
+        mdata['checksum'] = self._checksum_md(DEF_CHECKSUM_ALG,
+                                              digests[DEF_CHECKSUM_ALG])
+        if len(self.checksum_algs) > 1:
+            mdata['altChecksums'] = [self._checksum_md(a, digests[a])
+                                     for a in self.checksum_algs[1:]]
+        return tree
+    def wants_tree_hash(self, size):
+        """
+        return True if a data file of the given size should have a tree hash
+        calculated for it (according to the 'tree_hash' configuration).
+        Such files are best examined via init_filemd_for() without a 
+        precalculated checksum so that the file is read only once.
+        """
+        return self._treecfg is not None and \
+               size >= self._treecfg.get('min_size', DEF_TREE_HASH_MIN_SIZE)
+    def _tree_digests_of(self, destpath, dfile, expected=None):
+        # calculate the checksums and tree hash of a data file from a single
+        # read; the tree hash is returned ready to be saved.  If checksums 
+        # were previously recorded for the file (expected), they must match
+        # what was read.
+        chunk_size = self._treecfg.get('chunk_size', DEF_CHUNK_SIZE)
+        algs = list(self.checksum_algs)
+        if expected:
+            algs += [a for a in expected if a not in algs]
+        digests, tree = self.checksummer.tree_digests_of(dfile, chunk_size,
+                                                         algs)
+        if expected and any([digests[a] != expected[a] for a in expected]):
+            raise BagProfileError("Checksum failure for " + destpath)
+
+        # record the whole-file hash the tree hash corresponds to
+        tree = OrderedDict(tree)
+        tree['fileChecksum'] = digests[DEF_CHECKSUM_ALG]
+        return digests, tree
+    def save_tree_hash(self, destpath, tree):
+        """
+        save a tree hash (as returned by examine_filemd_for()) for the data 
+        file with the given path.
+        """
+        self.ensure_metadata_dirs(destpath)
+        self._write_json(tree, self.treehash_file_for(destpath))
+    def _get_tree_hash(self, destpath, filehash):
+        # return None if missing or out of date
+        thfile = self.treehash_file_for(destpath)
+        if not os.path.exists(thfile):
+            return None
+        tree = read_nerd(thfile)
+        if tree.get('fileChecksum') != filehash:
+            return None
+        return tree
+    def _checksum_md(self, alg, hash):
+        return OrderedDict([
+            ('algorithm', { '@type': "Thing", 'tag': alg }),
+            ('hash', hash)
+        ])
+    def _add_mediatype(self, dfile, mdata, config, head=None):
         if not self._mimetypes:
             mtfile = pkg_resources.resource_filename('nistoar.pdr',
                                                      'data/mime.types')
             self._mimetypes = build_mime_type_map([mtfile])
-        mdata['mediaType'] = self._mimetypes.get(os.path.splitext(dfile)[1][1:],
-                                                 'application/octet-stream')
+        mt = self._mimetypes.get(os.path.splitext(dfile)[1][1:])
+        if not mt:
+            # unrecognized extension; look at the file's leading bytes 
+            # (whether or not they were read while copying the file, so
+            # that the result is the same either way)
+            if head is None:
+                try:
+                    with open(dfile, 'rb') as fd:
+                        head = fd.read(SNIFF_SIZE)
+                except IOError:
+                    head = ''
+            mt = sniff_media_type(head, 'application/octet-stream')
+        mdata['mediaType'] = mt
 
     _file_types = {
         "DataFile": [
@@ -772,6 +996,7 @@ class BagBuilder(PreservationSystem):
         if trim:
             self.trim_metadata_folders()
 
+        self.ensure_tree_hashes()
         self.write_data_manifest(finalcfg.get('confirm_checksums', False))
         self.write_mbag_files()
         # write_ore_file
@@ -781,6 +1006,11 @@ class BagBuilder(PreservationSystem):
         self.write_bagit_ver()
         self.ensure_baginfo()
 
+        # the component index and record cache are only needed while the bag
+        # is being built
+        self.comp_index.discard()
+        NISTBag(self.bagdir).discard_record_cache()
+
         self.log.error("Implementation of Bag finalization is not complete!")
 
     def write_about_file(self):
@@ -1138,6 +1368,7 @@ format(nerdm['title'])
                             # rm metadata directory if it's empty or rmmeta=True
                             if len(mcont) == 0 or rmmeta:
                                 rmtree(mdir)
+                                self.comp_index.remove(ddir[len(droot)+1:])
 
                         else:
                             self.log.error("NIST bag profile error: not a " +
@@ -1146,6 +1377,7 @@ format(nerdm['title'])
                 except OSError, ex:
                     self.log.exception("Failed to remove empty data dir: " +
                                        ddir + ": " + str(ex))
+        self._bag_changed(None)
                     
     def trim_metadata_folders(self):
         """
@@ -1162,6 +1394,7 @@ format(nerdm['title'])
                 except OSError, ex:
                     self.log.exception("Failed to remove empty metadata dir: " +
                                        mdir + ": " + str(ex))
+        self._bag_changed(None)
 
 
     def ensure_comp_metadata(self, examine=True):
@@ -1175,33 +1408,51 @@ format(nerdm['title'])
         """
         if not self._bag:
             self.ensure_bagdir()
-        for dfile in self._bag.iter_data_files():
-            mdfile = self._bag.nerd_file_for(dfile)
-            if examine or not os.path.exists(mdfile):
-                # we'll merge the new examination with the previous:
-                # except 'checksum', previous data will over-ride new 
-                if os.path.exists(mdfile):
-                    oldmd = self._bag.nerd_metadata_for(dfile)
-                else:
-                    oldmd = OrderedDict()
-
-                # generate metadata
-                md = self.init_filemd_for(dfile, write=False, examine=examine)
-
-                # merge it with the previous metadata
-                cksm = md.get('checksum')
-                sz = md.get('size')
-                md.update(oldmd)
-                override = {}
-                if cksm:
-                    override['checksum'] = cksm
-                if sz:
-                    override['size'] = sz
-                md.update(override)
+        dfiles = [f for f in self._bag.iter_data_files()
+                    if examine or not os.path.exists(self._bag.nerd_file_for(f))]
 
-                # write it out
-                self.add_metadata_for_file(dfile, md)
-                self.ensure_ansc_collmd(dfile)
+        # calculate all of the needed checksums at once
+        sums = [None] * len(dfiles)
+        if examine:
+            # files needing tree hashes are left to be hashed individually
+            batch = [i for i, f in enumerate(dfiles)
+                       if not self.wants_tree_hash(
+                                  os.stat(self._bag._full_dpath(f)).st_size)]
+            calcd = self.checksummer.iter_digests(
+                                  [self._bag._full_dpath(dfiles[i]) for i in batch])
+            for i, (fp, dg) in zip(batch, calcd):
+                sums[i] = dg
+
+        for dfile, cksum in zip(dfiles, sums):
+            mdfile = self._bag.nerd_file_for(dfile)
+            # we'll merge the new examination with the previous:
+            # except 'checksum', previous data will over-ride new 
+            if os.path.exists(mdfile):
+                oldmd = self._bag.nerd_metadata_for(dfile)
+            else:
+                oldmd = OrderedDict()
+
+            # generate metadata
+            md = self.init_filemd_for(dfile, write=False, examine=examine,
+                                      checksum=cksum)
+
+            # merge it with the previous metadata
+            cksm = md.get('checksum')
+            altcksms = md.get('altChecksums')
+            sz = md.get('size')
+            md.update(oldmd)
+            override = {}
+            if cksm:
+                override['checksum'] = cksm
+            if altcksms:
+                override['altChecksums'] = altcksms
+            if sz:
+                override['size'] = sz
+            md.update(override)
+
+            # write it out
+            self.add_metadata_for_file(dfile, md)
+            self.ensure_ansc_collmd(dfile)
 
 
     def __del__(self):
@@ -1401,6 +1652,7 @@ format(nerdm['title'])
         if os.path.isdir(target):
             removed = True
             rmtree(target)
+            self.comp_index.remove(destpath)
         elif os.path.exists(target):
             raise BadBagRequest("Request path does not look like a data "+
                                 "component (it's a file in the metadata tree): "+
@@ -1414,6 +1666,8 @@ format(nerdm['title'])
         elif os.path.isdir(target):
             removed = True
             rmtree(target)
+        if removed:
+            self._bag_changed(destpath)
 
         if destpath and trimcolls:
             destpath = os.path.dirname(destpath)
@@ -1431,9 +1685,12 @@ format(nerdm['title'])
 
     def write_data_manifest(self, confirm=False):
         """
-        Write the manifest-<algorithm>.txt file based on the data files that 
-        are currently in the data directory.  Each datafile must have a 
-        corresponding metadata file that contains the correct checksum.  
+        Write the manifest-<algorithm>.txt files based on the data files that 
+        are currently in the data directory, one for each of the configured
+        checksum algorithms.  Each datafile must have a corresponding metadata
+        file that contains the correct (sha256) checksum.  Checksums for the
+        other algorithms that are missing from the metadata are calculated 
+        and saved to the metadata.  
 
         :param confirm bool:  if False (default), the checksum found in the
                               data file's metadata will be assumed to be 
@@ -1442,31 +1699,117 @@ format(nerdm['title'])
                               the value in the metadata file is correct.
         """
         self.ensure_merged_annotations()
-        manfile = os.path.join(self.bagdir, "manifest-sha256.txt")
+        algs = self.checksum_algs
+        manfiles = [os.path.join(self.bagdir, "manifest-"+a+".txt")
+                     for a in algs]
         try:
-          with open(manfile, 'w') as fd:
-            for datapath in self._bag.iter_data_files():
-                md = self._bag.nerd_metadata_for(datapath, merge_annots=False)
-                checksum = md.get('checksum')
-                if not checksum or 'hash' not in checksum:
-                    raise BagProfileError("Missing checksum for datafile: "+
-                                          datapath)
-                algo = checksum.get('algorithm', {}).get('tag')
-                if algo != 'sha256':
-                    raise BagProfileError("Unexpected checksum algorithm found: "+
-                                          str(algo))
-                checksum = checksum['hash']
-                if confirm:
-                    if checksum_of(self._bag._full_dpath(datapath)) != checksum:
-                        raise BagProfileError("Checksum failure for "+datapath)
-
-                self._record_checksum(fd, checksum,os.path.join('data', datapath))
+          datapaths = []
+          digests = []
+          for datapath in self._bag.iter_data_files():
+              md = self._bag.nerd_metadata_for(datapath, merge_annots=False)
+              checksum = md.get('checksum')
+              if not checksum or 'hash' not in checksum:
+                  raise BagProfileError("Missing checksum for datafile: "+
+                                        datapath)
+              algo = checksum.get('algorithm', {}).get('tag')
+              if algo != DEF_CHECKSUM_ALG:
+                  raise BagProfileError("Unexpected checksum algorithm found: "+
+                                        str(algo))
+              dg = { algo: checksum['hash'] }
+              for cs in md.get('altChecksums', []):
+                  algo = cs.get('algorithm', {}).get('tag')
+                  if algo in algs and 'hash' in cs:
+                      dg[algo] = cs['hash']
+              datapaths.append(datapath)
+              digests.append(dg)
+
+          # read each file that needs checking just once to calculate all
+          # of its checksums
+          check = [i for i in range(len(datapaths))
+                     if confirm or len(digests[i]) < len(algs)]
+
+          # files with tree hashes can be verified in parallel chunks
+          if confirm:
+              for i in list(check):
+                  if len(digests[i]) < len(algs):
+                      continue
+                  tree = self._get_tree_hash(datapaths[i],
+                                             digests[i][DEF_CHECKSUM_ALG])
+                  if not tree:
+                      continue
+                  bad = self.checksummer.verify_tree_hash(
+                                  self._bag._full_dpath(datapaths[i]), tree)
+                  if bad:
+                      raise BagProfileError("Checksum failure for " +
+                                            datapaths[i] + " in byte range(s): "
+                                            + ", ".join(["%d-%d" % (o, o+l-1)
+                                                         for o, l in bad]))
+                  check.remove(i)
+
+          if check:
+              calcd = self.checksummer.iter_digests(
+                          [self._bag._full_dpath(datapaths[i]) for i in check],
+                          algs)
+              for i, (fp, dg) in zip(check, calcd):
+                  if confirm and any([digests[i][a] != dg[a]
+                                      for a in digests[i]]):
+                      raise BagProfileError("Checksum failure for "+
+                                            datapaths[i])
+                  if len(digests[i]) < len(algs):
+                      dg.update(digests[i])
+                      digests[i] = dg
+                      self._save_alt_checksums(datapaths[i], dg)
+
+          for alg, manfile in zip(algs, manfiles):
+              with open(manfile, 'w') as fd:
+                for datapath, dg in zip(datapaths, digests):
+                  self._record_checksum(fd, dg[alg],
+                                        os.path.join('data', datapath))
 
         except Exception, e:
-            if os.path.exists(manfile):
-                os.remove(manfile)
+            for manfile in manfiles:
+                if os.path.exists(manfile):
+                    os.remove(manfile)
             raise
 
+    def ensure_tree_hashes(self):
+        """
+        ensure that each data file large enough to warrant one (according to
+        the 'tree_hash' configuration) has an up-to-date tree hash saved in 
+        the metadata directory.  A tree hash that is missing or that does 
+        not correspond to the checksum recorded in the file's metadata is 
+        (re-)calculated from a full read of the file; the checksum recorded
+        in the metadata is confirmed by the same read before the tree hash
+        is saved.  Nothing is done if tree hashes have not been configured.  
+
+        :raise BagProfileError:  if a file does not match the checksum 
+                                 recorded in its metadata
+        """
+        if self._treecfg is None:
+            return
+        if not self._bag:
+            self.ensure_bagdir()
+
+        for datapath in self._bag.iter_data_files():
+            dfile = self._bag._full_dpath(datapath)
+            if not self.wants_tree_hash(os.stat(dfile).st_size):
+                continue
+            md = self._bag.nerd_metadata_for(datapath, merge_annots=False)
+            hash = md.get('checksum', {}).get('hash')
+            if not hash or self._get_tree_hash(datapath, hash):
+                continue
+            self.record("Calculating tree hash for %s", datapath)
+            tree = self._tree_digests_of(datapath, dfile,
+                                         {DEF_CHECKSUM_ALG: hash})[1]
+            self.save_tree_hash(datapath, tree)
+
+    def _save_alt_checksums(self, datapath, digests):
+        mdfile = self.nerdm_file_for(datapath)
+        md = read_nerd(mdfile)
+        md['altChecksums'] = [self._checksum_md(a, digests[a])
+                              for a in self.checksum_algs[1:]]
+        self._write_json(md, mdfile)
+
     def _record_checksum(self, fd, checksum, filepath):
         fd.write(checksum)
         fd.write(' ')
@@ -0,0 +1,276 @@
+"""
+This module provides an index of the components described in a working bag's
+metadata tree.
+
+Answering simple questions about a bag's components--e.g. which ones are
+downloadable files, or what a file's checksum is--otherwise requires parsing
+the nerdm.json file of every component.  The ComponentIndex records a small
+summary of each component's metadata (its types, checksum, etc.) in a single
+tag file in the bag; it is kept up to date by the BagBuilder as it writes
+component metadata.  The file is written as a log:  each update appends a
+line.  Loading an existing index file only reads that file; if the file is
+missing or unreadable, it is rebuilt from the metadata tree.  To pick up 
+changes made to component metadata outside of the BagBuilder, a process 
+preparing the bag should call validate() (which also compacts the file when
+it has accumulated many superseded lines) once before relying on the index.
+"""
+import os, json, logging
+
+from .. import PreservationSystem, sys as _sys
+from .. import StateException, read_nerd
+
+log = logging.getLogger(_sys.system_abbrev).getChild(_sys.subsystem_abbrev)
+
+COMPINDEX_FILENAME = "compindex.jsonl"
+NERDMD_FILENAME = "nerdm.json"
+
+# the component properties (besides @type) copied into the index
+INDEXED_PROPS = [ "size", "describes", "valid" ]
+
+class ComponentIndex(PreservationSystem):
+    """
+    an index of the components described under a bag's metadata directory,
+    mapping each component's filepath to a summary of its metadata:
+      "@type":     the list of the component's types
+      "mtime":     the modification time of the component's nerdm.json file
+                   when it was indexed
+      "checksum":  the (sha256) hash value of the component's checksum, if
+                   it has one
+    along with the component's "size", "describes", and "valid" properties
+    when they are set.
+    """
+
+    def __init__(self, indexfile, metadir):
+        """
+        open the index, loading it from the index file or, if necessary,
+        rebuilding it from the metadata tree.
+
+        :param indexfile str:  the path to the file where the index is saved
+        :param metadir   str:  the bag's metadata directory
+        """
+        self.indexfile = indexfile
+        self.metadir = metadir
+        self._comps = None
+        self._nlines = 0
+
+    def _ensure_loaded(self):
+        if self._comps is not None:
+            return
+        if not self._load():
+            self.rebuild()
+
+    def _load(self):
+        if not os.path.exists(self.indexfile):
+            return False
+        comps = {}
+        n = 0
+        try:
+            with open(self.indexfile) as fd:
+                for line in fd:
+                    n += 1
+                    self._apply(comps, json.loads(line))
+        except (ValueError, KeyError, IOError), ex:
+            log.warning("Unable to read component index (%s); will rebuild: %s",
+                        self.indexfile, str(ex))
+            return False
+        self._comps = comps
+        self._nlines = n
+        return True
+
+    def _apply(self, comps, rec):
+        filepath = rec['filepath']
+        if rec.get('removed'):
+            self._drop(comps, filepath)
+        else:
+            comps[filepath] = dict([(k, v) for k, v in rec.items()
+                                           if k != 'filepath'])
+
+    def _drop(self, comps, filepath):
+        pfx = filepath + '/'
+        for fp in [f for f in comps if f == filepath or f.startswith(pfx)]:
+            del comps[fp]
+
+    def _append(self, rec):
+        try:
+            with open(self.indexfile, 'a') as fd:
+                fd.write(json.dumps(rec, separators=(',', ':')))
+                fd.write('\n')
+            self._nlines += 1
+        except IOError, ex:
+            raise StateException("Unable to update component index: " +
+                                 self.indexfile + ": " + str(ex), cause=ex,
+                                 sys=self)
+
+    def _write(self):
+        tmpfile = self.indexfile + ".tmp"
+        try:
+            with open(tmpfile, 'w') as fd:
+                for filepath in sorted(self._comps.keys()):
+                    rec = dict(self._comps[filepath])
+                    rec['filepath'] = filepath
+                    fd.write(json.dumps(rec, separators=(',', ':')))
+                    fd.write('\n')
+            os.rename(tmpfile, self.indexfile)
+        except (IOError, OSError), ex:
+            raise StateException("Unable to write component index: " +
+                                 self.indexfile + ": " + str(ex), cause=ex,
+                                 sys=self)
+        self._nlines = len(self._comps)
+
+    @classmethod
+    def summarize(cls, mdata, mtime=None):
+        """
+        return the index entry for a component with the given metadata
+        """
+        out = { "@type": mdata.get('@type', []), "mtime": mtime }
+        hash = (mdata.get('checksum') or {}).get('hash')
+        if hash:
+            out['checksum'] = hash
+        for prop in INDEXED_PROPS:
+            if prop in mdata:
+                out[prop] = mdata[prop]
+        return out
+
+    def rebuild(self):
+        """
+        recreate the index by reading all of the component metadata found
+        under the metadata directory.
+        """
+        comps = {}
+        for dir, subdirs, files in os.walk(self.metadir):
+            if dir == self.metadir or NERDMD_FILENAME not in files:
+                continue
+            mdfile = os.path.join(dir, NERDMD_FILENAME)
+            try:
+                comps[dir[len(self.metadir)+1:]] = \
+                    self.summarize(read_nerd(mdfile), os.stat(mdfile).st_mtime)
+            except Exception, ex:
+                log.warning("Unable to index component metadata, %s: %s",
+                            mdfile, str(ex))
+        self._comps = comps
+        self._write()
+        log.debug("Rebuilt component index with %d components", len(comps))
+
+    def validate(self):
+        """
+        bring the index up to date with changes made to the metadata tree 
+        since the index was last updated.  A component whose nerdm.json file
+        has a modification time different from the one recorded in the index
+        is re-indexed; components that have appeared or disappeared are 
+        added or removed.  If anything changed (or the index file has 
+        accumulated many superseded lines), the index file is rewritten.  
+        This walks the whole metadata tree, so it should be called once 
+        when a bag is prepared, by the process holding the bag's lock.
+
+        :return int:  the number of components that were re-indexed, added,
+                      or removed
+        """
+        if self._comps is None and not self._load():
+            # a rebuilt index is up to date
+            self.rebuild()
+            return 0
+        found = set()
+        changed = 0
+        for dir, subdirs, files in os.walk(self.metadir):
+            if dir == self.metadir or NERDMD_FILENAME not in files:
+                continue
+            filepath = dir[len(self.metadir)+1:]
+            mdfile = os.path.join(dir, NERDMD_FILENAME)
+            found.add(filepath)
+            try:
+                mtime = os.stat(mdfile).st_mtime
+                ent = self._comps.get(filepath)
+                if ent and ent.get('mtime') == mtime:
+                    continue
+                self._comps[filepath] = self.summarize(read_nerd(mdfile), mtime)
+                changed += 1
+            except Exception, ex:
+                log.warning("Unable to index component metadata, %s: %s",
+                            mdfile, str(ex))
+
+        for filepath in [f for f in self._comps if f not in found]:
+            del self._comps[filepath]
+            changed += 1
+
+        if changed:
+            log.debug("Component index was out of date with %d components",
+                      changed)
+            self._write()
+        elif self._nlines > 2 * len(self._comps) + 100:
+            self.compact()
+        return changed
+
+    def compact(self):
+        """
+        rewrite the index file so that it contains one line per component
+        """
+        self._ensure_loaded()
+        self._write()
+
+    def update(self, filepath, mdata, mtime=None):
+        """
+        record the metadata for the component with the given filepath.
+
+        :param filepath str:  the component's filepath
+        :param mdata   dict:  the component's (full) NERDm metadata
+        :param mtime  float:  the modification time of the component's
+                              metadata file
+        """
+        self._ensure_loaded()
+        ent = self.summarize(mdata, mtime)
+        if self._comps.get(filepath) == ent:
+            return
+        self._comps[filepath] = ent
+        rec = dict(ent)
+        rec['filepath'] = filepath
+        self._append(rec)
+
+    def remove(self, filepath):
+        """
+        remove the component with the given filepath, along with any
+        components below it, from the index.
+        """
+        self._ensure_loaded()
+        self._drop(self._comps, filepath)
+        self._append({"filepath": filepath, "removed": True})
+
+    def discard(self):
+        """
+        forget the index and remove the index file.  The index will be
+        rebuilt from the metadata tree if it is used again.
+        """
+        self._comps = None
+        self._nlines = 0
+        if os.path.exists(self.indexfile):
+            os.remove(self.indexfile)
+
+    def get(self, filepath, default=None):
+        """
+        return the index entry for the component with the given filepath
+        """
+        self._ensure_loaded()
+        return self._comps.get(filepath, default)
+
+    def __contains__(self, filepath):
+        self._ensure_loaded()
+        return filepath in self._comps
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._comps)
+
+    def items(self):
+        """
+        return a list of (filepath, entry) pairs for all indexed components
+        """
+        self._ensure_loaded()
+        return self._comps.items()
+
+    def filepaths_of_type(self, typename):
+        """
+        return the filepaths of the components that have a type ending with
+        the given name (e.g. ":DownloadableFile" or "ChecksumFile").
+        """
+        self._ensure_loaded()
+        return [fp for fp, ent in self._comps.items()
+                   if any([t.endswith(typename) for t in ent['@type']])]
@@ -0,0 +1,171 @@
+"""
+Tools for calculating the inventory and data hierarchy of a resource's
+components.
+
+The ComponentInventory class in this module produces the same values for
+a NERDm record's 'inventory' and 'dataHierarchy' properties as the
+jq-based ComponentCounter and HierarchyBuilder classes (from
+nistoar.nerdm.convert), but it does so in-process with a single pass over
+the components.  It can also be updated as components are added and
+removed without starting over.
+"""
+from collections import OrderedDict, Counter
+
+SUBCOLL_TYPE = "nrdp:Subcollection"
+
+def _parent_of(filepath):
+    if filepath is None:
+        return ""
+    return filepath.rsplit('/', 1)[0] if '/' in filepath else ""
+
+def _ancestors_of(filepath):
+    # the paths of the collections that contain the given filepath, from
+    # the nearest one up to the root collection ("")
+    if filepath is None:
+        return [""]
+    out = []
+    while '/' in filepath:
+        filepath = filepath.rsplit('/', 1)[0]
+        out.append(filepath)
+    out.append("")
+    return out
+
+class _CollectionCount(object):
+    # the tallies of children and descendants for a single collection
+    def __init__(self):
+        self.children = 0
+        self.desc = 0
+        self.childtypes = Counter()
+        self.desctypes = Counter()
+        self.childcolls = []
+
+    def summarize(self, collpath):
+        return OrderedDict([
+            ("forCollection", collpath),
+            ("childCount", self.children),
+            ("descCount", self.desc),
+            ("byType", [OrderedDict([("forType", t),
+                                     ("childCount", self.childtypes[t]),
+                                     ("descCount", self.desctypes[t])])
+                        for t in sorted(self.desctypes.keys())]),
+            ("childCollections", list(self.childcolls))
+        ])
+
+class ComponentInventory(object):
+    """
+    an updatable index of a resource's components that can produce the
+    values for the resource's 'inventory' and 'dataHierarchy' properties.
+    Only the component properties that affect these values (namely,
+    'filepath' and '@type') are retained.
+
+    Components are kept in the order they were added; a component added
+    with the same filepath (or, for components without a filepath, the
+    same '@id') as one already added replaces it in place.
+    """
+
+    def __init__(self, components=None):
+        """
+        create the inventory, initializing it with the given components
+
+        :param components list:  the NERDm component metadata to start with
+        """
+        self._comps = OrderedDict()
+        self._anon = 0
+        if components:
+            for comp in components:
+                self.add(comp)
+
+    @classmethod
+    def _key_for(cls, comp):
+        if comp.get('filepath'):
+            return comp['filepath']
+        if comp.get('@id'):
+            return "@id:" + comp['@id']
+        return None
+
+    def add(self, comp):
+        """
+        add a component to the inventory.
+
+        :param comp dict:  the NERDm component metadata
+        """
+        key = self._key_for(comp)
+        if key is None:
+            # a component with neither a filepath nor an identifier
+            self._anon += 1
+            key = "#" + str(self._anon)
+        self._comps[key] = (comp.get('filepath') or None,
+                            tuple(comp.get('@type', [])))
+
+    def remove(self, comp):
+        """
+        remove a component from the inventory.  Components contained in a
+        removed subcollection are not removed.
+
+        :param comp dict or str:  either the NERDm metadata for the component
+                                  or its filepath.
+        :return bool:  False if the component was not found in the inventory
+        """
+        key = comp
+        if not isinstance(comp, (str, unicode)):
+            key = self._key_for(comp)
+        return self._comps.pop(key, None) is not None
+
+    def __len__(self):
+        return len(self._comps)
+
+    def __contains__(self, filepath):
+        return filepath in self._comps
+
+    def inventory(self):
+        """
+        return the inventory of the components--i.e. the value for the
+        resource's 'inventory' property.  It contains an entry for the root
+        collection (with a 'forCollection' value of "") followed by one for
+        each subcollection, in order.
+        """
+        colls = OrderedDict([("", _CollectionCount())])
+        for filepath, types in self._comps.values():
+            if SUBCOLL_TYPE in types:
+                colls[filepath] = _CollectionCount()
+
+        for filepath, types in self._comps.values():
+            types = set(types)
+            coll = colls.get(_parent_of(filepath))
+            if coll:
+                coll.children += 1
+                coll.childtypes.update(types)
+                if SUBCOLL_TYPE in types:
+                    coll.childcolls.append(filepath)
+            for anc in _ancestors_of(filepath):
+                coll = colls.get(anc)
+                if coll:
+                    coll.desc += 1
+                    coll.desctypes.update(types)
+
+        return [c.summarize(p) for p, c in colls.items()]
+
+    def hierarchy(self):
+        """
+        return the hierarchy of the components that have filepaths--i.e. the
+        value for the resource's 'dataHierarchy' property.  Each entry gives
+        the filepath of a child of the root collection; the entries for
+        subcollections also include a list of 'children' in the same form.
+        """
+        children = {}
+        for filepath, types in self._comps.values():
+            if filepath is None:
+                continue
+            children.setdefault(_parent_of(filepath), []) \
+                    .append( (filepath, SUBCOLL_TYPE in types) )
+
+        def describe(collpath):
+            out = []
+            for filepath, issubcoll in children.get(collpath, []):
+                node = OrderedDict([("filepath", filepath)])
+                if issubcoll:
+                    node['children'] = describe(filepath)
+                out.append(node)
+            return out
+
+        return describe("")
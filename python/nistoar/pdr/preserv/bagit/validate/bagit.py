@@ -8,10 +8,16 @@ from urlparse import urlparse
 from .base import (Validator, ValidatorBase, ALL, ValidationResults,
                    ERROR, WARN, REC, ALL, PROB)
 from ..bag import NISTBag
-from ....utils import checksum_of
+from ....utils import checksum_of, digests_of
+
+def _digest_func(alg):
+    return lambda filepath: digests_of(filepath, [alg])[alg]
 
 csfunctions = {
-    "sha256":  checksum_of
+    "sha256":  checksum_of,
+    "sha512":  _digest_func("sha512"),
+    "sha1":    _digest_func("sha1"),
+    "md5":     _digest_func("md5")
 }
 
 class BagItValidator(ValidatorBase):
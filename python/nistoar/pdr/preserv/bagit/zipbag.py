@@ -0,0 +1,188 @@
+"""
+Tools for reading data from a bag that has been serialized into a zip file.
+
+The ZipNISTBag class provides the NISTBag interface to a zipped bag without
+extracting it:  the bag's structure is learned from the zip file's central
+directory, and only the tag and metadata files that are asked for are
+decompressed.  The bag's payload (its data files) is never read.
+"""
+import os, json, zipfile
+from collections import OrderedDict
+
+from .. import NERDError, PODError, StateException
+from .bag import NISTBag
+from .exceptions import BagFormatError
+
+class ZipNISTBag(NISTBag):
+    """
+    a read-only interface for reading data in a NIST-compliant BagIt bag
+    that has been serialized as a zip file (see
+    nistoar.pdr.preserv.bagit.serialize).
+
+    The zip file must contain a single top directory, named after the bag,
+    that contains the bag's contents.  The paths returned by the properties
+    and methods of this class (e.g. dir, metadata_dir, nerd_file_for()) are
+    the names of members within the zip file; likewise, the paths given to
+    methods like iter_tagfile_lines() and get_baginfo() must be member names.
+
+    An instance should not be shared between threads.
+    """
+
+    def __init__(self, zipfilepath, merge_annots=False):
+        """
+        open the zipped bag for reading
+
+        :param zipfilepath   str:  the path to the serialized bag
+        :param merge_annots bool:  the default value for the merge_annots
+                                   argument to nerd_metadata_for() and
+                                   nerdm_record()
+        """
+        if not os.path.isfile(zipfilepath) or \
+           not zipfile.is_zipfile(zipfilepath):
+            raise StateException("Serialized bag does not exist as a zip "+
+                                 "file: " + zipfilepath, sys=self)
+        self._zipfile = zipfilepath
+        self._zip = zipfile.ZipFile(zipfilepath)
+        self._load_tree()
+
+        rootdir = self._find_root()
+        self._dir = rootdir
+        self._name = rootdir
+
+        self._datadir = rootdir + "/data"
+        self._metadir = rootdir + "/metadata"
+        self._bagitver = None
+        self._tagencoding = None
+        self._mbagdir = None
+
+        self._mergeannots = merge_annots
+        self._cacherec = False
+        self._useindex = True
+        self._index = None
+
+    @property
+    def zipfile(self):
+        """
+        the path to the zip file containing the bag
+        """
+        return self._zipfile
+
+    def close(self):
+        """
+        close the underlying zip file.  This instance cannot be used after
+        it is closed.
+        """
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load_tree(self):
+        # learn the directory tree from the zip file's table of contents
+        self._tree = { "": (set(), []) }
+        for name in self._zip.namelist():
+            if name.endswith('/'):
+                self._add_dir(name.rstrip('/'))
+            else:
+                parent, fname = self._split(name)
+                self._add_dir(parent)[1].append(fname)
+
+    @classmethod
+    def _split(cls, path):
+        if '/' in path:
+            return path.rsplit('/', 1)
+        return "", path
+
+    def _add_dir(self, path):
+        if path not in self._tree:
+            self._tree[path] = (set(), [])
+            parent, name = self._split(path)
+            self._add_dir(parent)[0].add(name)
+        return self._tree[path]
+
+    def _find_root(self):
+        roots = self._tree[""][0]
+        if len(roots) != 1 or self._tree[""][1]:
+            raise BagFormatError("Zip file does not contain a single bag "+
+                                 "directory: " + self._zipfile,
+                                 os.path.basename(self._zipfile), sys=self)
+        root = iter(roots).next()
+        if "bagit.txt" not in self._tree[root][1]:
+            raise BagFormatError("Zip file does not contain a bag (missing "+
+                                 "bagit.txt): " + self._zipfile, root, sys=self)
+        return root
+
+    def _member(self, path):
+        path = os.path.normpath(path)
+        if path == '.':
+            return ""
+        return path
+
+    def _exists(self, path):
+        path = self._member(path)
+        if path in self._tree:
+            return True
+        parent, name = self._split(path)
+        return parent in self._tree and name in self._tree[parent][1]
+
+    def _walk(self, top):
+        top = self._member(top)
+        if top not in self._tree:
+            return
+        subdirs, files = self._tree[top]
+        subdirs = sorted(subdirs)
+        yield top, subdirs, sorted(files)
+        for subdir in subdirs:
+            for out in self._walk(top + '/' + subdir):
+                yield out
+
+    def _open(self, path):
+        try:
+            return self._zip.open(self._member(path))
+        except KeyError, ex:
+            raise IOError("File not found in zipped bag: " + path)
+
+    def _read_json(self, path):
+        with self._open(path) as fd:
+            return json.load(fd, object_pairs_hook=OrderedDict)
+
+    def read_nerd(self, nerdfile):
+        try:
+            return self._read_json(nerdfile)
+        except ValueError, ex:
+            raise NERDError("Unable to parse NERD file, " + nerdfile + ": " +
+                            str(ex), cause=ex, src=nerdfile)
+        except (IOError, zipfile.BadZipfile), ex:
+            raise NERDError("Unable to read NERD file, " + nerdfile + ": " +
+                            str(ex), cause=ex, src=nerdfile)
+
+    def read_pod(self, podfile):
+        try:
+            return self._read_json(podfile)
+        except ValueError, ex:
+            raise PODError("Unable to parse POD file, " + podfile + ": " +
+                           str(ex), cause=ex, src=podfile)
+        except (IOError, zipfile.BadZipfile), ex:
+            raise PODError("Unable to read POD file, " + podfile + ": " +
+                           str(ex), cause=ex, src=podfile)
+
+    def iter_tagfile_lines(self, filepath):
+        """
+        iterate through the lines contained in tagfile with a given path.
+
+        :param filepath str:  the name of the tag file within the zip file
+                              (not relative to the bag's base directory).
+        """
+        with self._open(filepath) as fd:
+            for line in fd:
+                yield line.rstrip()
+
+    def discard_record_cache(self):
+        """
+        do nothing:  a zipped bag is read-only and does not cache its NERDm
+        record.
+        """
+        pass
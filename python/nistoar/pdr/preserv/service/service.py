@@ -179,6 +179,23 @@ class PreservationService(object):
                     "history": [] }
             return out
 
+    def status_file_for(self, sipid, siptype=None):
+        """
+        return the path to the file where the status of the preservation 
+        of the SIP with the given identifier is (or would be) recorded.  
+        The file may not exist.  
+
+        :param sipid   str:  the ID for the dataset
+        :param siptype str:  the name of the type of SIP the ID refers to.
+                             If not provided, a default is assumed.
+        """
+        if not siptype:
+            siptype = 'midas'
+        pcfg = self._get_handler_config(siptype)
+        cachedir = pcfg.get('status_manager', {}).get('cachedir',
+                            os.path.join(pcfg['working_dir'], "preserv_status"))
+        return os.path.join(cachedir, sipid + ".json")
+
     def requests(self, siptype=None):
         """
         return the known SIP identifiers for which preservation requests 
@@ -428,7 +428,8 @@ class MIDASSIPHandler(SIPHandler):
         if self._ingester:
             try:
                 bag = NISTBag(self.bagger.bagdir)
-                self._ingester.stage(bag.nerdm_record(), self.bagger.name)
+                self._ingester.stage(bag.iter_nerdm_record(),
+                                     self.bagger.name)
             except Exception as ex:
                 msg = "Failure staging NERDm record for " + self.bagger.name + \
                       " for ingest: " + str(ex)
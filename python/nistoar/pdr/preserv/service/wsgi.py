@@ -13,12 +13,39 @@ from .service import (ThreadedPreservationService, RerequestException,
                       ConfigurationException)
 from . import status
 from .. import PreservationSystem
+from ...wsgiutils import (make_etag, http_date, not_modified, choose_encoding,
+                          compress, variant_etag)
 
 log = logging.getLogger(PreservationSystem().subsystem_abbrev).getChild("preserve")
 
 DEF_BASE_PATH = "/"
+MAX_VALIDATORS = 10000
+DEF_COMPRESS_MIN_SIZE = 1024
+
+# the states whose status data is reported as recorded (rather than 
+# recomputed on each request); only these are given validators
+_STABLE_STATES = [ status.IN_PROGRESS, status.SUCCESSFUL, status.FAILED ]
 
 class PreservationRequestApp(object):
+    """
+    the WSGI application for the preservation service.
+
+    In addition to the parameters supported by ThreadedPreservationService, 
+    this class supports the following configuration properties:
+    :prop base_path str ("/"):  the base URL path for the service
+    :prop auth_key str:  the secret key that clients must present to use
+                     the service
+    :prop auth_method str ("qparam"):  how the client presents the key:
+                     either "header" (as a Bearer token) or "qparam" (as
+                     the "auth" query parameter)
+    :prop compression dict ({}):  the parameters controlling the compression
+                     of responses for clients that accept it (via gzip or 
+                     deflate content coding):
+                       enabled bool (True): turns compression on or off
+                       level int (6):  the zlib compression level
+                       min_size int (1024):  responses smaller than this
+                                     number of bytes are not compressed
+    """
 
     def __init__(self, config):
         self.cfg = config
@@ -40,9 +67,18 @@ class PreservationRequestApp(object):
         if not self._auth[1]:
             log.warn("Service launched without authorization key defined")
 
+        # a memory of the validators (ETag and update time) for each status 
+        # file, keyed by the file's modification time and size
+        self._validators = {}
+
+        self.compression = config.get('compression', {})
+        if not self.compression.get('enabled', True):
+            self.compression = None
+
     def handle_request(self, env, start_resp):
         handler = Handler(self.preserv, self.siptype,
-                          env, start_resp, self._auth)
+                          env, start_resp, self._auth, self._validators,
+                          self.compression)
         return handler.handle()
 
     def __call__(self, env, start_resp):
@@ -55,8 +91,11 @@ class Handler(object):
     badidre = re.compile(r"[<>\s]")
 
     def __init__(self, service, siptype, wsgienv, start_resp,
-                 auth=None):
+                 auth=None, validators=None, compression=None):
         self._svc = service
+        self._validators = validators
+        self._comp = compression
+        self._encoded = False
         self._env = wsgienv
         self._start = start_resp
         self._meth = wsgienv.get('REQUEST_METHOD', 'GET')
@@ -81,6 +120,38 @@ class Handler(object):
         self._code = code
         self._msg = message
 
+    def add_validators(self, etag, mtime):
+        if etag:
+            self.add_header('ETag', etag)
+        if mtime is not None:
+            self.add_header('Last-Modified', http_date(mtime))
+
+    def choose_encoding(self):
+        """
+        return the content coding to apply to the response, or None if the 
+        response should not be compressed.
+        """
+        if self._comp is None:
+            return None
+        return choose_encoding(self._env)
+
+    def encode_body(self, body, encoding):
+        """
+        compress the given response body with the given content coding and
+        add the headers describing it; the body is returned unchanged if it
+        is too small to be worth compressing.  This must be called before 
+        end_headers().
+        """
+        if self._comp is None:
+            return body
+        self.add_header('Vary', 'Accept-Encoding')
+        if not encoding or \
+           len(body) < self._comp.get('min_size', DEF_COMPRESS_MIN_SIZE):
+            return body
+        self.add_header('Content-Encoding', encoding)
+        self._encoded = True
+        return compress(body + '\n', encoding, self._comp.get('level', 6))
+
     def end_headers(self):
         stat = "{0} {1}".format(str(self._code), self._msg)
         self._start(stat, self._hdr.items())
@@ -94,7 +165,7 @@ class Handler(object):
 
         if hasattr(self, meth_handler):
             out = getattr(self, meth_handler)(path)
-            if isinstance(out, list) and len(out) > 0:
+            if isinstance(out, list) and len(out) > 0 and not self._encoded:
                 out.append('\n')
             return out
         else:
@@ -189,6 +260,7 @@ class Handler(object):
 
         self.set_response(200, "Preservation requests by SIP ID")
         self.add_header('Content-Type', 'application/json')
+        out = self.encode_body(out, self.choose_encoding())
         self.end_headers()
         return [out]
 
@@ -196,6 +268,28 @@ class Handler(object):
         """
         return the status of a particular preservation request
         """
+        enc = self.choose_encoding()
+
+        # if the status file has not changed since we last reported it, the
+        # client may already have the current status
+        filekey = None
+        if self._validators is not None:
+            try:
+                sfile = self._svc.status_file_for(sipid, 'midas')
+                st = os.stat(sfile)
+                filekey = (st.st_mtime, st.st_size)
+                known = self._validators.get(sipid)
+                if known and known[0] == filekey:
+                    etag = self._matching_etag(known[1], known[2], enc)
+                    if etag:
+                        return self.send_not_modified(etag, known[2])
+            except OSError:
+                filekey = None
+            except Exception, ex:
+                log.warn("Unable to check status file for %s: %s",
+                         sipid, str(ex))
+                filekey = None
+
         try:
             stat = self._svc.status(sipid, 'midas')
             out = json.dumps(stat)
@@ -204,6 +298,19 @@ class Handler(object):
             self.send_error(500, "Internal error")
             return ["{}"]
 
+        etag = None
+        updtime = stat.get('update_time')
+        if stat['state'] in _STABLE_STATES and updtime:
+            etag = make_etag(sipid, updtime)
+            if filekey:
+                if len(self._validators) >= MAX_VALIDATORS and \
+                   sipid not in self._validators:
+                    self._validators.clear()
+                self._validators[sipid] = (filekey, etag, updtime)
+            matched = self._matching_etag(etag, updtime, enc)
+            if matched:
+                return self.send_not_modified(matched, updtime)
+
         if stat['state'] == status.NOT_READY and \
            stat['message'].startswith('Internal Error'):
             self.set_response(500, stat['message'])
@@ -221,9 +328,33 @@ class Handler(object):
             self.set_response(200, "Preservation record found")
 
         self.add_header('Content-Type', 'application/json')
+        out = self.encode_body(out, enc)
+        if self._code == 200:
+            self.add_validators(variant_etag(etag, self._encoded and enc),
+                                updtime)
         self.end_headers()
         return [out]
 
+    def _matching_etag(self, etag, mtime, encoding):
+        # return the entity tag of the representation that the client
+        # already has (per its conditional headers), or None if it does not
+        # have a current one
+        tags = [etag]
+        if encoding:
+            tags.insert(0, variant_etag(etag, encoding))
+        for tag in tags:
+            if not_modified(self._env, tag, mtime):
+                return tag
+        return None
+
+    def send_not_modified(self, etag, mtime):
+        self.set_response(304, "Not Modified")
+        self.add_validators(etag, mtime)
+        if self._comp is not None:
+            self.add_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return []
+
     def do_PATCH(self, path):
         # create an update request
 
@@ -0,0 +1,555 @@
+"""
+An event-driven web server front-end to the PrePubMetadataService.
+
+Unlike the PrePubMetadataWebServer (in the webservice module), which handles
+one request at a time, the server in this module manages its connections
+with an asyncore event loop.  Parsing requests and sending responses are done
+by the loop, while the (potentially slow) work of preparing metadata is
+handed off to a bounded pool of worker threads that run the WSGI application
+(see the wsgi module).  Response bodies--including data files--are streamed
+out a block at a time as each client is ready to receive them; each block is
+read by a worker thread, too.  Thus, a
+single slow preparation does not hold up the other clients.
+"""
+import os, sys, logging, json, socket, threading, Queue, urllib
+import asyncore, asynchat
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from wsgiref.util import FileWrapper
+
+from .. import PublishSystem
+from .wsgi import PrePubMetadaRequestApp
+from .webservice import DEF_BASE_PATH as DEF_MIDAS_BASE_PATH
+from ...wsgiutils import DEF_BLOCK_SIZE
+
+log = logging.getLogger(PublishSystem().subsystem_abbrev).getChild("asyncserver")
+
+DEF_WORKERS = 4
+DEF_MAX_PENDING = 100
+DEF_STATS_PATH = "/_stats"
+DEF_BASE_PATH = "/"
+MAX_HEADER_SIZE = 64 * 1024
+
+class AsyncWSGIServer(asyncore.dispatcher, object):
+    """
+    an HTTP server that runs a WSGI application using an asyncore event
+    loop and a bounded pool of worker threads.  Each connection carries
+    a single request (i.e. the connection is closed after the response is
+    sent).
+
+    This class can take a configuration dictionary on construction; the
+    following properties are supported:
+    :prop workers     int (4):    the number of worker threads available
+                                  for running the application
+    :prop max_pending int (100):  the maximum number of requests that may
+                                  be running or waiting for a worker;
+                                  requests beyond this are rejected with
+                                  a 503 (Service Unavailable) response.
+    :prop stats_path  str ("/_stats"):  the URL path at which the server's
+                                  statistics (see stats()) are served as
+                                  JSON; an empty value disables this.
+    :prop base_path   str ("/"):  the base URL path for the application;
+                                  this part of a request's path is passed
+                                  to the application as SCRIPT_NAME, and
+                                  requests for paths outside of it are
+                                  answered with a 404 (Not Found).
+    """
+
+    def __init__(self, server_address, app, config=None):
+        """
+        create the server and start listening at the given address
+
+        :param server_address tuple:  the (host, port) to listen at
+        :param app         callable:  the WSGI application to run
+        :param config          dict:  the server configuration (see the
+                                      class documentation)
+        """
+        if config is None:
+            config = {}
+        self._map = {}
+        asyncore.dispatcher.__init__(self, map=self._map)
+
+        self.app = app
+        self.workers = config.get('workers', DEF_WORKERS)
+        self.max_pending = config.get('max_pending', DEF_MAX_PENDING)
+        self.stats_path = config.get('stats_path', DEF_STATS_PATH)
+        self.base_path = config.get('base_path', DEF_BASE_PATH)
+        self.reqlim = 0
+
+        self._pool = ThreadPool(self.workers)
+        self._done = Queue.Queue()
+        self._chunks = Queue.Queue()
+        self._waker = _Waker(self)
+        self._running = False
+
+        # statistics
+        self._statlock = threading.Lock()
+        self.pending = 0         # requests submitted but not yet answered
+        self.active = 0          # requests being run by a worker
+        self.max_queued = 0      # the greatest number waiting for a worker
+        self.handled = 0         # requests answered (including rejections)
+        self.rejected = 0        # requests rejected due to the pending limit
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(server_address)
+        self.server_address = self.socket.getsockname()
+        self.listen(max(self.max_pending, 5))
+
+    @property
+    def queued(self):
+        """
+        the number of requests waiting for a worker thread
+        """
+        return self.pending - self.active
+
+    def stats(self):
+        """
+        return a dictionary of statistics describing the server's load:
+        the number of open connections, the number of requests in
+        progress ("active") and waiting for a worker ("queued"), the
+        greatest number that have been queued at once, and the numbers of
+        requests handled and rejected.
+        """
+        with self._statlock:
+            return { "connections": len(self._map) - 2,
+                     "workers": self.workers,
+                     "active": self.active,
+                     "queued": self.pending - self.active,
+                     "max_queued": self.max_queued,
+                     "handled": self.handled,
+                     "rejected": self.rejected }
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        _Connection(self, pair[0], pair[1])
+
+    def submit(self, conn, env):
+        """
+        arrange for the WSGI application to handle the request from the
+        given connection.  This is called from the event loop.
+        """
+        if self.stats_path and env['PATH_INFO'] == self.stats_path:
+            body = json.dumps(self.stats())
+            conn.respond("200 OK", [("Content-Type", "application/json"),
+                                    ("Content-Length", str(len(body)))],
+                         [body])
+            return
+
+        if not self._split_base_path(env):
+            with self._statlock:
+                self.handled += 1
+            conn.respond("404 Not Found", [], [])
+            return
+
+        with self._statlock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                self.handled += 1
+                reject = True
+            else:
+                self.pending += 1
+                self.max_queued = max(self.max_queued,
+                                      self.pending - self.active)
+                reject = False
+        if reject:
+            log.warning("Too many pending requests; rejecting request for %s",
+                        env['PATH_INFO'])
+            conn.respond("503 Service Unavailable", [("Retry-After", "5")], [])
+            return
+
+        self._pool.apply_async(self._run, (conn, env))
+
+    def _split_base_path(self, env):
+        # move the base path from PATH_INFO to SCRIPT_NAME; return False if
+        # the requested path is not under the base path
+        base = self.base_path.rstrip('/')
+        if not base:
+            return True
+        path = env['PATH_INFO']
+        if path != base and not path.startswith(base+'/'):
+            return False
+        env['SCRIPT_NAME'] = base
+        env['PATH_INFO'] = path[len(base):]
+        return True
+
+    def _run(self, conn, env):
+        # run the application within a worker thread
+        with self._statlock:
+            self.active += 1
+        resp = []
+        def start_response(status, headers, exc_info=None):
+            if exc_info and resp:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            resp[:] = [status, headers]
+
+        try:
+            try:
+                body = self.app(env, start_response)
+                if not resp:
+                    # a generator may not call start_response until its first
+                    # iteration
+                    body = _Prefetched(body)
+            except Exception, ex:
+                log.exception("Unexpected failure handling request for %s: %s",
+                              env['PATH_INFO'], str(ex))
+                resp[:] = ["500 Internal Server Error", []]
+                body = []
+            self._done.put((conn, resp[0], resp[1], body))
+        finally:
+            with self._statlock:
+                self.active -= 1
+            self._waker.wake()
+
+    def _send_completed(self):
+        # send the responses and the response body chunks from the workers
+        # (called from the event loop)
+        while True:
+            try:
+                conn, status, headers, body = self._done.get_nowait()
+            except Queue.Empty:
+                break
+            with self._statlock:
+                self.pending -= 1
+                self.handled += 1
+            conn.respond(status, headers, body)
+
+        while True:
+            try:
+                streamer, chunk = self._chunks.get_nowait()
+            except Queue.Empty:
+                break
+            streamer.deliver(chunk)
+
+    def serve_forever(self, timeout=1.0):
+        """
+        run the event loop until stop() is called
+        """
+        self._running = True
+        while self._running:
+            asyncore.loop(timeout, True, self._map, 1)
+
+    def handle_limited_requests(self, timeout=1.0):
+        """
+        run the event loop until the number of requests set by the
+        reqlim attribute have been handled and their responses sent.
+        """
+        self._running = True
+        while self._running and \
+              (self.handled < self.reqlim or len(self._map) > 2):
+            asyncore.loop(timeout, True, self._map, 1)
+        self._running = False
+
+    def stop(self):
+        """
+        stop the event loop (after its current iteration)
+        """
+        self._running = False
+        self._waker.wake()
+
+    def server_close(self):
+        """
+        close the server's socket, its connections, and its worker pool
+        """
+        self._pool.close()
+        asyncore.close_all(self._map)
+
+    def handle_error(self):
+        log.exception("Unexpected server error")
+
+class _Prefetched(object):
+    # wraps a WSGI response iterable whose first item has been fetched
+    # (to trigger a delayed call to start_response)
+    def __init__(self, body):
+        self._body = body
+        self._it = iter(body)
+        self._first = [next(self._it, '')]
+
+    def __iter__(self):
+        while self._first:
+            yield self._first.pop()
+        for chunk in self._it:
+            yield chunk
+
+    def close(self):
+        if hasattr(self._body, 'close'):
+            self._body.close()
+
+class _Waker(asyncore.file_dispatcher):
+    # lets worker threads wake up the event loop
+    def __init__(self, server):
+        rfd, self._wfd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, rfd, server._map)
+        os.close(rfd)
+        self._server = server
+
+    def wake(self):
+        try:
+            os.write(self._wfd, 'x')
+        except OSError:
+            pass
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(8192)
+        except (OSError, socket.error):
+            pass
+        self._server._send_completed()
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        try:
+            os.close(self._wfd)
+        except OSError:
+            pass
+
+class _BodyProducer(object):
+    # feeds a WSGI response list (already in memory) to an async_chat, one
+    # item at a time
+    def __init__(self, body):
+        self._body = body
+        self._it = iter(body)
+
+    def more(self):
+        for chunk in self._it:
+            if chunk:
+                return chunk
+        self.close()
+        return ''
+
+    def close(self):
+        if self._body is not None:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+            self._body = None
+
+class _BodyStreamer(object):
+    # feeds any other WSGI response iterable (e.g. one reading a data file)
+    # to a connection.  Each chunk is produced by a worker thread and handed
+    # to the event loop via the server's waker; the next chunk is fetched
+    # while the current one is being sent.
+
+    def __init__(self, conn, body):
+        self._conn = conn
+        self._body = body
+        self._it = iter(body)
+        self._lock = threading.Lock()
+        self._fetching = False
+        self._closed = False
+        self._held = []
+
+    def fetch(self):
+        # start fetching the next chunk (called from the event loop)
+        with self._lock:
+            if self._fetching or self._closed:
+                return
+            self._fetching = True
+        try:
+            self._conn.server._pool.apply_async(self._fetch)
+        except ValueError:
+            # the server is shutting down
+            with self._lock:
+                self._fetching = False
+            self._conn.close()
+
+    def _fetch(self):
+        # runs in a worker thread; None marks the end of the body
+        chunk = ''
+        try:
+            while not chunk:
+                chunk = next(self._it)
+        except StopIteration:
+            chunk = None
+        except Exception, ex:
+            log.exception("Unexpected failure producing response body: %s",
+                          str(ex))
+            chunk = None
+
+        with self._lock:
+            self._fetching = False
+            closed = self._closed
+        if closed:
+            # the connection was closed while we were fetching
+            self._close_body()
+            return
+        self._conn.server._chunks.put((self, chunk))
+        self._conn.server._waker.wake()
+
+    def deliver(self, chunk):
+        # accept a fetched chunk (called from the event loop)
+        if self._closed:
+            return
+        self._held.append(chunk)
+        self.drained()
+
+    def drained(self):
+        # send the held chunk, if any, once the connection has sent what it
+        # was given previously (called from the event loop)
+        while self._held and not self._conn.producer_fifo and not self._closed:
+            chunk = self._held.pop()
+            if chunk is None:
+                self._close_body()
+                self._conn.close_when_done()
+                return
+            self._conn.push(chunk)
+            self.fetch()
+
+    def _close_body(self):
+        if self._body is not None:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+            self._body = None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            fetching = self._fetching
+        if not fetching:
+            self._close_body()
+
+class _Connection(asynchat.async_chat):
+    # a connection to a client
+
+    def __init__(self, server, sock, addr):
+        asynchat.async_chat.__init__(self, sock, server._map)
+        self.ac_out_buffer_size = DEF_BLOCK_SIZE
+        self.server = server
+        self.addr = addr
+        self._inbuf = []
+        self._inlen = 0
+        self._producer = None
+        self.set_terminator("\r\n\r\n")
+
+    def collect_incoming_data(self, data):
+        if self._inbuf is None:
+            # request already received; ignore anything else sent
+            return
+        self._inlen += len(data)
+        if self._inlen > MAX_HEADER_SIZE:
+            self._inbuf = None
+            self.respond("431 Request Header Fields Too Large", [], [])
+            return
+        self._inbuf.append(data)
+
+    def found_terminator(self):
+        if self._inbuf is None:
+            return
+        head = "".join(self._inbuf)
+        self._inbuf = None
+        self.set_terminator(None)
+
+        env = self.make_environ(head)
+        if env is None:
+            self.respond("400 Bad Request", [], [])
+            return
+        self.server.submit(self, env)
+
+    def make_environ(self, head):
+        """
+        create the WSGI environment for the request with the given header
+        (request line and header fields), or None if it cannot be parsed.
+        """
+        lines = head.split("\r\n")
+        words = lines[0].split()
+        if len(words) != 3 or not words[2].startswith("HTTP/"):
+            return None
+        path, sep, query = words[1].partition('?')
+
+        env = {
+            'REQUEST_METHOD':    words[0],
+            'PATH_INFO':         urllib.unquote(path),
+            'QUERY_STRING':      query,
+            'SERVER_PROTOCOL':   words[2],
+            'SERVER_NAME':       self.server.server_address[0],
+            'SERVER_PORT':       str(self.server.server_address[1]),
+            'REMOTE_ADDR':       self.addr and self.addr[0] or '',
+            'SCRIPT_NAME':       '',
+            'wsgi.version':      (1, 0),
+            'wsgi.url_scheme':   'http',
+            'wsgi.input':        StringIO(''),
+            'wsgi.errors':       sys.stderr,
+            'wsgi.multithread':  True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once':     False,
+            'wsgi.file_wrapper': FileWrapper
+        }
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in env:
+                value = env[name] + "," + value
+            env[name] = value
+
+        return env
+
+    def respond(self, status, headers, body):
+        """
+        send the response to the client and then close the connection.  This
+        must be called from the event loop.
+        """
+        if not self.connected:
+            # the client gave up
+            _BodyProducer(body).close()
+            return
+        headers = [h for h in headers if h[0].lower() != 'connection']
+        head = ["HTTP/1.0 " + status] + \
+               ["{0}: {1}".format(n, v) for n, v in headers] + \
+               ["Connection: close", "", ""]
+        self.push("\r\n".join(head))
+        if isinstance(body, (list, tuple)):
+            self._producer = _BodyProducer(body)
+            self.push_with_producer(self._producer)
+            self.close_when_done()
+        else:
+            self._producer = _BodyStreamer(self, body)
+            self._producer.fetch()
+
+    def handle_write(self):
+        asynchat.async_chat.handle_write(self)
+        if isinstance(self._producer, _BodyStreamer):
+            self._producer.drained()
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        if self._producer:
+            self._producer.close()
+        asynchat.async_chat.close(self)
+
+    def handle_error(self):
+        log.exception("Unexpected error while communicating with %s",
+                      str(self.addr))
+        self.close()
+
+class AsyncMetadataServer(AsyncWSGIServer, PublishSystem):
+    """
+    an event-driven web server for serving pre-publication metadata (and
+    data files) for the pre-publication landing page service.
+
+    This server takes the same configuration as the PrePubMetadaRequestApp
+    (from the wsgi module); the "async_server" property can contain the
+    parameters for the server itself (see AsyncWSGIServer).  As with the
+    PrePubMetadataWebServer, requests are expected under the URL path given
+    by the "base_path" property (default: "/midas/").
+    """
+
+    def __init__(self, server_address, config):
+        AsyncWSGIServer.__init__(self, server_address,
+                                 PrePubMetadaRequestApp(config),
+                                 config.get('async_server', {}))
+        self.base_path = config.get('base_path', DEF_MIDAS_BASE_PATH)
+        self.mdsvc = self.app.mdsvc
@@ -0,0 +1,146 @@
+"""
+This module provides an in-memory cache of ready-to-send response bodies for
+the metadata service.
+
+Serializing a large NERDm record for every request is expensive; the
+ResponseCache keeps the serialized bodies of recently requested records,
+keyed by the dataset identifier and the fingerprint of the SIP it was
+created from (see PrePubMetadataService.current_fingerprint()).  A body 
+can also be cached in content-coded (e.g. gzip) forms alongside the 
+uncoded one.  When a body is cached under a new fingerprint for an 
+identifier, bodies cached under older fingerprints are dropped.
+"""
+import threading, zlib
+from collections import OrderedDict
+
+DEF_MAX_ENTRIES = 100
+DEF_MAX_BYTES = 256 * 1024 * 1024   # 256 MB
+
+def gzip_compress(data, level=6):
+    """
+    compress the given bytes into the gzip format
+    """
+    comp = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return comp.compress(data) + comp.flush()
+
+def gzip_decompress(data):
+    """
+    decompress the given gzip-formatted bytes
+    """
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+class ResponseCache(object):
+    """
+    a bounded, thread-safe, least-recently-used cache of response bodies.
+    Each key is a 2-tuple of an identifier and a fingerprint of the state
+    the body was generated from.
+
+    This class can take a configuration dictionary on construction; the
+    following properties are supported:
+    :prop max_entries int (100):  the maximum number of bodies to hold
+    :prop max_bytes   int (256 MB):  the maximum total size of the bodies
+                         held (as stored, i.e. after compression)
+    :prop compress   bool (False):  if True, bodies are stored
+                         gzip-compressed, trading CPU for memory.
+    """
+
+    def __init__(self, config=None):
+        if config is None:
+            config = {}
+        self.max_entries = config.get('max_entries', DEF_MAX_ENTRIES)
+        self.max_bytes = config.get('max_bytes', DEF_MAX_BYTES)
+        self.compress = config.get('compress', False)
+
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, encoding=None):
+        """
+        return the body cached with the given key, or None if it is not
+        in the cache.
+
+        :param key      tuple:  the identifier and fingerprint of the body
+        :param encoding   str:  the content coding (e.g. "gzip") of the 
+                                form of the body wanted; None means the 
+                                uncoded body.
+        """
+        with self._lock:
+            data = self._data.pop(key + (encoding,), None)
+            if data is not None:
+                self._data[key + (encoding,)] = data
+            elif encoding == "gzip" and self.compress:
+                # the uncoded body is stored in gzip form already
+                data = self._data.pop(key + (None,), None)
+                if data is not None:
+                    self._data[key + (None,)] = data
+                    self.hits += 1
+                    return data
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        if self.compress and not encoding:
+            data = gzip_decompress(data)
+        return data
+
+    def put(self, key, body, encoding=None):
+        """
+        cache a response body.  Any bodies cached for the same identifier
+        under a different fingerprint are removed.
+
+        :param key      tuple:  the identifier and fingerprint of the body
+        :param body       str:  the body to cache
+        :param encoding   str:  the content coding already applied to the 
+                                body (e.g. "gzip"); None means it is uncoded.
+        """
+        data = body
+        if self.compress and not encoding:
+            data = gzip_compress(body)
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._drop(key[0], key[1])
+            self._data[key + (encoding,)] = data
+            self._bytes += len(data)
+            while len(self._data) > self.max_entries or \
+                  self._bytes > self.max_bytes:
+                self._bytes -= len(self._data.popitem(last=False)[1])
+
+    def invalidate(self, id):
+        """
+        remove any bodies cached for the given identifier
+        """
+        with self._lock:
+            self._drop(id)
+
+    def _drop(self, id, keep=None):
+        # remove the bodies for id, except those with the fingerprint, keep
+        for key in [k for k in self._data if k[0] == id and 
+                                             (keep is None or k[1] != keep)]:
+            self._bytes -= len(self._data.pop(key))
+
+    def clear(self):
+        """
+        empty the cache (without resetting the hit/miss counters)
+        """
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """
+        return a dictionary of statistics describing the use of the cache:
+        its hit and miss counts and the number and total size of the bodies
+        it currently holds.
+        """
+        with self._lock:
+            return { "hits": self.hits, "misses": self.misses,
+                     "entries": len(self._data), "bytes": self._bytes }
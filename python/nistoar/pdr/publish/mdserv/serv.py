@@ -3,18 +3,54 @@ This module manages the preparation of the metadata needed by pre-publication
 landing page service.  It uses an SIPBagger to create the NERDm metadata from 
 POD metadata provided by MIDAS and assembles it into an exportable form.  
 """
-import os, logging, re, json
-from collections import Mapping
+import os, logging, re, json, time, threading, filelock, bisect
+from collections import Mapping, OrderedDict
+from copy import deepcopy
 
 from .. import PublishSystem
 from ...exceptions import ConfigurationException, StateException, SIPDirectoryNotFound
 from ...preserv.bagger import MIDASMetadataBagger
+from ...preserv.bagger.midas import fingerprint_of
 from ...preserv.bagit import NISTBag
+from ...preserv.bagit.compindex import ComponentIndex, COMPINDEX_FILENAME
+from ...preserv.bagit.exceptions import ComponentNotFound
 from ...utils import build_mime_type_map
 from ....id import PDRMinter
 
 log = logging.getLogger(PublishSystem().subsystem_abbrev)
 
+# the default number of seconds to remember an unknown ID and the maximum
+# number of unknown IDs to remember
+DEF_NOTFOUND_TTL = 30
+MAX_NOTFOUND = 10000
+
+# the number of SIPs whose data file locations (and component listings) 
+# are kept in memory
+DATAFILES_CACHE_SIZE = 100
+
+# the default number of seconds to wait for another process to finish 
+# preparing a metadata bag
+DEF_PREPARE_LOCK_TIMEOUT = 300
+
+# the default for fingerprint arguments, indicating that the caller has not
+# already checked the SIP's fingerprint
+_UNCHECKED = object()
+
+class PreparationTimeout(StateException):
+    """
+    an exception indicating that the metadata bag for a SIP could not be 
+    accessed because another process has been preparing it for too long.
+    The request may succeed if it is tried again later.
+    """
+    pass
+
+class _Flight(object):
+    # a preparation of a SIP in progress that other threads can wait on
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
 class PrePubMetadataService(PublishSystem):
     """
     The class providing the implementation for the pre-publication metadata
@@ -46,6 +82,24 @@ class PrePubMetadataService(PublishSystem):
     :prop bagger dict ({}):  a dictionary for configuring the SIPBagger instance
                       used to process the SIP (see SIPBagger implementation 
                       documentation for supported sub-properties).  
+    :prop notfound_ttl float (30):  the number of seconds to remember that
+                      no SIP exists for a requested ID.  Within this time, 
+                      repeated requests for that ID are answered from memory
+                      (unless a directory has since been added to, or removed
+                      from, the review or upload directory).  A value of 0 
+                      turns off this memory.
+    :prop sip_fingerprint bool (True):  if True, a fingerprint of the SIP 
+                      (see MIDASMetadataBagger.sip_fingerprint()) is saved 
+                      with the metadata bag along with the assembled NERDm 
+                      record and the locations of the SIP's data files.  
+                      When the SIP's fingerprint is unchanged, preparation is
+                      skipped and the saved record is returned without 
+                      examining the SIP further.  Checking the fingerprint 
+                      requires a stat of each of the SIP's data files.
+    :prop prepare_lock_timeout float (300):  the maximum number of seconds to
+                      wait for another thread or process to finish preparing
+                      (or otherwise updating) the metadata bag for a SIP 
+                      before giving up with a PreparationTimeout exception.
     """
 
     def __init__(self, config, workdir=None, reviewdir=None, uploaddir=None,
@@ -117,6 +171,21 @@ class PrePubMetadataService(PublishSystem):
             mimefiles = [mimefiles]
         self.mimetypes = build_mime_type_map(mimefiles)
 
+        # preparations in progress, by ID
+        self._flights = {}
+        self._flightlock = threading.Lock()
+
+        # the IDs recently found not to exist:  id -> (expiration time, 
+        # parent directory mtimes, exception)
+        self._notfound = OrderedDict()
+        self._notfoundlock = threading.Lock()
+
+        # the data files and component listings of recently requested, 
+        # unchanged SIPs, by ID
+        self._datafiles = OrderedDict()
+        self._listings = OrderedDict()
+        self._datafileslock = threading.Lock()
+
     def _create_minter(self, parentdir):
         cfg = self.cfg.get('id_minter', {})
         out = PDRMinter(parentdir, cfg)
@@ -127,17 +196,268 @@ class PrePubMetadataService(PublishSystem):
     def prepare_metadata_bag(self, id):
         """
         Bag up the metadata from data provided by MIDAS for a given MIDAS ID.  
+
+        Concurrent requests for the same ID share a single preparation:  
+        a thread that finds a preparation of the ID already in progress in 
+        this process waits for it and returns its result.  Across processes,
+        preparation is serialized by a lock file next to the bag, and a 
+        process that had to wait for another to finish preparing the bag 
+        reuses that result rather than preparing it again.  In either case,
+        a request waits no longer than the 'prepare_lock_timeout' 
+        configuration parameter before PreparationTimeout is raised.
         """
-        cfg = self.cfg.get('bagger', {})
+        return self._prepare(id)[0]
+
+    def _prepare(self, id, checked=False):
+        # prepare the bag as described in prepare_metadata_bag(), returning
+        # the bagger and the SIP's fingerprint as saved with the bag.  If 
+        # checked is True, the caller has already found that the SIP's 
+        # fingerprint does not match the saved one.
+        notfound = self._known_not_found(id)
+        if notfound:
+            raise notfound
+
+        with self._flightlock:
+            flight = self._flights.get(id)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[id] = flight
+
+        if not leader:
+            timeout = self.cfg.get('prepare_lock_timeout',
+                                   DEF_PREPARE_LOCK_TIMEOUT)
+            if not flight.done.wait(timeout):
+                self.log.error("Timed out waiting for preparation of %s "+
+                               "(after %s seconds)", id, str(timeout))
+                raise PreparationTimeout("Metadata bag for " + id + " is " +
+                                         "still being prepared", sys=self)
+            if flight.error:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._prepare_metadata_bag(id, checked)
+        except SIPDirectoryNotFound, ex:
+            self._remember_not_found(id, ex)
+            flight.error = ex
+            raise
+        except Exception, ex:
+            flight.error = ex
+            raise
+        finally:
+            with self._flightlock:
+                del self._flights[id]
+            flight.done.set()
+
+        return flight.result
+
+    def _prepare_metadata_bag(self, id, checked=False):
         if not os.path.exists(self.workdir):
-            os.mkdir(workdir)
+            os.mkdir(self.workdir)
         elif not os.path.isdir(self.workdir):
             raise StateException("Working directory path not a directory: " +
                                  self.workdir)
-        bagger = MIDASMetadataBagger(id, self.workdir, self.reviewdir,
-                                     self.uploaddir, cfg, self._minter)
-        bagger.ensure_preparation()
-        return bagger
+
+        usefp = self.cfg.get('sip_fingerprint', True)
+        if usefp and not checked:
+            fp = self.current_fingerprint(id)
+            datafiles = fp and self._saved_datafiles(id, fp)
+            if datafiles is not None:
+                self.log.debug("SIP unchanged; skipping preparation of %s", id)
+                bagger = self._create_bagger(id)
+                bagger.datafiles = datafiles
+                return (bagger, fp)
+
+        bagger = self._create_bagger(id)
+
+        # the stamp file is touched after each successful preparation
+        stampfile = bagger.bagdir + ".prepared"
+        lock = filelock.FileLock(bagger.bagdir + ".lock")
+        try:
+            lock.acquire(timeout=0)
+        except filelock.Timeout:
+            # another process is preparing this bag; wait for it to finish
+            before = self._mtime_of(stampfile)
+            self._acquire_bag_lock(lock, id)
+            if self._mtime_of(stampfile) != before and \
+               bagger.recall_preparation():
+                lock.release()
+                self.log.debug("Reusing concurrent preparation of %s", id)
+                fp = usefp and self._read_fingerprint(bagger.bagdir)[0] or None
+                return (bagger, fp)
+
+        fp = None
+        try:
+            bagger.ensure_preparation()
+            with open(stampfile, 'a'):
+                os.utime(stampfile, None)
+            if usefp:
+                fp = self._save_fingerprint(bagger)
+        finally:
+            lock.release()
+        return (bagger, fp)
+
+    def _create_bagger(self, id):
+        return MIDASMetadataBagger(id, self.workdir, self.reviewdir,
+                                   self.uploaddir, self.cfg.get('bagger', {}),
+                                   self._minter)
+
+    def _acquire_bag_lock(self, lock, id):
+        # wait a bounded amount of time for the lock on a metadata bag
+        timeout = self.cfg.get('prepare_lock_timeout',
+                               DEF_PREPARE_LOCK_TIMEOUT)
+        try:
+            lock.acquire(timeout=timeout)
+        except filelock.Timeout:
+            self.log.error("Timed out waiting for metadata bag for %s to be "+
+                           "released (after %s seconds)", id, str(timeout))
+            raise PreparationTimeout("Metadata bag for " + id + " is still " +
+                                     "being prepared by another process",
+                                     sys=self)
+
+    def _parent_mtimes(self):
+        # a summary of the state of the SIP parent directories: a new SIP 
+        # directory will change it
+        return (self._mtime_of(self.reviewdir), self._mtime_of(self.uploaddir))
+
+    def _known_not_found(self, id):
+        # return the SIPDirectoryNotFound exception recorded for the given ID
+        # if it is still applicable; otherwise, return None
+        with self._notfoundlock:
+            known = self._notfound.get(id)
+        if not known:
+            return None
+        if known[0] > time.time() and known[1] == self._parent_mtimes():
+            return known[2]
+        with self._notfoundlock:
+            self._notfound.pop(id, None)
+        return None
+
+    def _remember_not_found(self, id, ex):
+        ttl = self.cfg.get('notfound_ttl', DEF_NOTFOUND_TTL)
+        if ttl <= 0:
+            return
+        known = (time.time() + ttl, self._parent_mtimes(), ex)
+        with self._notfoundlock:
+            self._notfound.pop(id, None)
+            self._notfound[id] = known
+            while len(self._notfound) > MAX_NOTFOUND:
+                self._notfound.popitem(last=False)
+
+    def _mtime_of(self, filepath):
+        try:
+            return os.stat(filepath).st_mtime
+        except OSError:
+            return None
+
+    def _read_fingerprint(self, bagdir):
+        # return the fingerprint saved with the bag and the paths it was 
+        # calculated from
+        try:
+            with open(bagdir + ".fingerprint") as fd:
+                saved = json.load(fd)
+            return (saved['fingerprint'], saved['sip'], saved['bag'])
+        except (IOError, ValueError, KeyError, TypeError):
+            return (None, None, None)
+
+    def _save_fingerprint(self, bagger):
+        # save the fingerprint of the just-prepared SIP along with the 
+        # locations of its data files; return the fingerprint (or None if
+        # one could not be formed)
+        fpfile = bagger.bagdir + ".fingerprint"
+        paths = bagger.sip_fingerprint_paths()
+        fp = paths and fingerprint_of(*paths)
+        if not fp:
+            # the SIP is still in flux
+            if os.path.exists(fpfile):
+                os.remove(fpfile)
+            return None
+        self._write_atomically(fpfile, json.dumps({ "fingerprint": fp,
+                                                    "sip": paths[0],
+                                                    "bag": paths[1],
+                                                 "datafiles": bagger.datafiles }))
+        return fp
+
+    def _saved_datafiles(self, id, fp):
+        # return the data file locations saved with the given fingerprint, 
+        # or None if they are not available
+        try:
+            with open(os.path.join(self.workdir, id) + ".fingerprint") as fd:
+                saved = json.load(fd)
+            if saved['fingerprint'] == fp:
+                return saved['datafiles']
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _check_fingerprint(self, id, fingerprint):
+        # return the fingerprint given by a caller or, if the caller did not 
+        # check it, the current one
+        if fingerprint is _UNCHECKED:
+            return self.current_fingerprint(id)
+        return fingerprint
+
+    def current_fingerprint(self, id):
+        """
+        return the fingerprint of the SIP with the given ID as saved at its
+        last preparation if nothing has changed since then.  None is 
+        returned if the SIP has changed, has not been prepared, or
+        fingerprinting is not enabled.  This is cheap to call:  it does not
+        examine the SIP beyond checking the status of the paths the 
+        fingerprint was calculated from.  Callers handling a request can 
+        pass the result to the other methods of this service (as their 
+        fingerprint argument) so that it need not be checked again.
+        """
+        if not self.cfg.get('sip_fingerprint', True):
+            return None
+        fp, sippaths, bagpaths = \
+            self._read_fingerprint(os.path.join(self.workdir, id))
+        if fp and fingerprint_of(sippaths, bagpaths) == fp:
+            return fp
+        return None
+
+    def last_prepared(self, id):
+        """
+        return the time (as epoch seconds) that the metadata bag for the SIP
+        with the given ID was last prepared with a reliable fingerprint, or
+        None if it is not known.
+        """
+        return self._mtime_of(os.path.join(self.workdir, id) + ".fingerprint")
+
+    def _write_atomically(self, destfile, content):
+        tmpfile = "{0}.{1}.tmp".format(destfile, os.getpid())
+        try:
+            with open(tmpfile, 'w') as fd:
+                fd.write(content)
+            os.rename(tmpfile, destfile)
+        except (IOError, OSError), ex:
+            self.log.warning("Unable to write %s: %s", destfile, str(ex))
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+
+    def _prepared_datafiles(self, id, fp):
+        # return the data files found by the last preparation of the SIP
+        # if its current fingerprint, fp, matches the one saved then; 
+        # otherwise, return None
+        if not fp:
+            return None
+
+        with self._datafileslock:
+            cached = self._datafiles.pop(id, None)
+            if cached and cached[0] == fp:
+                self._datafiles[id] = cached
+                return cached[1]
+
+        datafiles = self._saved_datafiles(id, fp)
+        if datafiles is None:
+            return None
+
+        with self._datafileslock:
+            self._datafiles[id] = (fp, datafiles)
+            while len(self._datafiles) > DATAFILES_CACHE_SIZE:
+                self._datafiles.popitem(last=False)
+        return datafiles
 
     def make_nerdm_record(self, bagdir, datafiles=None, baseurl=None):
         """
@@ -166,38 +486,239 @@ class PrePubMetadataService(PublishSystem):
                             conversion will not be applied unless 
                             'download_base_url' is set (see above).  
         """
-        bag = NISTBag(bagdir)
+        bag = NISTBag(bagdir, cache_record=True)
         out = bag.nerdm_record()
 
-        if not baseurl:
-            baseurl = self.cfg.get('download_base_url')
-        if baseurl and 'components' in out:
-            ddspath = self.cfg.get('datadist_base_url', '/od/ds/')
-            if ddspath[0] != '/':
-                ddspath = '/' + ddspath
-            pat = re.compile(r'https?://[\w\.]+(:\d+)?'+ddspath)
-            for comp in out['components']:
-                # do a download URL substitution if 1) it looks like a
-                # distribution service URL, and 2) the file exists in our
-                # SIP areas.  
-                if 'downloadURL' in comp and pat.search(comp['downloadURL']):
-                    # it matches
-                    filepath = comp.get('filepath',
-                                        pat.sub('',comp['downloadURL']))
-                    if datafiles is None or filepath in datafiles:
-                        # it exists
-                        comp['downloadURL'] = pat.sub(baseurl,
-                                                      comp['downloadURL'])
+        if 'components' in out:
+            self._convert_download_urls(out['components'], datafiles, baseurl)
 
         return out
 
-    def resolve_id(self, id):
+    def iter_nerdm_record(self, bagdir, datafiles=None, baseurl=None):
+        """
+        Given a metadata bag, return an iterator that produces a complete
+        NERDm resource record serialized as JSON, a chunk at a time.  This 
+        is the streaming counterpart to make_nerdm_record() (which describes
+        the arguments):  the components are read from the bag and converted 
+        one at a time, so that the full record is never held in memory.
+        """
+        def convert(comp):
+            self._convert_download_urls([comp], datafiles, baseurl)
+        return NISTBag(bagdir).iter_nerdm_record(comp_filter=convert)
+
+    def _convert_download_urls(self, comps, datafiles=None, baseurl=None):
+        # convert the downloadURLs in the given components as described in
+        # make_nerdm_record()
+        if not baseurl:
+            baseurl = self.cfg.get('download_base_url')
+        if not baseurl:
+            return
+        ddspath = self.cfg.get('datadist_base_url', '/od/ds/')
+        if ddspath[0] != '/':
+            ddspath = '/' + ddspath
+        pat = re.compile(r'https?://[\w\.]+(:\d+)?'+ddspath)
+        for comp in comps:
+            # do a download URL substitution if 1) it looks like a
+            # distribution service URL, and 2) the file exists in our
+            # SIP areas.  
+            if 'downloadURL' in comp and pat.search(comp['downloadURL']):
+                # it matches
+                filepath = comp.get('filepath',
+                                    pat.sub('',comp['downloadURL']))
+                if datafiles is None or filepath in datafiles:
+                    # it exists
+                    comp['downloadURL'] = pat.sub(baseurl,
+                                                  comp['downloadURL'])
+
+    def resolve_id(self, id, fingerprint=_UNCHECKED):
         """
         return a full NERDm resource record corresponding to the given 
         MIDAS ID.  
+
+        :param fingerprint str:  the SIP's fingerprint as returned by 
+                                 current_fingerprint() if the caller has
+                                 already checked it (including None); if 
+                                 not given, it is checked here.
+        """
+        return self.fingerprinted_record(id, fingerprint)[0]
+
+    def stream_id(self, id, fingerprint=_UNCHECKED):
+        """
+        return an iterator that produces the full NERDm resource record 
+        corresponding to the given MIDAS ID serialized as JSON, a chunk at a
+        time.  Unlike resolve_id(), the assembled record is not saved for 
+        reuse.  The metadata bag is prepared before this function returns, 
+        so errors locating the SIP are raised immediately.
+
+        :param fingerprint str:  the SIP's fingerprint, as with resolve_id()
+        """
+        return self.fingerprinted_record(id, fingerprint, True)[0]
+
+    def fingerprinted_record(self, id, fingerprint=_UNCHECKED, stream=False):
+        """
+        return the full NERDm resource record corresponding to the given
+        MIDAS ID (as with resolve_id(), or with stream_id() if stream is 
+        True) along with the fingerprint of the SIP that it reflects.  The
+        fingerprint is None if the SIP could not be fingerprinted.  When 
+        the SIP is unchanged, the record saved from its last preparation is
+        returned without examining the SIP further.
+
+        :param fingerprint str:  the SIP's fingerprint, as with resolve_id()
+        :param stream     bool:  if True, return an iterator producing the 
+                                 serialized record
+        :return tuple:  the record (or iterator) and the fingerprint
+        """
+        fp = self._check_fingerprint(id, fingerprint)
+        if fp and not stream:
+            out = self._saved_record(id, fp)
+            if out is not None:
+                return (out, fp)
+
+        before = fp
+        bagdir, datafiles, fp = self._prepared_bag(id, fp)
+        if stream:
+            return (self.iter_nerdm_record(bagdir, datafiles), fp)
+
+        if fp and fp != before:
+            # the record may have been saved along with this preparation
+            out = self._saved_record(id, fp)
+            if out is not None:
+                return (out, fp)
+
+        out = self.make_nerdm_record(bagdir, datafiles)
+        if fp:
+            self._write_atomically(bagdir + ".record.json",
+                                   json.dumps({ "fingerprint": fp,
+                                                "record": out }))
+        return (out, fp)
+
+    def _saved_record(self, id, fp):
+        # return the record assembled when the SIP had the given fingerprint
+        # or None if it is not available
+        try:
+            with open(os.path.join(self.workdir, id) + ".record.json") as fd:
+                saved = json.load(fd, object_pairs_hook=OrderedDict)
+            if saved.get('fingerprint') == fp:
+                return saved['record']
+        except (IOError, ValueError, KeyError):
+            pass
+        return None
+
+    def get_component(self, id, filepath, fingerprint=_UNCHECKED):
+        """
+        return the NERDm metadata for a single component of the dataset with
+        the given ID.  The metadata is read directly from the metadata bag;
+        the full resource record is not assembled.  
+
+        :param id       str:   the dataset's identifier
+        :param filepath str:   the component's filepath within the dataset
+        :param fingerprint str:  the SIP's fingerprint, as with resolve_id()
+        :return dict:  the component metadata, or None if the dataset has no
+                       component with the given filepath
+        """
+        filepath = filepath.strip('/')
+        if not filepath or \
+           any([p in ('', '.', '..') for p in filepath.split('/')]):
+            return None
+        bagdir, datafiles, fp = \
+            self._prepared_bag(id, self._check_fingerprint(id, fingerprint))
+        bag = NISTBag(bagdir)
+
+        # only read the metadata of components known to the bag's index
+        filepaths = self._component_listing(id, bag, fp)[1]
+        i = bisect.bisect_left(filepaths, filepath)
+        if i == len(filepaths) or filepaths[i] != filepath:
+            return None
+
+        try:
+            comp = bag.nerd_metadata_for(filepath)
+        except ComponentNotFound:
+            return None
+        self._convert_download_urls([comp], datafiles)
+        return comp
+
+    def list_components(self, id, offset=0, limit=None, subcoll=None,
+                        fingerprint=_UNCHECKED):
+        """
+        return a page of the NERDm component metadata for the dataset with
+        the given ID.  Components are read directly from the metadata bag;
+        the full resource record is not assembled.  Components that are not 
+        part of the file hierarchy come first (in the order recorded), 
+        followed by the file components ordered by filepath.  
+
+        :param id      str:   the dataset's identifier
+        :param offset  int:   the number of components to skip 
+        :param limit   int:   the maximum number of components to return;
+                              if None, all remaining components are returned.
+        :param subcoll str:   if provided, restrict the listing to those 
+                              components that are direct members of the 
+                              subcollection with this filepath ("" selects 
+                              the top-level members).
+        :param fingerprint str:  the SIP's fingerprint, as with resolve_id()
+        :return dict:  a dictionary with the properties, "total" (the number
+                       of components matching the request), "offset", 
+                       "limit", and "components" (the list of components)
         """
-        bagger = self.prepare_metadata_bag(id)
-        return self.make_nerdm_record(bagger.bagdir, bagger.datafiles)
+        bagdir, datafiles, fp = \
+            self._prepared_bag(id, self._check_fingerprint(id, fingerprint))
+        bag = NISTBag(bagdir)
+
+        nonfiles, filepaths = self._component_listing(id, bag, fp)
+        if subcoll is not None:
+            subcoll = subcoll.strip('/')
+            nonfiles = []
+            filepaths = [fp for fp in filepaths
+                            if os.path.dirname(fp) == subcoll]
+
+        total = len(nonfiles) + len(filepaths)
+        end = total
+        if limit is not None:
+            end = min(offset + limit, total)
+
+        comps = deepcopy(nonfiles[offset:end])
+        for fp in filepaths[max(offset - len(nonfiles), 0):
+                            max(end - len(nonfiles), 0)]:
+            try:
+                comps.append(bag.nerd_metadata_for(fp))
+            except ComponentNotFound:
+                self.log.warning("%s: component metadata missing for %s",
+                                 id, fp)
+        self._convert_download_urls(comps, datafiles)
+
+        return OrderedDict([ ("total", total), ("offset", offset),
+                             ("limit", limit), ("components", comps) ])
+
+    def _prepared_bag(self, id, fp):
+        # ensure that the metadata bag is up to date given the SIP's current
+        # fingerprint, fp, returning the bag's directory, the SIP's data 
+        # files, and the fingerprint saved with the bag
+        datafiles = self._prepared_datafiles(id, fp)
+        if datafiles is not None:
+            return (os.path.join(self.workdir, id), datafiles, fp)
+        bagger, fp = self._prepare(id, True)
+        return (bagger.bagdir, bagger.datafiles, fp)
+
+    def _component_listing(self, id, bag, fp):
+        # return the components in the resource-level metadata and the
+        # sorted filepaths of the other components
+        if fp:
+            with self._datafileslock:
+                cached = self._listings.pop(id, None)
+                if cached and cached[0] == fp:
+                    self._listings[id] = cached
+                    return cached[1:]
+
+        nonfiles = bag.nerd_metadata_for("").get('components', [])
+        index = ComponentIndex(os.path.join(bag.dir, COMPINDEX_FILENAME),
+                               os.path.join(bag.dir, "metadata"))
+        filepaths = sorted([f for f, e in index.items()])
+
+        if fp:
+            with self._datafileslock:
+                self._listings[id] = (fp, nonfiles, filepaths)
+                while len(self._listings) > DATAFILES_CACHE_SIZE:
+                    self._listings.popitem(last=False)
+        return (nonfiles, filepaths)
 
     def locate_data_file(self, id, filepath):
         """
@@ -209,15 +730,20 @@ class PrePubMetadataService(PublishSystem):
                                  dataset
         :return tuple:  2-element tuple giving the full filepath and recommended
                                  MIME-type
+
+        If the SIP is unchanged since its metadata bag was last prepared (see 
+        current_fingerprint()), the file is located using the data file 
+        locations saved with that fingerprint and only the file's own component metadata is 
+        read; otherwise, the bag is prepared first.
         """
-        bagger = self.prepare_metadata_bag(id)
-        if filepath not in bagger.datafiles:
+        datafiles = self._prepared_bag(id, self.current_fingerprint(id))[1]
+        if filepath not in datafiles:
             return (None, None)
 
-        loc = bagger.datafiles[filepath]
+        loc = datafiles[filepath]
 
         # determine the MIME type to send data as
-        bag = NISTBag(bagger.bagdir, True)
+        bag = NISTBag(os.path.join(self.workdir, id), True)
         dfmd = bag.nerd_metadata_for(filepath)
         if 'mediaType' in dfmd and dfmd['mediaType']:
             mt = str(dfmd['mediaType'])
@@ -133,6 +133,10 @@ def _define_cli_options(progname):
                         help="use this server as the discovery server; if not "+
                              "provided, a default server will be consulted as "+
                              "needed")
+    parser.add_argument('-A', '--async', action='store_true', dest='useasync',
+                        help="run the event-driven server (which can handle "+
+                             "many requests concurrently) rather than the "+
+                             "one-request-at-a-time server")
     parser.add_argument('-L', '--response-limit', type=int, dest='reqlim',
                         default=0, metavar='NUM',
                         help="limit the number of requests that are accepted "+
@@ -201,13 +205,17 @@ def from_cli(args, progname="ppmdserve", config=None):
     if opts.port:
         port = opts.port
 
-    server = PrePubMetadataWebServer((host, port), config)
+    if opts.useasync or config.get('server_mode') == 'async':
+        from .asyncserver import AsyncMetadataServer
+        server = AsyncMetadataServer((host, port), config)
+    else:
+        server = PrePubMetadataWebServer((host, port), config)
 
     if opts.reqlim:
         server.reqlim = opts.reqlim
         target = server.handle_limited_requests
     else:
-        target = server.handle_forever
+        target = server.serve_forever
     thread = threading.Thread(target=target)
     if opts.detach:
         thread.daemon = True
@@ -5,24 +5,75 @@ This module provides the most basic implementation of a WSGI application
 necessary for integration into a WSGI server.  It should be replaced with 
 a framework-based implementation if any further capabilities are needed.
 """
-import os, sys, logging, json, re
+import os, sys, logging, json, re, uuid, cgi
 from wsgiref.headers import Headers
 
 from .. import PublishSystem
 from .serv import (PrePubMetadataService, SIPDirectoryNotFound,
-                   ConfigurationException, StateException)
+                   ConfigurationException, StateException, PreparationTimeout)
+from .cache import ResponseCache
+from ...wsgiutils import (make_etag, http_date, parse_http_date, not_modified,
+                          parse_range, iter_file, DEF_BLOCK_SIZE,
+                          choose_encoding, compress, iter_compressed,
+                          variant_etag)
 
 log = logging.getLogger(PublishSystem().subsystem_abbrev).getChild("mdserv")
 
 # DEF_BASE_PATH = "/midas/"
 DEF_BASE_PATH = "/"
+DEF_COMPRESS_MIN_SIZE = 1024
+DEF_STREAM_SIZE = 1024 * 1024
+DEF_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 class PrePubMetadaRequestApp(object):
+    """
+    the WSGI application for the pre-publication metadata service.
+
+    In addition to the parameters supported by PrePubMetadataService, this
+    class supports the following configuration properties:
+    :prop base_path str ("/"):  the base URL path for the service
+    :prop response_cache dict ({}):  the parameters for the in-memory cache 
+                     of serialized metadata responses (see 
+                     nistoar.pdr.publish.mdserv.cache.ResponseCache); in 
+                     addition, "enabled" (default: True) turns the cache on
+                     or off.  The cache requires that the sip_fingerprint 
+                     feature of the service be enabled.
+    :prop compression dict ({}):  the parameters controlling the compression
+                     of metadata responses for clients that accept it 
+                     (via gzip or deflate content coding):
+                       enabled bool (True): turns compression on or off
+                       level int (6):  the zlib compression level
+                       min_size int (1024):  responses smaller than this
+                                     number of bytes are not compressed
+                       stream_size int (1048576):  responses of at least 
+                                     this many bytes are compressed as they
+                                     are sent.
+    :prop stream_records bool (False):  if True, metadata records that are 
+                     not already in the response cache are serialized and
+                     sent a piece at a time as they are read from the 
+                     metadata bag rather than being assembled in memory 
+                     first.  This bounds the memory needed to serve very
+                     large records; however, such responses are sent without
+                     a Content-Length, and they are only cached if they fit
+                     within the response cache's limits.
+    """
 
     def __init__(self, config):
         self.base_path = config.get('base_path', DEF_BASE_PATH)
         self.mdsvc = PrePubMetadataService(config)
 
+        self.resp_cache = None
+        cachecfg = config.get('response_cache', {})
+        if cachecfg.get('enabled', True) and \
+           config.get('sip_fingerprint', True):
+            self.resp_cache = ResponseCache(cachecfg)
+
+        self.compression = config.get('compression', {})
+        if not self.compression.get('enabled', True):
+            self.compression = None
+        self.stream_records = config.get('stream_records', False)
+
         self.filemap = {}
         for loc in ('review_dir', 'upload_dir'):
             dir = config.get(loc)
@@ -30,7 +81,9 @@ class PrePubMetadaRequestApp(object):
                 self.filemap[dir] = "/midasdata/"+loc
 
     def handle_request(self, env, start_resp):
-        handler = Handler(self.mdsvc, self.filemap, env, start_resp)
+        handler = Handler(self.mdsvc, self.filemap, env, start_resp,
+                          self.resp_cache, self.compression,
+                          self.stream_records)
         return handler.handle()
 
     def __call__(self, env, start_resp):
@@ -42,8 +95,12 @@ class Handler(object):
 
     badidre = re.compile(r"[<>\s]")
 
-    def __init__(self, service, filemap, wsgienv, start_resp):
+    def __init__(self, service, filemap, wsgienv, start_resp, cache=None,
+                 compression=None, stream=False):
         self._svc = service
+        self._cache = cache
+        self._comp = compression
+        self._stream = stream
         self._fmap = filemap
         self._env = wsgienv
         self._start = start_resp
@@ -68,6 +125,20 @@ class Handler(object):
         self._code = code
         self._msg = message
 
+    def add_validators(self, etag, mtime):
+        if etag:
+            self.add_header('ETag', etag)
+        if mtime is not None:
+            self.add_header('Last-Modified', http_date(mtime))
+
+    def send_not_modified(self, etag, mtime, negotiated=False):
+        self.set_response(304, "Not Modified")
+        self.add_validators(etag, mtime)
+        if negotiated:
+            self.add_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return []
+
     def end_headers(self):
         status = "{0} {1}".format(str(self._code), self._msg)
         ###DEBUG:
@@ -103,28 +174,270 @@ class Handler(object):
             return []
         filepath = "/".join(parts[1:])
 
+        if len(parts) > 1 and parts[1] == "_comps":
+            filepath = "/".join(parts[2:])
+            if filepath:
+                return self.get_component(dsid, filepath)
+            return self.list_components(dsid)
         if filepath:
             return self.get_datafile(dsid, filepath)
         return self.get_metadata(dsid)
 
     def get_metadata(self, dsid):
-        
+        enc = self.choose_encoding()
+
+        # if the SIP is unchanged, the client may already have the record or
+        # we may have the response ready to go
+        body = None
+        bodyenc = None      # the content coding already applied to body
+        fp = self._svc.current_fingerprint(dsid)
+        if fp:
+            etag = make_etag(dsid, fp)
+            mtime = self._svc.last_prepared(dsid)
+            tag = self._matching_etag(etag, mtime, enc)
+            if tag:
+                return self.send_not_modified(tag, mtime,
+                                              self._comp is not None)
+            if self._cache is not None:
+                if enc:
+                    body = self._cache.get((dsid, fp), enc)
+                    bodyenc = body is not None and enc or None
+                if body is None:
+                    body = self._cache.get((dsid, fp))
+        elif self._cache is not None:
+            self._cache.get((dsid, None))   # count the miss
+
+        if body is None:
+            try:
+                mdata, fp = self._svc.fingerprinted_record(dsid, fp,
+                                                           self._stream)
+            except SIPDirectoryNotFound, ex:
+                #TODO: consider sending a 301
+                self.send_error(404,
+                                "Dataset with ID={0} not available".format(dsid))
+                return []
+            except PreparationTimeout, ex:
+                self.send_error(503, "Dataset metadata are being prepared; "
+                                     "try again later")
+                return []
+            except Exception, ex:
+                log.exception("Internal error: "+str(ex))
+                self.send_error(500, "Internal error")
+                return []
+
+            if self._stream:
+                return self.send_stream(dsid, mdata, enc, fp)
+            body = json.dumps(mdata, separators=(',', ':'))
+            if fp and self._cache is not None:
+                self._cache.put((dsid, fp), body)
+
+        cachekey = None
+        if fp and self._cache is not None:
+            cachekey = (dsid, fp)
+        if enc and not bodyenc and \
+           len(body) < self._comp.get('min_size', DEF_COMPRESS_MIN_SIZE):
+            enc = None
+        stream = enc and not bodyenc and \
+                 len(body) >= self._comp.get('stream_size', DEF_STREAM_SIZE)
+        if enc and not bodyenc and not stream:
+            body = compress(body, enc, self._comp.get('level', 6))
+            bodyenc = enc
+            if cachekey:
+                self._cache.put(cachekey, body, enc)
+
+        self.set_response(200, "Identifier found")
+        self.add_header('Content-Type', 'application/json')
+        if enc:
+            self.add_header('Content-Encoding', enc)
+        if self._comp is not None:
+            self.add_header('Vary', 'Accept-Encoding')
+        if not stream:
+            self.add_header('Content-Length', str(len(body)))
+        if fp:
+            self.add_validators(variant_etag(make_etag(dsid, fp), enc),
+                                self._svc.last_prepared(dsid))
+        self.end_headers()
+
+        if stream:
+            return self.iter_encoded(body, enc, cachekey)
+        return [ body ]
+
+    def send_stream(self, dsid, chunks, encoding=None, fp=None):
+        """
+        send a metadata record that is being serialized as it is sent.
+
+        :param dsid       str:  the identifier of the dataset
+        :param chunks iterable: the serialized record, as a series of strings
+        :param encoding   str:  the content coding to apply to the record
+        :param fp         str:  the fingerprint of the SIP the record 
+                                reflects, if known
+        """
+        cachekey = None
+        if fp and self._cache is not None:
+            cachekey = (dsid, fp)
+        if encoding:
+            chunks = iter_compressed(chunks, encoding,
+                                     self._comp.get('level', 6))
+
+        self.set_response(200, "Identifier found")
+        self.add_header('Content-Type', 'application/json')
+        if encoding:
+            self.add_header('Content-Encoding', encoding)
+        if self._comp is not None:
+            self.add_header('Vary', 'Accept-Encoding')
+        if fp:
+            self.add_validators(variant_etag(make_etag(dsid, fp), encoding),
+                                self._svc.last_prepared(dsid))
+        self.end_headers()
+
+        return self.iter_caching(chunks, encoding, cachekey)
+
+    def iter_caching(self, chunks, encoding, cachekey=None):
+        # pass through the chunks of a body as they are sent, caching the
+        # full body when done if it is small enough to be cached
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if cachekey:
+                size += len(chunk)
+                if size > self._cache.max_bytes:
+                    cachekey = None
+                    parts = []
+                else:
+                    parts.append(chunk)
+            yield chunk
+        if cachekey:
+            self._cache.put(cachekey, "".join(parts), encoding)
+
+    def choose_encoding(self):
+        """
+        return the content coding to apply to the response, or None if the 
+        response should not be compressed.
+        """
+        if self._comp is None:
+            return None
+        return choose_encoding(self._env)
+
+    def iter_encoded(self, body, encoding, cachekey=None):
+        # compress the body as it is sent, caching the result when done
+        parts = []
+        for chunk in iter_compressed(body, encoding,
+                                     self._comp.get('level', 6)):
+            if cachekey:
+                parts.append(chunk)
+            yield chunk
+        if cachekey:
+            self._cache.put(cachekey, "".join(parts), encoding)
+
+    def get_component(self, dsid, filepath):
+        fp = self._svc.current_fingerprint(dsid)
+        etag = self._component_etag(dsid, fp, "_comps", filepath)
+        tag = etag and self._matching_etag(etag, None, self.choose_encoding())
+        if tag:
+            return self.send_not_modified(tag, None, self._comp is not None)
+
         try:
-            mdata = self._svc.resolve_id(dsid)
+            comp = self._svc.get_component(dsid, filepath, fp)
         except SIPDirectoryNotFound, ex:
-            #TODO: consider sending a 301
-            self.send_error(404,"Dataset with ID={0} not available".format(dsid))
+            self.send_error(404,
+                            "Dataset with ID={0} not available".format(dsid))
+            return []
+        except PreparationTimeout, ex:
+            self.send_error(503, "Dataset metadata are being prepared; "
+                                 "try again later")
             return []
         except Exception, ex:
             log.exception("Internal error: "+str(ex))
             self.send_error(500, "Internal error")
             return []
+        if comp is None:
+            self.send_error(404, "Dataset (ID={0}) has no component with "
+                                 "filepath={1}".format(dsid, filepath))
+            return []
 
-        self.set_response(200, "Identifier found")
+        return self.send_json(json.dumps(comp, separators=(',', ':')),
+                              "Component found", etag)
+
+    def list_components(self, dsid):
+        params = cgi.parse_qs(self._env.get('QUERY_STRING', ''))
+        try:
+            offset = int(params.get('offset', [0])[-1])
+            limit = int(params.get('limit', [DEF_PAGE_SIZE])[-1])
+            if offset < 0 or limit < 0:
+                raise ValueError("negative value")
+        except ValueError, ex:
+            self.send_error(400, "Bad offset or limit value")
+            return []
+        limit = min(limit, MAX_PAGE_SIZE)
+        subcoll = params.get('subcoll', [None])[-1]
+
+        fp = self._svc.current_fingerprint(dsid)
+        etag = self._component_etag(dsid, fp, "_comps", offset, limit, subcoll)
+        tag = etag and self._matching_etag(etag, None, self.choose_encoding())
+        if tag:
+            return self.send_not_modified(tag, None, self._comp is not None)
+
+        try:
+            page = self._svc.list_components(dsid, offset, limit, subcoll,
+                                             fp)
+        except SIPDirectoryNotFound, ex:
+            self.send_error(404,
+                            "Dataset with ID={0} not available".format(dsid))
+            return []
+        except PreparationTimeout, ex:
+            self.send_error(503, "Dataset metadata are being prepared; "
+                                 "try again later")
+            return []
+        except Exception, ex:
+            log.exception("Internal error: "+str(ex))
+            self.send_error(500, "Internal error")
+            return []
+
+        return self.send_json(json.dumps(page, separators=(',', ':')),
+                              "Components found", etag)
+
+    def _matching_etag(self, etag, mtime, encoding):
+        # return the entity tag of the representation that the client
+        # already has (per its conditional headers), or None if it does not
+        # have a current one
+        tags = [etag]
+        if encoding:
+            tags.insert(0, variant_etag(etag, encoding))
+        for tag in tags:
+            if not_modified(self._env, tag, mtime):
+                return tag
+        return None
+
+    def _component_etag(self, dsid, fp, *parts):
+        # the ETag for a view of the components of an unchanged SIP with the
+        # given current fingerprint
+        if not fp:
+            return None
+        return make_etag(dsid, fp, *parts)
+
+    def send_json(self, body, message, etag=None):
+        """
+        send a JSON body with a 200 status, compressing it if the client
+        accepts it.
+        """
+        enc = self.choose_encoding()
+        if enc and \
+           len(body) >= self._comp.get('min_size', DEF_COMPRESS_MIN_SIZE):
+            body = compress(body, enc, self._comp.get('level', 6))
+        else:
+            enc = None
+
+        self.set_response(200, message)
         self.add_header('Content-Type', 'application/json')
+        if enc:
+            self.add_header('Content-Encoding', enc)
+        if self._comp is not None:
+            self.add_header('Vary', 'Accept-Encoding')
+        self.add_header('Content-Length', str(len(body)))
+        if etag:
+            self.add_header('ETag', variant_etag(etag, enc))
         self.end_headers()
-
-        return [ json.dumps(mdata, indent=4, separators=(',', ': ')) ]
+        return [ body ]
 
     def get_datafile(self, id, filepath):
 
@@ -134,6 +447,10 @@ class Handler(object):
             #TODO: consider sending a 301
             self.send_error(404,"Dataset with ID={0} not available".format(id))
             return []
+        except PreparationTimeout, ex:
+            self.send_error(503, "Dataset metadata are being prepared; "
+                                 "try again later")
+            return []
         except Exception, ex:
             log.exception("Internal error: "+str(ex))
             self.send_error(500, "Internal error")
@@ -141,6 +458,7 @@ class Handler(object):
         if not loc:
             self.send_error(404, "Dataset (ID={0}) does not contain file={1}".
                                  format(id, filepath))
+            return []
 
         xsend = None
         prfx = [p for p in self._fmap.keys() if loc.startswith(p+'/')]
@@ -148,21 +466,103 @@ class Handler(object):
             xsend = self._fmap[prfx[0]] + loc[len(prfx[0]):]
             log.debug("Sending file via X-Accel-Redirect: %s", xsend)
 
-        self.set_response(200, "Data file found")
-        self.add_header('Content-Type', mtype)
         if xsend:
+            # the front-end server will handle the details of delivery
+            self.set_response(200, "Data file found")
+            self.add_header('Content-Type', mtype)
             self.add_header('X-Accel-Redirect', xsend)
+            self.end_headers()
+            return []
+
+        try:
+            st = os.stat(loc)
+        except OSError, ex:
+            log.error("Unable to stat data file, %s: %s", loc, str(ex))
+            self.send_error(404, "Dataset (ID={0}) does not contain file={1}".
+                                 format(id, filepath))
+            return []
+        size = st.st_size
+        etag = make_etag(loc, size, st.st_mtime)
+
+        if not_modified(self._env, etag, st.st_mtime):
+            return self.send_not_modified(etag, st.st_mtime)
+
+        ranges = None
+        if self._range_applies(etag, st.st_mtime):
+            ranges = parse_range(self._env.get('HTTP_RANGE'), size)
+
+        if ranges is not None and len(ranges) == 0:
+            self.set_response(416, "Requested range not satisfiable")
+            self.add_header('Content-Range', "bytes */{0}".format(size))
+            self.end_headers()
+            return []
+
+        self.add_header('Accept-Ranges', 'bytes')
+        self.add_validators(etag, st.st_mtime)
+        if ranges and len(ranges) > 1:
+            return self.send_file_parts(loc, mtype, size, ranges)
+
+        start, length = 0, size
+        if ranges:
+            start, length = ranges[0][0], ranges[0][1] - ranges[0][0] + 1
+            self.set_response(206, "Partial content")
+            self.add_header('Content-Range', "bytes {0}-{1}/{2}".
+                            format(ranges[0][0], ranges[0][1], size))
+        else:
+            self.set_response(200, "Data file found")
+        self.add_header('Content-Type', mtype)
+        self.add_header('Content-Length', str(length))
         self.end_headers()
 
-        if xsend:
+        if self._meth == 'HEAD':
             return []
-        return self.iter_file(loc)
+        if length == size and 'wsgi.file_wrapper' in self._env:
+            # allows the server to use sendfile() and the like
+            return self._env['wsgi.file_wrapper'](open(loc, 'rb'),
+                                                  DEF_BLOCK_SIZE)
+        return iter_file(loc, start, length)
+
+    def _range_applies(self, etag, mtime):
+        # a Range request is only honored if the If-Range condition (if
+        # provided) matches the current version of the file
+        ifrange = self._env.get('HTTP_IF_RANGE')
+        if not ifrange:
+            return True
+        ifrange = ifrange.strip()
+        if ifrange.startswith('"'):
+            return ifrange == etag
+        since = parse_http_date(ifrange)
+        return since is not None and int(mtime) == since
+
+    def send_file_parts(self, loc, mtype, size, ranges):
+        """
+        send multiple ranges of a file as a multipart/byteranges response
+        """
+        boundary = uuid.uuid4().hex
+        heads = [ "\r\n--{0}\r\nContent-Type: {1}\r\n".format(boundary,mtype) +
+                  "Content-Range: bytes {0}-{1}/{2}\r\n\r\n".format(r[0], r[1],
+                                                                    size)
+                  for r in ranges ]
+        tail = "\r\n--{0}--\r\n".format(boundary)
+        length = sum([len(h) for h in heads]) + len(tail) + \
+                 sum([r[1] - r[0] + 1 for r in ranges])
+
+        self.set_response(206, "Partial content")
+        self.add_header('Content-Type',
+                        "multipart/byteranges; boundary="+boundary)
+        self.add_header('Content-Length', str(length))
+        self.end_headers()
 
-    def iter_file(self, loc):
-        # this is the backup, inefficient way to send a file
-        with open(loc, 'rb') as fd:
-            buf = fd.read(5000000)
-            yield buf
+        if self._meth == 'HEAD':
+            return []
+        return self._iter_parts(loc, heads, ranges, tail)
+
+    def _iter_parts(self, loc, heads, ranges, tail):
+        for head, r in zip(heads, ranges):
+            yield head
+            for buf in iter_file(loc, r[0], r[1] - r[0] + 1):
+                yield buf
+        yield tail
         
     def do_HEAD(self, path):
 
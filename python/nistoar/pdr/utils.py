@@ -119,6 +119,53 @@ def build_mime_type_map(filelist):
         update_mimetypes_from_file(out, file)
     return out
 
+# leading byte signatures of common file formats
+_magic_sigs = [
+    ("%PDF-",               "application/pdf"),
+    ("\x89PNG\r\n\x1a\n",    "image/png"),
+    ("\xff\xd8\xff",         "image/jpeg"),
+    ("GIF87a",              "image/gif"),
+    ("GIF89a",              "image/gif"),
+    ("II*\x00",             "image/tiff"),
+    ("MM\x00*",             "image/tiff"),
+    ("\x89HDF\r\n\x1a\n",    "application/x-hdf5"),
+    ("CDF\x01",             "application/x-netcdf"),
+    ("CDF\x02",             "application/x-netcdf"),
+    ("PK\x03\x04",          "application/zip"),
+    ("\x1f\x8b",             "application/gzip"),
+    ("BZh",                 "application/x-bzip2"),
+    ("\xfd7zXZ\x00",        "application/x-xz"),
+    ("<?xml",               "application/xml")
+]
+SNIFF_SIZE = 512
+
+def sniff_media_type(head, default='application/octet-stream'):
+    """
+    surmise the MIME-type of a file from its first few bytes.  This 
+    recognizes a limited number of common binary formats by their 
+    signatures; other content that appears to be UTF-8 text is identified 
+    as "text/plain".
+
+    :param head str:     the leading bytes of the file (up to SNIFF_SIZE are 
+                         examined)
+    :param default str:  the MIME-type to return if the type cannot be 
+                         determined
+    """
+    head = head[:SNIFF_SIZE]
+    if not head:
+        return default
+    for sig, mt in _magic_sigs:
+        if head.startswith(sig):
+            return mt
+    if '\x00' not in head:
+        try:
+            head.decode('utf-8')
+            return "text/plain"
+        except UnicodeDecodeError as ex:
+            # may have cut a multibyte character at the end
+            if ex.start >= len(head) - 3:
+                return "text/plain"
+    return default
 
 def checksum_of(filepath):
     """
@@ -133,6 +180,26 @@ def checksum_of(filepath):
             sum.update(buf)
     return sum.hexdigest()
 
+def digests_of(filepath, algorithms=("sha256",)):
+    """
+    return the checksums for the given file for each of a set of algorithms,
+    calculating them all from a single read of the file.
+
+    :param filepath str:     the path to the file to hash
+    :param algorithms list:  the names of the algorithms (as supported by 
+                             hashlib) to apply
+    :return dict:  a mapping of algorithm names to hash values
+    """
+    bfsz = 10240000   # 10 MB buffer
+    sums = [(alg, hashlib.new(alg)) for alg in algorithms]
+    with open(filepath) as fd:
+        while True:
+            buf = fd.read(bfsz)
+            if not buf: break
+            for alg, sum in sums:
+                sum.update(buf)
+    return dict([(alg, sum.hexdigest()) for alg, sum in sums])
+
 def rmtree_sys(rootdir):
     """
     an implementation of rmtree that is intended to work on NSF-mounted 
@@ -0,0 +1,234 @@
+"""
+Utility functions for the PDR's WSGI applications, supporting HTTP
+conditional requests, byte ranges, and content-coding negotiation.
+"""
+import hashlib, zlib
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+def make_etag(*parts):
+    """
+    return a strong entity tag (including the surrounding quotes) derived
+    from the given values.  The values should together identify the
+    resource and the version of its content.
+    """
+    return '"' + hashlib.sha1("\0".join([str(p) for p in parts])) \
+                        .hexdigest()[:32] + '"'
+
+def http_date(t):
+    """
+    format the given epoch time as an HTTP date (e.g. for a Last-Modified
+    header).
+    """
+    return formatdate(t, usegmt=True)
+
+def parse_http_date(datestr):
+    """
+    convert an HTTP date into an epoch time.  None is returned if the date
+    cannot be parsed.
+    """
+    try:
+        parsed = parsedate_tz(datestr)
+        if parsed is None:
+            return None
+        return mktime_tz(parsed)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def _etag_list(header):
+    return [t.strip() for t in header.split(',') if t.strip()]
+
+def _opaque(etag):
+    # strip the weakness indicator for a weak comparison
+    if etag.startswith('W/'):
+        return etag[2:]
+    return etag
+
+def not_modified(env, etag=None, mtime=None):
+    """
+    return True if the conditional headers (If-None-Match and
+    If-Modified-Since) in the given WSGI request environment indicate that
+    the client already has the current version of a resource with the given
+    entity tag and modification time.  As per RFC 7232, If-Modified-Since is
+    ignored when If-None-Match is present.
+
+    :param env   dict:  the WSGI request environment
+    :param etag   str:  the resource's current entity tag (with quotes), or
+                        None if it does not have one
+    :param mtime float: the resource's last modification time (epoch
+                        seconds), or None if it is not known
+    """
+    inm = env.get('HTTP_IF_NONE_MATCH')
+    if inm is not None:
+        if not etag:
+            return False
+        tags = _etag_list(inm)
+        return '*' in tags or _opaque(etag) in [_opaque(t) for t in tags]
+
+    ims = env.get('HTTP_IF_MODIFIED_SINCE')
+    if ims and mtime is not None:
+        since = parse_http_date(ims)
+        return since is not None and int(mtime) <= since
+
+    return False
+
+DEF_BLOCK_SIZE = 64 * 1024
+
+def parse_range(header, size):
+    """
+    parse the value of an HTTP Range header into a list of byte ranges
+    for a resource of a given size.  Each range is returned as a 2-tuple
+    giving the first and last byte positions (inclusive).  None is returned
+    if the header is missing or is not a syntactically valid byte-range
+    request (in which case, the Range header should be ignored); an empty
+    list is returned if none of the requested ranges can be satisfied.
+
+    :param header str:  the value of the Range header
+    :param size   int:  the size of the resource in bytes
+    """
+    if not header:
+        return None
+    unit, sep, spec = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+
+    out = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last):
+            return None
+        try:
+            if not first:
+                # a suffix range: the last N bytes
+                n = int(last)
+                if n < 0:
+                    return None
+                if n > 0 and size > 0:
+                    out.append( (max(size - n, 0), size - 1) )
+                continue
+            first = int(first)
+            last = int(last) if last else None
+        except ValueError:
+            return None
+        if first < 0 or (last is not None and last < first):
+            return None
+        if last is None:
+            last = size - 1
+        if first < size:
+            out.append( (first, min(last, size - 1)) )
+
+    return out
+
+def iter_file(filepath, start=0, length=None, blocksize=DEF_BLOCK_SIZE):
+    """
+    return an iterator that reads the contents of a file in blocks.  The 
+    file is opened only when the iteration begins, and it is closed when
+    the iteration is finished (or abandoned).
+
+    :param filepath str:  the path to the file to read
+    :param start    int:  the position of the first byte to return
+    :param length   int:  the number of bytes to return; if None, the 
+                          rest of the file is returned
+    :param blocksize int: the maximum number of bytes to return in each
+                          iteration
+    """
+    with open(filepath, 'rb') as fd:
+        if start:
+            fd.seek(start)
+        while length is None or length > 0:
+            n = blocksize
+            if length is not None:
+                n = min(n, length)
+            buf = fd.read(n)
+            if not buf:
+                break
+            if length is not None:
+                length -= len(buf)
+            yield buf
+
+SUPPORTED_ENCODINGS = ("gzip", "deflate")
+
+def choose_encoding(env, supported=SUPPORTED_ENCODINGS):
+    """
+    select a content coding for a response based on the Accept-Encoding 
+    header in the given WSGI request environment.  None is returned if the
+    response should not be encoded (i.e. the identity coding should be 
+    used).  
+
+    :param env       dict:  the WSGI request environment
+    :param supported list:  the names of the encodings available, in order
+                            of preference
+    """
+    accept = env.get('HTTP_ACCEPT_ENCODING')
+    if not accept:
+        return None
+
+    qs = {}
+    for item in accept.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, sep, val = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(val)
+                except ValueError:
+                    q = 0.0
+        qs[coding] = q
+
+    best, bestq = None, 0.0
+    for coding in supported:
+        q = qs.get(coding, qs.get('*', 0.0))
+        if q > bestq:
+            best, bestq = coding, q
+    return best
+
+def _compressor(encoding, level=6):
+    if encoding == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        # HTTP's "deflate" is the zlib format (RFC 1950)
+        return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+    raise ValueError("Unsupported content coding: " + str(encoding))
+
+def compress(body, encoding, level=6):
+    """
+    return the given body encoded with the given content coding (one of 
+    SUPPORTED_ENCODINGS)
+    """
+    comp = _compressor(encoding, level)
+    return comp.compress(body) + comp.flush()
+
+def iter_compressed(body, encoding, level=6, blocksize=DEF_BLOCK_SIZE):
+    """
+    return an iterator over the given body compressed with the given content
+    coding.  The body is compressed a block at a time so that sending the 
+    output can begin before the whole body is compressed.
+
+    :param body      str or iterable:  the data to compress; this can be a 
+                                       string or an iterable of strings.
+    """
+    chunks = body
+    if isinstance(body, str):
+        chunks = (body[i:i+blocksize] for i in xrange(0, len(body), blocksize))
+    comp = _compressor(encoding, level)
+    for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+def variant_etag(etag, encoding):
+    """
+    return the entity tag for the given content coding of the 
+    representation with the given (strong) entity tag
+    """
+    if not etag or not encoding:
+        return etag
+    return etag[:-1] + '-' + encoding + '"'
@@ -172,6 +172,26 @@ class TestIngestClient(test.TestCase):
         self.assertIn("bro", names)
         self.assertEqual(len(names), 2)
 
+    def test_stage_chunks(self):
+        rec = getrec()
+        body = json.dumps(rec)
+        chunks = (body[i:i+100] for i in range(0, len(body), 100))
+        self.cl.stage(chunks, 'bru')
+        self.assertEqual(self.cl.staged_names(), ["bru"])
+        with open(os.path.join(self.stagedir, "bru.json")) as fd:
+            self.assertEqual(json.load(fd), rec)
+
+        with self.assertRaises(ValueError):
+            self.cl.stage(iter([body]))
+
+        def failing():
+            yield body[:100]
+            raise RuntimeError("oops")
+        with self.assertRaises(rmm.StateException):
+            self.cl.stage(failing(), 'bro')
+        self.assertEqual(self.cl.staged_names(), ["bru"])
+        self.assertEqual(os.listdir(self.stagedir), ["bru.json"])
+
     def test_submit_staged(self):
         rec = getrec()
         self.cl.stage(rec, 'bru')
@@ -0,0 +1,143 @@
+import os, sys, pdb, shutil, logging, json, time
+import unittest as test
+
+from nistoar.testing import *
+import nistoar.pdr.preserv.bagger.inventory as inv
+
+# datadir = nistoar/preserv/data
+datadir = os.path.join( os.path.dirname(os.path.dirname(__file__)), "data" )
+
+def setUpModule():
+    ensure_tmpdir()
+
+def tearDownModule():
+    rmtmpdir()
+
+class TestSIPInventory(test.TestCase):
+
+    testsip = os.path.join(datadir, "midassip")
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.revdir = self.tf.track("review")
+        self.upldir = self.tf.track("upload")
+        shutil.copytree(os.path.join(self.testsip, "review", "1491"),
+                        self.revdir)
+        shutil.copytree(os.path.join(self.testsip, "upload", "1491"),
+                        self.upldir)
+        self.snapfile = self.tf.track("inventory.json")
+
+        # backdate the directories so that their mtimes can be trusted
+        self.backdate(self.revdir)
+        self.backdate(self.upldir)
+
+    def tearDown(self):
+        self.tf.clean()
+
+    def backdate(self, dir, t=None):
+        if t is None:
+            t = time.time() - 100
+        for root, subdirs, files in os.walk(dir):
+            os.utime(root, (t, t))
+
+    def test_refresh(self):
+        sipinv = inv.SIPInventory([self.revdir, self.upldir], self.snapfile,
+                                  ["_pod.json"])
+        self.assertFalse(sipinv.restored)
+        diff = sipinv.refresh()
+        datafiles = sipinv.files()
+        self.assertEqual(set(datafiles.keys()),
+                         set(["trial1.json", "trial1.json.sha256",
+                              "trial2.json", "trial3/trial3a.json",
+                              "trial3/trial3a.json.sha256"]))
+        self.assertEqual(diff['added'], set(datafiles.keys()))
+        self.assertEqual(diff['removed'], set())
+        self.assertEqual(diff['modified'], set())
+
+        # later roots take precedence
+        self.assertEqual(datafiles["trial3/trial3a.json"],
+                         os.path.join(self.upldir, "trial3", "trial3a.json"))
+        self.assertEqual(datafiles["trial1.json"],
+                         os.path.join(self.revdir, "trial1.json"))
+        self.assertEqual(sipinv.stat_of("trial1.json")[0],
+                        os.stat(datafiles["trial1.json"]).st_size)
+        self.assertIsNone(sipinv.stat_of("goob.json"))
+
+        diff = sipinv.refresh()
+        self.assertEqual(diff, {"added": set(), "removed": set(),
+                                "modified": set()})
+
+    def test_save_restore(self):
+        sipinv = inv.SIPInventory([self.revdir, self.upldir], self.snapfile,
+                                  ["_pod.json"])
+        sipinv.refresh()
+        self.assertFalse(os.path.exists(self.snapfile))
+        sipinv.save()
+        self.assertTrue(os.path.exists(self.snapfile))
+
+        sipinv2 = inv.SIPInventory([self.revdir, self.upldir], self.snapfile,
+                                   ["_pod.json"])
+        self.assertTrue(sipinv2.restored)
+        self.assertEqual(sipinv2.files(), sipinv.files())
+        self.assertIn(self.revdir, sipinv2.dir_mtimes())
+        self.assertIn(os.path.join(self.revdir, "trial3"),
+                      sipinv2.dir_mtimes())
+
+        # make some changes
+        os.remove(os.path.join(self.revdir, "trial2.json"))
+        with open(os.path.join(self.revdir, "trial3", "new.json"), 'w') as fd:
+            fd.write("{}\n")
+        with open(os.path.join(self.revdir, "trial1.json"), 'a') as fd:
+            fd.write("\n")
+        self.backdate(self.revdir, time.time() - 50)
+
+        diff = sipinv2.refresh()
+        self.assertEqual(diff['added'], set(["trial3/new.json"]))
+        self.assertEqual(diff['removed'], set(["trial2.json"]))
+        self.assertEqual(diff['modified'], set(["trial1.json"]))
+        sipinv2.discard()
+        self.assertFalse(os.path.exists(self.snapfile))
+        self.assertFalse(sipinv2.restored)
+
+    def test_unchanged_dirs_not_listed(self):
+        sipinv = inv.SIPInventory([self.revdir], self.snapfile, ["_pod.json"],
+                                  {"check_file_changes": False})
+        sipinv.refresh()
+        sipinv.save()
+
+        # sneak a new file into a directory without changing its mtime
+        t = os.stat(self.revdir).st_mtime
+        with open(os.path.join(self.revdir, "sneaky.json"), 'w') as fd:
+            fd.write("{}\n")
+        os.utime(self.revdir, (t, t))
+
+        sipinv = inv.SIPInventory([self.revdir], self.snapfile, ["_pod.json"])
+        diff = sipinv.refresh()
+        self.assertEqual(diff['added'], set())
+        self.assertNotIn("sneaky.json", sipinv.files())
+
+    def test_recent_dirs_relisted(self):
+        # directories modified within the last couple of seconds are not
+        # trusted
+        sipinv = inv.SIPInventory([self.revdir], self.snapfile, ["_pod.json"])
+        self.backdate(self.revdir, time.time())
+        sipinv.refresh()
+
+        t = os.stat(self.revdir).st_mtime
+        with open(os.path.join(self.revdir, "sneaky.json"), 'w') as fd:
+            fd.write("{}\n")
+        os.utime(self.revdir, (t, t))
+
+        diff = sipinv.refresh()
+        self.assertEqual(diff['added'], set(["sneaky.json"]))
+
+    def test_bad_snapshot(self):
+        with open(self.snapfile, 'w') as fd:
+            fd.write("goob")
+        sipinv = inv.SIPInventory([self.revdir], self.snapfile)
+        self.assertFalse(sipinv.restored)
+        self.assertIn("trial2.json", sipinv.files())
+
+
+if __name__ == '__main__':
+    test.main()
@@ -181,6 +181,49 @@ class TestMIDASMetadataBaggerMixed(test.TestCase):
         self.assertEqual(data['downloadURL'], dlurl)
         self.assertNotIn('description', data)
 
+    def test_check_file_metadata_by_checksum(self):
+        destpath = "trial1.json"
+        dfile = self.tf.track("trial1.json")
+        shutil.copy(os.path.join(self.revdir, self.midasid[32:], destpath),
+                    dfile)
+        self.bagr.ensure_file_metadata(dfile, destpath)
+        self.assertFalse(self.bagr._check_file_metadata(dfile, destpath)[0])
+
+        # change the contents but not the size and give it an old date
+        with open(dfile) as fd:
+            data = fd.read()
+        with open(dfile, 'w') as fd:
+            fd.write(data.replace('{', '['))
+        os.utime(dfile, (1000000000, 1000000000))
+        self.assertFalse(self.bagr._check_file_metadata(dfile, destpath)[0])
+
+        self.bagr.cfg['update_by_checksum_size_lim'] = 1000000
+        self.assertTrue(self.bagr._check_file_metadata(dfile, destpath)[0])
+        self.bagr.ensure_file_metadata(dfile, destpath)
+        self.assertFalse(self.bagr._check_file_metadata(dfile, destpath)[0])
+
+        # files larger than the limit are only checked by size
+        self.bagr.cfg['update_by_checksum_size_lim'] = 10
+        with open(dfile, 'a') as fd:
+            fd.write("\n")
+        os.utime(dfile, (1000000000, 1000000000))
+        self.assertTrue(self.bagr._check_file_metadata(dfile, destpath)[0])
+
+        # size is checked even when the file is thought to be unchanged
+        self.assertTrue(self.bagr._check_file_metadata(dfile, destpath,
+                                                       changed=False)[0])
+        self.bagr.ensure_file_metadata(dfile, destpath)
+        self.assertFalse(self.bagr._check_file_metadata(dfile, destpath,
+                                                        changed=False)[0])
+
+        # as is a missing checksum
+        mdfile = self.bagr.bagbldr.nerdm_file_for(destpath)
+        md = midas.read_nerd(mdfile)
+        del md['checksum']
+        self.bagr.bagbldr._write_json(md, mdfile)
+        self.assertTrue(self.bagr._check_file_metadata(dfile, destpath,
+                                                       changed=False)[0])
+
     def test_ensure_file_metadata_checksumfile(self):
         self.assertFalse(os.path.exists(self.bagdir))
         self.assertIsNone(self.bagr.bagbldr.ediid)
@@ -273,6 +316,80 @@ class TestMIDASMetadataBaggerMixed(test.TestCase):
             self.assertTrue(os.path.exists(os.path.join(metadir, filepath,
                                                         "nerdm.json")))
         
+    def test_sip_fingerprint(self):
+        self.assertIsNone(self.bagr.sip_fingerprint())
+        self.bagr.ensure_data_files()
+        self.bagr.inventory.save()
+        fp = self.bagr.sip_fingerprint()
+        self.assertTrue(fp)
+
+        # the data files' status are included
+        sippaths = self.bagr.sip_fingerprint_paths()[0]
+        for inpath in self.bagr.datafiles.values():
+            self.assertIn(inpath, sippaths)
+
+        # a file rewritten in place with the same size changes it
+        dfile = self.tf.track("data.txt")
+        with open(dfile, 'w') as fd:
+            fd.write("goober")
+        os.utime(dfile, (1000000000, 1000000000))
+        fp = midas.fingerprint_of([dfile], [])
+        with open(dfile, 'w') as fd:
+            fd.write("gurnee")
+        os.utime(dfile, (1000000000, 1000000001))
+        self.assertNotEqual(midas.fingerprint_of([dfile], []), fp)
+
+    def test_ensure_data_files_parallel(self):
+        self.bagr.ensure_data_files()
+
+        parent = self.tf.mkdir("pbagger")
+        treecfg = { "min_size": 70, "chunk_size": 32 }
+        bagr = midas.MIDASMetadataBagger(self.midasid, parent, self.revdir,
+                                         self.upldir, {"examine_workers": 4,
+                                     "bag_builder": { "tree_hash": treecfg }})
+        try:
+            bagr.ensure_data_files()
+        finally:
+            bagr.bagbldr._unset_logfile()
+        self.assertEqual(sorted(bagr.datafiles.keys()),
+                         sorted(self.bagr.datafiles.keys()))
+
+        # tree hashes calculated by the workers are saved by the writer
+        trees = [f for f in bagr.datafiles
+                   if os.stat(bagr.datafiles[f]).st_size >= 70]
+        self.assertTrue(trees)
+        for filepath in trees:
+            tree = midas.read_nerd(bagr.bagbldr.treehash_file_for(filepath))
+            md = midas.read_nerd(bagr.bagbldr.nerdm_file_for(filepath))
+            self.assertEqual(tree['fileChecksum'], md['checksum']['hash'])
+
+        # the metadata should be identical to that done serially
+        pmetadir = os.path.join(parent, self.midasid, 'metadata')
+        for filepath in self.bagr.datafiles:
+            with open(os.path.join(self.bagdir, 'metadata', filepath,
+                                   "nerdm.json")) as fd:
+                serial = fd.read()
+            with open(os.path.join(pmetadir, filepath, "nerdm.json")) as fd:
+                self.assertEqual(fd.read(), serial)
+
+    def test_component_for(self):
+        self.assertIsNone(self.bagr.component_for("trial1.json"))
+        self.bagr.ensure_res_metadata()
+        comp = self.bagr.component_for("trial1.json")
+        self.assertIsNotNone(comp)
+        self.assertEqual(comp['filepath'], "trial1.json")
+        self.assertIsNone(self.bagr.component_for("trial3/trial3a.json"))
+
+        # the index is updated as file metadata is merged in
+        self.bagr.ensure_data_files()
+        comp = self.bagr.component_for("trial1.json")
+        self.assertEqual(comp['filepath'], "trial1.json")
+        self.assertIn('checksum', comp)
+        self.assertIn('size', comp)
+        comp = self.bagr.component_for("trial3/trial3a.json")
+        self.assertIsNotNone(comp)
+        self.assertIn('checksum', comp)
+
     def test_ensure_data_files_wremove(self):
         metadir = os.path.join(self.bagdir, 'metadata')
         self.assertFalse(os.path.exists(self.bagdir))
@@ -323,6 +440,11 @@ class TestMIDASMetadataBaggerMixed(test.TestCase):
         self.assertEqual(len(valid) + len(invalid), 2)
         self.assertIn("trial1.json.sha256", valid)
         self.assertIn("trial3/trial3a.json.sha256", invalid)
+
+        # the validity flags are reflected in the bag's component index
+        compidx = self.bagr.bagbldr.comp_index
+        self.assertIs(compidx.get("trial1.json.sha256")['valid'], True)
+        self.assertIs(compidx.get("trial3/trial3a.json.sha256")['valid'], False)
         
         
     def test_ensure_subcoll_metadata(self):
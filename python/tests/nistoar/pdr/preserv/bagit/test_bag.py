@@ -14,6 +14,12 @@ import nistoar.pdr.exceptions as exceptions
 datadir = os.path.join( os.path.dirname(os.path.dirname(__file__)), "data" )
 bagdir = os.path.join(datadir, "samplembag")
 
+def setUpModule():
+    ensure_tmpdir()
+
+def tearDownModule():
+    rmtmpdir()
+
 baghier = [
     {
         "filepath": "trial1.json"
@@ -101,6 +107,25 @@ class TestNISTBag(test.TestCase):
         for comp in data['dataHierarchy']:
             self.assertIn(comp, baghier)
 
+    def test_iter_nerdm_record(self):
+        expect = json.dumps(self.bag.nerdm_record(), separators=(',', ':'))
+        chunks = list(self.bag.iter_nerdm_record())
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0], expect)
+
+        chunks = list(self.bag.iter_nerdm_record(chunksize=100))
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual("".join(chunks), expect)
+
+        def retitle(comp):
+            comp['title'] = "goob"
+        data = json.loads("".join(self.bag.iter_nerdm_record(
+                                                       comp_filter=retitle)))
+        self.assertEqual(len(data['components']), 5)
+        self.assertEqual(set([c['title'] for c in data['components']]),
+                         set(["goob"]))
+        self.assertEqual(data['inventory'][0]['descCount'], 5)
+
     def test_comp_exists(self):
         self.assertTrue( self.bag.comp_exists("trial1.json") )
         self.assertTrue( self.bag.comp_exists("trial2.json") )
@@ -191,6 +216,152 @@ class TestNISTBag(test.TestCase):
         self.assertTrue(self.bag.is_headbag())
                          
                          
+class TestIndexedNISTBag(TestNISTBag):
+
+    def setUp(self):
+        self.bag = bag.NISTBag(bagdir, index=True)
+
+class TestBagIndex(test.TestCase):
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.bagdir = self.tf.track("samplembag")
+        shutil.copytree(bagdir, self.bagdir)
+        self.bag = bag.NISTBag(self.bagdir, index=True)
+
+    def tearDown(self):
+        self.tf.clean()
+
+    def test_lazy(self):
+        self.assertIsNone(self.bag._index)
+        self.assertTrue(self.bag.comp_exists("trial3/trial3a.json"))
+        self.assertIsNotNone(self.bag._index)
+
+        # changes are not seen until the index is invalidated
+        os.remove(os.path.join(self.bagdir, "data", "trial1.json"))
+        self.assertTrue(self.bag.is_data_file("trial1.json"))
+        self.bag.invalidate_index()
+        self.assertIsNone(self.bag._index)
+
+        # the component types are read only once
+        reads = []
+        read_nerd = self.bag.read_nerd
+        def counting_read(nerdfile):
+            reads.append(nerdfile)
+            return read_nerd(nerdfile)
+        self.bag.read_nerd = counting_read
+        self.assertTrue(self.bag.is_data_file("trial1.json"))  # has metadata
+        self.assertTrue(self.bag.is_data_file("trial1.json"))
+        self.assertFalse(self.bag.is_subcoll("trial1.json"))
+        self.assertEqual(len(reads), 1)
+        self.assertIn("trial1.json", self.bag.subcoll_children(""))
+
+    def test_invalidate(self):
+        self.assertEqual(len(self.bag.subcoll_children("trial3")), 1)
+
+        # add a subcollection with a file
+        ddir = os.path.join(self.bagdir, "data", "trial3", "sub")
+        os.makedirs(ddir)
+        with open(os.path.join(ddir, "gurn.txt"), 'w') as fd:
+            fd.write("gurn\n")
+        self.assertFalse(self.bag.comp_exists("trial3/sub"))
+        self.bag.invalidate_index("trial3/sub/gurn.txt", False)
+        self.assertTrue(self.bag.is_subcoll("trial3/sub"))
+        self.assertTrue(self.bag.is_data_file("trial3/sub/gurn.txt"))
+        self.assertEqual(self.bag.subcoll_children("trial3/sub"), ["gurn.txt"])
+        self.assertEqual(sorted(self.bag.subcoll_children("trial3")),
+                         ["sub", "trial3a.json"])
+
+        # remove a subcollection
+        shutil.rmtree(os.path.join(self.bagdir, "data", "trial3"))
+        shutil.rmtree(os.path.join(self.bagdir, "metadata", "trial3"))
+        self.bag.invalidate_index("trial3")
+        self.assertFalse(self.bag.comp_exists("trial3"))
+        self.assertFalse(self.bag.comp_exists("trial3/sub/gurn.txt"))
+        self.assertFalse(self.bag.is_data_file("trial3/trial3a.json"))
+        self.assertEqual(sorted(self.bag.subcoll_children("")),
+                         ["trial1.json", "trial2.json"])
+
+        # a component with metadata only
+        mdir = os.path.join(self.bagdir, "metadata", "trial4")
+        os.mkdir(mdir)
+        self.bag.invalidate_index("trial4", False)
+        self.assertTrue(self.bag.comp_exists("trial4"))
+        self.assertFalse(self.bag.is_subcoll("trial4"))
+        shutil.copy(os.path.join(datadir, "samplembag", "metadata", "trial3",
+                                 "nerdm.json"), mdir)
+        self.bag.invalidate_index("trial4", False)
+        self.assertTrue(self.bag.is_subcoll("trial4"))
+        self.assertIn("trial4", self.bag.subcoll_children(""))
+
+class TestRecordCache(test.TestCase):
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.bagdir = self.tf.track("samplembag")
+        shutil.copytree(bagdir, self.bagdir)
+        self.bag = bag.NISTBag(self.bagdir, cache_record=True)
+        self.reads = []
+        read_nerd = self.bag.read_nerd
+        def counting_read(nerdfile):
+            self.reads.append(nerdfile)
+            return read_nerd(nerdfile)
+        self.bag.read_nerd = counting_read
+
+    def tearDown(self):
+        self.tf.clean()
+
+    def test_cached_record(self):
+        cachefile = os.path.join(self.bagdir, bag.RECORD_CACHE_FILENAME)
+        self.assertFalse(os.path.exists(cachefile))
+        data = self.bag.nerdm_record()
+        self.assertTrue(os.path.exists(cachefile))
+        self.assertEqual(data, bag.NISTBag(self.bagdir).nerdm_record())
+        self.assertEqual(len(self.reads), 5)
+
+        # nothing is read again if nothing changed
+        self.reads = []
+        self.assertEqual(self.bag.nerdm_record(), data)
+        self.assertEqual(self.reads, [])
+
+        # only changed components are read
+        nerdfile = self.bag.nerd_file_for("trial1.json")
+        with open(nerdfile) as fd:
+            comp = json.load(fd, object_pairs_hook=OrderedDict)
+        comp['title'] = "Trial 1"
+        with open(nerdfile, 'w') as fd:
+            json.dump(comp, fd, indent=4, separators=(',', ': '))
+        data = self.bag.nerdm_record()
+        self.assertEqual(self.reads, [nerdfile])
+        self.assertEqual([c['title'] for c in data['components']
+                                     if c.get('filepath') == "trial1.json"],
+                         ["Trial 1"])
+        self.assertEqual(data, bag.NISTBag(self.bagdir).nerdm_record())
+
+        # a rewrite that keeps the size and restores the mtime is detected
+        os.utime(nerdfile, (1500000000, 1500000000))
+        self.bag.nerdm_record()
+        size = os.stat(nerdfile).st_size
+        comp['title'] = "Trial 2"
+        with open(nerdfile, 'w') as fd:
+            json.dump(comp, fd, indent=4, separators=(',', ': '))
+        os.utime(nerdfile, (1500000000, 1500000000))
+        self.assertEqual(os.stat(nerdfile).st_size, size)
+        self.reads = []
+        data = self.bag.nerdm_record()
+        self.assertEqual(self.reads, [nerdfile])
+        self.assertEqual([c['title'] for c in data['components']
+                                     if c.get('filepath') == "trial1.json"],
+                         ["Trial 2"])
+
+        # removed components are dropped
+        shutil.rmtree(os.path.join(self.bag.metadata_dir, "trial3"))
+        data = self.bag.nerdm_record()
+        self.assertEqual(len(data['components']), 3)
+        self.assertEqual(data, bag.NISTBag(self.bagdir).nerdm_record())
+
+        self.bag.discard_record_cache()
+        self.assertFalse(os.path.exists(cachefile))
 
 if __name__ == '__main__':
     test.main()
@@ -9,7 +9,7 @@ from collections import OrderedDict
 from nistoar.testing import *
 import nistoar.pdr.preserv.bagit.builder as bldr
 import nistoar.pdr.exceptions as exceptions
-from nistoar.pdr.utils import read_nerd
+from nistoar.pdr.utils import read_nerd, digests_of
 
 # datadir = tests/nistoar/pdr/preserv/data
 datadir = os.path.join(
@@ -440,6 +440,32 @@ class TestBuilder(test.TestCase):
             data = json.load(fd)
         self.assertEqual(data, need)
         
+    def test_add_data_file_sniff(self):
+        srcfile = self.tf.track("trial1.dat")
+        with open(srcfile, 'w') as fd:
+            fd.write("%PDF-1.4\n")
+        path = os.path.join("trial1","gold","trial1.dat")
+        bagmdpath = os.path.join(self.bag.bagdir, 'metadata',path,"nerdm.json")
+
+        self.bag.add_data_file(path, srcfile)
+        with open(bagmdpath) as fd:
+            data = json.load(fd)
+        self.assertEqual(data['mediaType'], "application/pdf")
+        self.assertEqual(data['size'], 9)
+
+        # a linked file gets the same type
+        path = os.path.join("trial1","gold","trial2.dat")
+        bagmdpath = os.path.join(self.bag.bagdir, 'metadata',path,"nerdm.json")
+        self.bag.add_data_file(path, srcfile, True)
+        with open(bagmdpath) as fd:
+            data = json.load(fd)
+        self.assertEqual(data['mediaType'], "application/pdf")
+
+        # as does a file examined in place
+        mdata, tree = self.bag.examine_filemd_for("trial3.dat", srcfile)
+        self.assertEqual(mdata['mediaType'], "application/pdf")
+        self.assertEqual(mdata['size'], 9)
+
     def test_add_data_no_file(self):
         path = os.path.join("trial1","gold","trial1.json")
         bagfilepath = os.path.join(self.bag.bagdir, 'data',path)
@@ -656,6 +682,25 @@ class TestBuilder(test.TestCase):
         self.assertFalse( os.path.exists(os.path.join(self.bag.bagdir,
                                                       "data", "trial1.json")) )
 
+    def test_comp_index(self):
+        path = os.path.join("trial1","gold","trial1.json")
+        self.bag.add_data_file(path, os.path.join(datadir,"trial1.json"))
+        self.assertTrue(os.path.exists(os.path.join(self.bag.bagdir,
+                                                    "compindex.jsonl")))
+
+        idx = self.bag.comp_index
+        self.assertEqual(sorted([fp for fp, e in idx.items()]),
+                         ["trial1", "trial1/gold", path])
+        ent = idx.get(path)
+        self.assertIn("nrdp:DownloadableFile", ent['@type'])
+        self.assertEqual(ent['checksum'],
+                    read_nerd(self.bag.nerdm_file_for(path))['checksum']['hash'])
+        self.assertEqual(ent['size'], 69)
+        self.assertEqual(idx.filepaths_of_type(":DownloadableFile"), [path])
+
+        self.bag.remove_component(path, True)
+        self.assertEqual(len(idx), 0)
+
     def test_remove_component_trim(self):
         gold = os.path.join("trial1","gold")
         golddir = os.path.join(self.bag.bagdir, "data", gold)
@@ -691,6 +736,35 @@ class TestBuilder(test.TestCase):
         self.assertTrue( os.path.exists(t2bagfilepath) )
         self.assertTrue( os.path.exists(t2bagmdpath) )
 
+    def test_structure_index(self):
+        paths = [ "trial1", os.path.join("trial1","gold"),
+                  os.path.join("trial1","gold","trial1.json"),
+                  os.path.join("trial1","trial2.json"), "trial3", "goob" ]
+        def assertIndexCurrent():
+            unindexed = bldr.NISTBag(self.bag.bagdir)
+            for path in paths:
+                for meth in "comp_exists is_data_file is_subcoll".split():
+                    self.assertEqual(getattr(self.bag._bag, meth)(path),
+                                     getattr(unindexed, meth)(path),
+                                     "{0}({1}) is out of date"
+                                     .format(meth, path))
+            for path in [""] + [p for p in paths if unindexed.is_subcoll(p)]:
+                self.assertEqual(sorted(self.bag._bag.subcoll_children(path)),
+                                 sorted(unindexed.subcoll_children(path)))
+
+        self.bag.add_data_file(paths[2], os.path.join(datadir,"trial1.json"))
+        assertIndexCurrent()
+        self.assertIsNotNone(self.bag._bag._index)
+        self.bag.add_data_file(paths[3], os.path.join(datadir,"trial2.json"))
+        assertIndexCurrent()
+        self.bag.add_metadata_for_coll("trial3", {})
+        assertIndexCurrent()
+
+        self.bag.remove_component(paths[2], True)
+        assertIndexCurrent()
+        self.bag.remove_component("trial1")
+        assertIndexCurrent()
+
     def test_write_data_manifest(self):
         manfile = os.path.join(self.bag.bagdir, "manifest-sha256.txt")
         datafiles = [ "trial1.json", "trial2.json", 
@@ -738,6 +812,125 @@ class TestBuilder(test.TestCase):
                 self.assertEqual(parts[0], bldr.checksum_of(dfp))
         self.assertEqual(c, len(datafiles))
 
+    def test_write_data_manifest_parallel(self):
+        self.bag.checksummer = bldr.ChecksumEngine({"workers": 2})
+        manfile = os.path.join(self.bag.bagdir, "manifest-sha256.txt")
+        datafiles = [ "trial1.json", "trial2.json", 
+                      os.path.join("trial3", "trial3a.json") ]
+        for df in datafiles:
+            self.bag.add_data_file(df, os.path.join(datadir, df))
+
+        self.bag.write_data_manifest(True)
+        self.assertTrue(os.path.exists(manfile))
+        with open(manfile) as fd:
+            lines = [l.strip().split(' ', 1) for l in fd]
+        self.assertEqual(len(lines), len(datafiles))
+        for parts in lines:
+            dfp = os.path.join(self.bag.bagdir, parts[1])
+            self.assertEqual(parts[0], bldr.checksum_of(dfp))
+
+        # corrupt the metadata for one of the files
+        mdfile = self.bag.nerdm_file_for("trial2.json")
+        md = read_nerd(mdfile)
+        md['checksum']['hash'] = "0" * 64
+        self.bag._write_json(md, mdfile)
+        with self.assertRaises(bldr.BagProfileError):
+            self.bag.write_data_manifest(True)
+        self.assertFalse(os.path.exists(manfile))
+
+    def test_write_data_manifest_multi(self):
+        datafiles = [ "trial1.json", "trial2.json", 
+                      os.path.join("trial3", "trial3a.json") ]
+        for df in datafiles:
+            self.bag.add_data_file(df, os.path.join(datadir, df))
+        self.bag._unset_logfile()
+
+        # switch to a builder that applies additional algorithms
+        self.cfg['checksum_algorithms'] = [ "md5", "sha512" ]
+        self.bag = bldr.BagBuilder(self.tf.root, "testbag", self.cfg)
+        self.assertEqual(self.bag.checksum_algs, ["sha256", "md5", "sha512"])
+        self.bag.ensure_bagdir()
+        self.bag.write_data_manifest(False)
+
+        for alg in self.bag.checksum_algs:
+            manfile = os.path.join(self.bag.bagdir, "manifest-"+alg+".txt")
+            self.assertTrue(os.path.exists(manfile))
+            with open(manfile) as fd:
+                lines = [l.strip().split(' ', 1) for l in fd]
+            self.assertEqual(len(lines), len(datafiles))
+            for parts in lines:
+                dfp = os.path.join(self.bag.bagdir, parts[1])
+                self.assertEqual(parts[0], digests_of(dfp, [alg])[alg])
+
+        # the extra digests were saved to the metadata
+        md = read_nerd(self.bag.nerdm_file_for("trial2.json"))
+        dfp = os.path.join(self.bag.bagdir, "data", "trial2.json")
+        self.assertEqual([c['algorithm']['tag'] for c in md['altChecksums']],
+                         ["md5", "sha512"])
+        self.assertEqual(md['altChecksums'][0]['hash'],
+                         digests_of(dfp, ["md5"])["md5"])
+
+        # new files get all their checksums on addition
+        self.bag.add_data_file("trial4.json",
+                               os.path.join(datadir, "trial1.json"))
+        md = read_nerd(self.bag.nerdm_file_for("trial4.json"))
+        self.assertEqual(md['altChecksums'][1]['hash'],
+                         digests_of(dfp.replace("trial2", "trial1"),
+                                    ["sha512"])["sha512"])
+        self.bag.write_data_manifest(True)
+
+        md['altChecksums'][0]['hash'] = "0" * 32
+        self.bag._write_json(md, self.bag.nerdm_file_for("trial4.json"))
+        with self.assertRaises(bldr.BagProfileError):
+            self.bag.write_data_manifest(True)
+        self.assertFalse(os.path.exists(os.path.join(self.bag.bagdir,
+                                                     "manifest-md5.txt")))
+
+    def test_tree_hash(self):
+        self.cfg['tree_hash'] = { "min_size": 70, "chunk_size": 32 }
+        self.bag = bldr.BagBuilder(self.tf.root, "testbag", self.cfg)
+        datafiles = [ "trial1.json", "trial2.json", 
+                      os.path.join("trial3", "trial3a.json") ]
+        for df in datafiles:
+            self.bag.add_data_file(df, os.path.join(datadir, df))
+
+        # trial1.json is too small (69 bytes)
+        self.assertFalse(os.path.exists(self.bag.treehash_file_for("trial1.json")))
+        t3path = os.path.join("trial3", "trial3a.json")
+        thfile = self.bag.treehash_file_for(t3path)
+        self.assertTrue(os.path.exists(thfile))
+        tree = read_nerd(thfile)
+        md = read_nerd(self.bag.nerdm_file_for(t3path))
+        self.assertEqual(tree['fileChecksum'], md['checksum']['hash'])
+        self.assertEqual(tree['chunkSize'], 32)
+        self.assertEqual(tree['size'], md['size'])
+
+        # missing tree hashes get restored
+        os.remove(thfile)
+        self.bag.ensure_tree_hashes()
+        self.assertEqual(read_nerd(thfile), tree)
+
+        self.bag.write_data_manifest(True)
+        dfile = os.path.join(self.bag.bagdir, "data", t3path)
+        with open(dfile, 'r+b') as fd:
+            fd.seek(40)
+            c = fd.read(1)
+            fd.seek(40)
+            fd.write(chr((ord(c) + 1) % 256))
+        try:
+            self.bag.write_data_manifest(True)
+            self.fail("Failed to detect corruption")
+        except bldr.BagProfileError as ex:
+            self.assertIn("32-63", str(ex))
+
+        # a tree hash is not rebuilt from a corrupted file
+        os.remove(thfile)
+        with self.assertRaises(bldr.BagProfileError):
+            self.bag.ensure_tree_hashes()
+        self.assertFalse(os.path.exists(thfile))
+        with self.assertRaises(bldr.BagProfileError):
+            self.bag.write_data_manifest(True)
+
     def test_trim_metadata_folders(self):
         manfile = os.path.join(self.bag.bagdir, "manifest-sha256.txt")
         datafiles = [ "trial1.json", "trial2.json", 
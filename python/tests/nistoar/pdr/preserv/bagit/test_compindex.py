@@ -0,0 +1,136 @@
+import os, sys, pdb, shutil, logging, json
+import unittest as test
+
+from nistoar.testing import *
+import nistoar.pdr.preserv.bagit.compindex as cidx
+
+# datadir = tests/nistoar/pdr/preserv/data
+datadir = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data"
+)
+
+def setUpModule():
+    ensure_tmpdir()
+
+def tearDownModule():
+    rmtmpdir()
+
+class TestComponentIndex(test.TestCase):
+
+    testbag = os.path.join(datadir, "samplembag")
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.bagdir = self.tf.track("samplembag")
+        shutil.copytree(self.testbag, self.bagdir)
+        self.metadir = os.path.join(self.bagdir, "metadata")
+        self.idxfile = os.path.join(self.bagdir, cidx.COMPINDEX_FILENAME)
+        self.idx = cidx.ComponentIndex(self.idxfile, self.metadir)
+
+    def tearDown(self):
+        self.tf.clean()
+
+    def test_rebuild(self):
+        self.assertFalse(os.path.exists(self.idxfile))
+        self.assertEqual(len(self.idx), 4)
+        self.assertTrue(os.path.exists(self.idxfile))
+        self.assertIn("trial3", self.idx)
+        self.assertNotIn("", self.idx)
+
+        ent = self.idx.get("trial1.json")
+        self.assertIn("nrdp:DataFile", ent['@type'])
+        self.assertEqual(ent['size'], 69)
+        self.assertTrue(ent['checksum'])
+        self.assertTrue(ent['mtime'])
+        self.assertEqual(sorted(self.idx.filepaths_of_type(":DataFile")),
+                         ["trial1.json", "trial2.json", "trial3/trial3a.json"])
+        self.assertEqual(self.idx.filepaths_of_type(":Subcollection"),
+                         ["trial3"])
+
+        # a corrupted index file gets rebuilt
+        with open(self.idxfile, 'a') as fd:
+            fd.write("goob\n")
+        idx = cidx.ComponentIndex(self.idxfile, self.metadir)
+        self.assertEqual(len(idx), 4)
+
+    def test_update_remove(self):
+        self.idx.update("trial2.json", {"@type": ["nrdp:ChecksumFile"],
+                                        "checksum": {"hash": "abcdef"},
+                                        "describes": "cmps/trial1.json"})
+        self.idx.update("trial4.json", {"@type": ["nrdp:DataFile"]}, 1.0)
+        self.idx.remove("trial3")
+        self.assertEqual(sorted([fp for fp, e in self.idx.items()]),
+                         ["trial1.json", "trial2.json", "trial4.json"])
+
+        # changes are persisted
+        idx = cidx.ComponentIndex(self.idxfile, self.metadir)
+        self.assertEqual(sorted([fp for fp, e in idx.items()]),
+                         ["trial1.json", "trial2.json", "trial4.json"])
+        self.assertEqual(idx.get("trial2.json"),
+                         {"@type": ["nrdp:ChecksumFile"], "mtime": None,
+                          "checksum": "abcdef",
+                          "describes": "cmps/trial1.json"})
+        self.assertEqual(idx.get("trial4.json")['mtime'], 1.0)
+
+        idx.compact()
+        with open(self.idxfile) as fd:
+            self.assertEqual(len(fd.readlines()), 3)
+
+        idx.discard()
+        self.assertFalse(os.path.exists(self.idxfile))
+        self.assertIn("trial3/trial3a.json", idx)
+
+    def test_validate(self):
+        self.assertEqual(len(self.idx), 4)
+        self.assertEqual(self.idx.validate(), 0)
+
+        # change the metadata behind the index's back
+        t1file = os.path.join(self.metadir, "trial1.json", "nerdm.json")
+        with open(t1file) as fd:
+            md = json.load(fd)
+        md['@type'] = ["nrdp:ChecksumFile"]
+        with open(t1file, 'w') as fd:
+            json.dump(md, fd)
+        os.utime(t1file, (5.0, 5.0))
+        shutil.rmtree(os.path.join(self.metadir, "trial2.json"))
+        os.mkdir(os.path.join(self.metadir, "trial4"))
+        with open(os.path.join(self.metadir, "trial4", "nerdm.json"), 'w') as fd:
+            json.dump({"@type": ["nrdp:Subcollection"]}, fd)
+
+        # a plain load only reads the index file
+        idx = cidx.ComponentIndex(self.idxfile, self.metadir)
+        self.assertEqual(sorted([fp for fp, e in idx.items()]),
+                         ["trial1.json", "trial2.json", "trial3",
+                          "trial3/trial3a.json"])
+
+        self.assertEqual(idx.validate(), 3)
+        self.assertEqual(sorted([fp for fp, e in idx.items()]),
+                         ["trial1.json", "trial3", "trial3/trial3a.json",
+                          "trial4"])
+        self.assertEqual(idx.get("trial1.json")['mtime'], 5.0)
+        self.assertEqual(idx.filepaths_of_type(":ChecksumFile"),
+                         ["trial1.json"])
+        self.assertEqual(sorted(idx.filepaths_of_type(":Subcollection")),
+                         ["trial3", "trial4"])
+
+        # the index file was brought up to date
+        with open(self.idxfile) as fd:
+            self.assertEqual(len(fd.readlines()), 4)
+        idx = cidx.ComponentIndex(self.idxfile, self.metadir)
+        self.assertEqual(idx.validate(), 0)
+        self.assertIn("trial4", idx)
+
+        # validating also compacts the index file
+        for i in range(60):
+            idx.update("trial4", {"@type": ["nrdp:Subcollection"]},
+                       idx.get("trial4")['mtime'])
+            idx.update("trial4", {"@type": ["nrdp:Subcollection"],
+                                  "size": i}, idx.get("trial4")['mtime'])
+        with open(self.idxfile) as fd:
+            self.assertGreater(len(fd.readlines()), 100)
+        self.assertEqual(idx.validate(), 0)
+        with open(self.idxfile) as fd:
+            self.assertEqual(len(fd.readlines()), 4)
+
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,176 @@
+import os, sys, pdb, json
+import unittest as test
+from collections import OrderedDict
+
+from nistoar.testing import *
+from nistoar.pdr import def_jq_libdir
+from nistoar.nerdm.convert import ComponentCounter, HierarchyBuilder
+import nistoar.pdr.preserv.bagit.inventory as inv
+import nistoar.pdr.preserv.bagit.bag as bag
+
+# datadir = nistoar/pdr/preserv/data
+datadir = os.path.join( os.path.dirname(os.path.dirname(__file__)), "data" )
+bagdir = os.path.join(datadir, "samplembag")
+
+FILE_TYPES = [ "nrdp:DataFile", "nrdp:DownloadableFile", "dcat:Distribution" ]
+CKSUM_TYPES = [ "nrdp:ChecksumFile", "nrdp:DownloadableFile",
+                "dcat:Distribution" ]
+COLL_TYPES = [ "nrdp:Subcollection" ]
+
+def _comp(filepath, types, id=None):
+    out = OrderedDict()
+    if filepath:
+        out['filepath'] = filepath
+    out['@id'] = id or "cmps/" + (filepath or "link")
+    out['@type'] = list(types)
+    return out
+
+def deep_components():
+    return [
+        _comp(None, ["nrd:AccessPage", "dcat:Distribution"], "#doi"),
+        _comp("a", COLL_TYPES),
+        _comp("readme.txt", FILE_TYPES),
+        _comp("a/data.csv", FILE_TYPES),
+        _comp("a/data.csv.sha256", CKSUM_TYPES),
+        _comp("a/b", COLL_TYPES),
+        _comp("a/b/c", COLL_TYPES),
+        _comp("a/b/c/deep.json", FILE_TYPES),
+        _comp("a/b/more.dat", FILE_TYPES),
+        _comp("empty", COLL_TYPES),
+        _comp(None, ["nrd:Hidden", "dcat:Distribution"], "#api")
+    ]
+
+class TestComponentInventory(test.TestCase):
+
+    def setUp(self):
+        self.comps = bag.NISTBag(bagdir).nerdm_record()['components']
+
+    def test_ctor(self):
+        ci = inv.ComponentInventory()
+        self.assertEqual(len(ci), 0)
+        self.assertEqual(ci.hierarchy(), [])
+        self.assertEqual(ci.inventory(),
+                         [{ "forCollection": "", "childCount": 0,
+                            "descCount": 0, "byType": [],
+                            "childCollections": [] }])
+
+        ci = inv.ComponentInventory(self.comps)
+        self.assertEqual(len(ci), 5)
+        self.assertIn("trial3/trial3a.json", ci)
+        self.assertNotIn("trial4", ci)
+
+    def test_inventory(self):
+        data = inv.ComponentInventory(self.comps).inventory()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['forCollection'], "")
+        self.assertEqual(data[0]['childCount'], 4)
+        self.assertEqual(data[0]['descCount'], 5)
+        self.assertEqual(data[0]['childCollections'], ["trial3"])
+        self.assertEqual(data[1]['forCollection'], "trial3")
+        self.assertEqual(data[1]['childCount'], 1)
+        self.assertEqual(data[1]['descCount'], 1)
+        self.assertEqual(data[1]['childCollections'], [])
+
+        bytype = dict([(t['forType'], t) for t in data[0]['byType']])
+        self.assertEqual(bytype['nrdp:DataFile']['childCount'], 2)
+        self.assertEqual(bytype['nrdp:DataFile']['descCount'], 3)
+        self.assertEqual(bytype['nrdp:Subcollection']['childCount'], 1)
+        self.assertEqual(bytype['nrdp:Subcollection']['descCount'], 1)
+
+    def test_deep_inventory(self):
+        data = inv.ComponentInventory(deep_components()).inventory()
+        self.assertEqual([c['forCollection'] for c in data],
+                         ["", "a", "a/b", "a/b/c", "empty"])
+        counts = dict([(c['forCollection'], (c['childCount'], c['descCount']))
+                       for c in data])
+        self.assertEqual(counts, { "": (5, 11), "a": (3, 6), "a/b": (2, 3),
+                                   "a/b/c": (1, 1), "empty": (0, 0) })
+        self.assertEqual(data[0]['childCollections'], ["a", "empty"])
+        self.assertEqual(data[1]['childCollections'], ["a/b"])
+        self.assertEqual(data[4]['byType'], [])
+
+    def test_hierarchy(self):
+        hier = inv.ComponentInventory(deep_components()).hierarchy()
+        self.assertEqual(json.loads(json.dumps(hier)), [
+            { "filepath": "a", "children": [
+                { "filepath": "a/data.csv" },
+                { "filepath": "a/data.csv.sha256" },
+                { "filepath": "a/b", "children": [
+                    { "filepath": "a/b/c", "children": [
+                        { "filepath": "a/b/c/deep.json" }
+                    ]},
+                    { "filepath": "a/b/more.dat" }
+                ]}
+            ]},
+            { "filepath": "readme.txt" },
+            { "filepath": "empty", "children": [] }
+        ])
+
+    def test_update(self):
+        comps = deep_components()
+        ci = inv.ComponentInventory(comps[:4])
+        for comp in comps[4:]:
+            ci.add(comp)
+        self.assertEqual(ci.inventory(),
+                         inv.ComponentInventory(comps).inventory())
+
+        # re-adding a component replaces it in place
+        ci.add(_comp("readme.txt", CKSUM_TYPES))
+        self.assertEqual(len(ci), len(comps))
+        self.assertEqual([h['filepath'] for h in ci.hierarchy()],
+                         ["a", "readme.txt", "empty"])
+
+        self.assertTrue(ci.remove("a/b/c/deep.json"))
+        self.assertTrue(ci.remove(comps[-1]))
+        self.assertFalse(ci.remove("goober"))
+        expect = [c for c in comps if c.get('filepath') != "a/b/c/deep.json"
+                                      and c['@id'] != "#api"]
+        expect[2] = _comp("readme.txt", CKSUM_TYPES)
+        ci2 = inv.ComponentInventory(expect)
+        self.assertEqual(ci.inventory(), ci2.inventory())
+        self.assertEqual(ci.hierarchy(), ci2.hierarchy())
+
+class TestAgainstJq(test.TestCase):
+    """
+    check that ComponentInventory gives the same results as the jq-based
+    ComponentCounter and HierarchyBuilder
+    """
+
+    def setUp(self):
+        self.cc = ComponentCounter(def_jq_libdir)
+        self.hb = HierarchyBuilder(def_jq_libdir)
+
+    def assertSameAsJq(self, comps):
+        ci = inv.ComponentInventory(comps)
+        self.assertEqual(ci.inventory(), self.cc.inventory(comps))
+        self.assertEqual(ci.hierarchy(), self.hb.build_hierarchy(comps))
+
+    def test_samplembag(self):
+        self.assertSameAsJq(bag.NISTBag(bagdir).nerdm_record()['components'])
+
+    def test_deep(self):
+        self.assertSameAsJq(deep_components())
+
+    def test_no_files(self):
+        self.assertSameAsJq([c for c in deep_components()
+                               if 'filepath' not in c])
+        self.assertSameAsJq([])
+
+    def test_reordered(self):
+        comps = deep_components()
+        comps.reverse()
+        self.assertSameAsJq(comps)
+
+    def test_updated(self):
+        comps = deep_components()
+        ci = inv.ComponentInventory(comps)
+        ci.remove("a/b")
+        ci.add(_comp("a/new.txt", FILE_TYPES))
+        comps = [c for c in comps if c.get('filepath') != "a/b"] + \
+                [_comp("a/new.txt", FILE_TYPES)]
+        self.assertEqual(ci.inventory(), self.cc.inventory(comps))
+        self.assertEqual(ci.hierarchy(), self.hb.build_hierarchy(comps))
+
+
+if __name__ == '__main__':
+    test.main()
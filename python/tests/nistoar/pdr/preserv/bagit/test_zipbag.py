@@ -0,0 +1,142 @@
+import os, sys, pdb, shutil, logging, json, zipfile
+import unittest as test
+
+from nistoar.testing import *
+import nistoar.pdr.preserv.bagit.bag as bag
+import nistoar.pdr.preserv.bagit.zipbag as zipbag
+import nistoar.pdr.preserv.bagit.exceptions as bagex
+import nistoar.pdr.exceptions as exceptions
+
+# datadir = nistoar/pdr/preserv/data
+datadir = os.path.join( os.path.dirname(os.path.dirname(__file__)), "data" )
+bagdir = os.path.join(datadir, "samplembag")
+
+def setUpModule():
+    ensure_tmpdir()
+
+def tearDownModule():
+    rmtmpdir()
+
+def zip_bag(srcdir, destfile):
+    # serialize a bag the way "zip -qr" would (with the bag's name as the
+    # top directory)
+    parent = os.path.dirname(srcdir)
+    with zipfile.ZipFile(destfile, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for dir, subdirs, files in os.walk(srcdir):
+            for f in files:
+                path = os.path.join(dir, f)
+                zf.write(path, os.path.relpath(path, parent))
+
+class TestZipNISTBag(test.TestCase):
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.zipfile = self.tf("samplembag.zip")
+        zip_bag(bagdir, self.zipfile)
+        self.bag = zipbag.ZipNISTBag(self.zipfile)
+        self.dbag = bag.NISTBag(bagdir)
+
+    def tearDown(self):
+        self.bag.close()
+        self.tf.clean()
+
+    def test_ctor(self):
+        self.assertEqual(self.bag.zipfile, self.zipfile)
+        self.assertEqual(self.bag.dir, "samplembag")
+        self.assertEqual(self.bag.name, "samplembag")
+        self.assertEqual(self.bag.data_dir, "samplembag/data")
+        self.assertEqual(self.bag.metadata_dir, "samplembag/metadata")
+        self.assertEqual(self.bag.nerd_file_for("trial3/trial3a.json"),
+                         "samplembag/metadata/trial3/trial3a.json/nerdm.json")
+
+    def test_not_a_bag(self):
+        with self.assertRaises(exceptions.StateException):
+            zipbag.ZipNISTBag(os.path.join(bagdir, "bagit.txt"))
+
+        badzip = self.tf("notabag.zip")
+        zip_bag(os.path.join(bagdir, "data"), badzip)
+        with self.assertRaises(bagex.BagFormatError):
+            zipbag.ZipNISTBag(badzip)
+
+    def test_structure(self):
+        for comp in "trial1.json trial2.json trial3 trial3/trial3a.json trial4"\
+                    .split():
+            self.assertEqual(self.bag.comp_exists(comp),
+                             self.dbag.comp_exists(comp))
+            self.assertEqual(self.bag.is_data_file(comp),
+                             self.dbag.is_data_file(comp))
+            self.assertEqual(self.bag.is_subcoll(comp),
+                             self.dbag.is_subcoll(comp))
+        self.assertTrue(self.bag.is_subcoll(""))
+
+        self.assertEqual(sorted(self.bag.subcoll_children("")),
+                         sorted(self.dbag.subcoll_children("")))
+        self.assertEqual(self.bag.subcoll_children("trial3"), ["trial3a.json"])
+        with self.assertRaises(bag.BadBagRequest):
+            self.bag.subcoll_children("trial4")
+
+        self.assertEqual(sorted(self.bag.iter_data_files()),
+                         sorted(self.dbag.iter_data_files()))
+
+    def test_tagfiles(self):
+        self.assertEqual(self.bag.get_baginfo(), self.dbag.get_baginfo())
+        self.assertEqual(list(self.bag.iter_fetch_records()),
+                         list(self.dbag.iter_fetch_records()))
+        self.assertEqual(self.bag.bagit_version, "0.97")
+        self.assertEqual(self.bag.tag_encoding, "UTF-8")
+        self.assertEqual(self.bag.multibag_dir, "samplembag/multibag")
+        self.assertTrue(self.bag.is_headbag())
+
+    def test_nerd_metadata_for(self):
+        self.assertEqual(self.bag.nerd_metadata_for("trial3/trial3a.json"),
+                         self.dbag.nerd_metadata_for("trial3/trial3a.json"))
+        self.assertEqual(self.bag.nerd_metadata_for(""),
+                         self.dbag.nerd_metadata_for(""))
+        with self.assertRaises(bagex.ComponentNotFound):
+            self.bag.nerd_metadata_for('goober')
+
+    def test_nerdm_record(self):
+        data = self.bag.nerdm_record()
+        expect = self.dbag.nerdm_record()
+
+        # the order of the components depends on how the bag is walked
+        comps = data.pop('components')
+        ecomps = expect.pop('components')
+        self.assertEqual(len(comps), 5)
+        self.assertEqual(len(comps), len(ecomps))
+        for comp in comps:
+            self.assertIn(comp, ecomps)
+
+        self.assertEqual(len(data['dataHierarchy']),
+                         len(expect['dataHierarchy']))
+        for comp in data.pop('dataHierarchy'):
+            self.assertIn(comp, expect['dataHierarchy'])
+        expect.pop('dataHierarchy')
+        self.assertEqual(data, expect)
+
+        data = json.loads("".join(self.bag.iter_nerdm_record()))
+        self.assertEqual(len(data['components']), 5)
+        self.assertEqual(data['inventory'][0]['descCount'], 5)
+
+    def test_payload_not_read(self):
+        opened = []
+        zopen = self.bag._zip.open
+        def spy(name, *args, **kw):
+            opened.append(name)
+            return zopen(name, *args, **kw)
+        self.bag._zip.open = spy
+
+        self.bag.nerdm_record()
+        self.bag.get_baginfo()
+        list(self.bag.iter_data_files())
+        list(self.bag.iter_fetch_records())
+
+        self.assertGreater(len(opened), 0)
+        self.assertEqual([f for f in opened
+                            if not f.startswith("samplembag/metadata/") and
+                               f not in ["samplembag/bag-info.txt",
+                                         "samplembag/fetch.txt"]], [])
+
+
+if __name__ == '__main__':
+    test.main()
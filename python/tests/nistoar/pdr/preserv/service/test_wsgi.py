@@ -1,4 +1,4 @@
-import os, pdb, sys, logging, threading, time, json, yaml
+import os, pdb, sys, logging, threading, time, json, yaml, zlib
 from copy import deepcopy
 import unittest as test
 
@@ -341,6 +341,74 @@ class TestApp(test.TestCase):
         self.assertEqual(data['state'], "successful")
         self.assertEqual(len(data['bagfiles']), 1)
 
+    def test_conditional_status(self):
+        req = {
+            'PATH_INFO': '/midas/'+self.midasid+'/',
+            'REQUEST_METHOD': 'PUT'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("201", self.resp[0])
+
+        self.resp = []
+        req = {
+            'PATH_INFO': '/midas/'+self.midasid,
+            'REQUEST_METHOD': 'GET'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        etag = [h for h in self.resp if h.startswith("ETag: ")]
+        self.assertEqual(len(etag), 1)
+        etag = etag[0][len("ETag: "):]
+        self.assertEqual(len([h for h in self.resp
+                              if h.startswith("Last-Modified: ")]), 1)
+
+        self.resp = []
+        req['HTTP_IF_NONE_MATCH'] = etag
+        body = self.svc(req, self.start)
+        self.assertIn("304", self.resp[0])
+        self.assertEqual(body, [])
+
+        # a changed status file invalidates the validators
+        stfile = os.path.join(self.statusdir, self.midasid+".json")
+        stat = status.SIPStatus(self.midasid, {"cachedir": self.statusdir})
+        time.sleep(0.01)
+        stat.update(status.FAILED)
+        os.utime(stfile, (time.time()+2, time.time()+2))
+        self.resp = []
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(json.loads(body[0])['state'], status.FAILED)
+
+    def test_compressed_status(self):
+        self.svc.compression['min_size'] = 0
+        req = {
+            'PATH_INFO': '/midas/'+self.midasid+'/',
+            'REQUEST_METHOD': 'PUT'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("201", self.resp[0])
+
+        self.resp = []
+        req = {
+            'PATH_INFO': '/midas/'+self.midasid,
+            'REQUEST_METHOD': 'GET',
+            'HTTP_ACCEPT_ENCODING': 'gzip'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertIn("Content-Encoding: gzip", self.resp)
+        self.assertIn("Vary: Accept-Encoding", self.resp)
+        data = json.loads(zlib.decompress("".join(body), 16+zlib.MAX_WBITS))
+        self.assertEqual(data['state'], "successful")
+
+        self.resp = []
+        req['PATH_INFO'] = '/midas/'
+        req['HTTP_ACCEPT_ENCODING'] = 'deflate'
+        body = self.svc(req, self.start)
+        self.assertIn("Content-Encoding: deflate", self.resp)
+        self.assertEqual(json.loads(zlib.decompress("".join(body))),
+                         [self.midasid])
+
     def test_bad_patch(self):
         req = {
             'PATH_INFO': '/',
@@ -0,0 +1,165 @@
+import os, sys, pdb, shutil, logging, json, time
+import unittest as test
+import threading, httplib
+
+from nistoar.testing import *
+from nistoar.pdr.publish.mdserv import asyncserver as asrv
+
+datadir = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    "preserv", "data"
+)
+
+def setUpModule():
+    ensure_tmpdir()
+
+def tearDownModule():
+    rmtmpdir()
+
+SERVER_ADDR = '127.0.0.1'
+
+class TestAsyncWSGIServer(test.TestCase):
+
+    def app(self, env, start_resp):
+        if env['PATH_INFO'] == '/slow':
+            time.sleep(0.5)
+        start_resp("200 OK", [("Content-Type", "text/plain"),
+                              ("X-Script-Name", env['SCRIPT_NAME'])])
+        if env['PATH_INFO'] == '/stream':
+            return self.stream()
+        return [env['PATH_INFO']]
+
+    def stream(self):
+        for i in range(5):
+            self.producers.append(threading.current_thread())
+            yield "chunk{0}\n".format(i)
+
+    def setUp(self):
+        self.producers = []
+        self.start({"workers": 2, "max_pending": 3})
+
+    def start(self, config):
+        self.server = asrv.AsyncWSGIServer((SERVER_ADDR, 0), self.app, config)
+        self.port = self.server.server_address[1]
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+
+    def stop(self):
+        self.server.stop()
+        self.server_thread.join()
+        self.server.server_close()
+
+    def tearDown(self):
+        self.stop()
+
+    def get(self, path, out=None):
+        conn = httplib.HTTPConnection(SERVER_ADDR, self.port)
+        conn.request("GET", path)
+        resp = conn.getresponse()
+        body = resp.read()
+        if out is not None:
+            out.append(resp.status)
+        self.script_name = resp.getheader("X-Script-Name")
+        return (resp.status, body)
+
+    def test_get(self):
+        self.assertEqual(self.get("/goob"), (200, "/goob"))
+        stats = json.loads(self.get("/_stats")[1])
+        self.assertEqual(stats['handled'], 1)
+        self.assertEqual(stats['active'], 0)
+        self.assertEqual(stats['queued'], 0)
+
+    def test_escaped_path(self):
+        self.assertEqual(self.get("/goob%20er/gurn%2Fey"),
+                         (200, "/goob er/gurn/ey"))
+        self.assertEqual(self.script_name, "")
+
+    def test_base_path(self):
+        self.stop()
+        self.start({"workers": 2, "base_path": "/midas/"})
+
+        self.assertEqual(self.get("/midas/goob"), (200, "/goob"))
+        self.assertEqual(self.script_name, "/midas")
+        self.assertEqual(self.get("/midas"), (200, ""))
+        self.assertEqual(self.script_name, "/midas")
+        self.assertEqual(self.get("/mid%61s/goob"), (200, "/goob"))
+        self.assertEqual(self.get("/goob")[0], 404)
+        self.assertEqual(self.get("/midasgoob")[0], 404)
+        self.assertEqual(self.get("/_stats")[0], 200)
+
+    def test_stream(self):
+        self.assertEqual(self.get("/stream"),
+                         (200, "".join("chunk{0}\n".format(i)
+                                       for i in range(5))))
+
+        # the body is produced by the workers, not the event loop
+        self.assertEqual(len(self.producers), 5)
+        self.assertNotIn(self.server_thread, self.producers)
+
+    def test_limit(self):
+        statuses = []
+        clients = [threading.Thread(target=self.get, args=("/slow", statuses))
+                   for i in range(5)]
+        for c in clients:
+            c.start()
+        time.sleep(0.2)
+
+        # slow requests do not hold up others, but the number pending is
+        # limited
+        self.assertEqual(self.get("/fast")[0], 503)
+        for c in clients:
+            c.join()
+        self.assertEqual(sorted(statuses), [200, 200, 200, 503, 503])
+
+        stats = self.server.stats()
+        self.assertEqual(stats['rejected'], 3)
+        self.assertGreater(stats['max_queued'], 0)
+        self.assertEqual(self.get("/fast"), (200, "/fast"))
+
+class TestAsyncMetadataServer(test.TestCase):
+
+    testsip = os.path.join(datadir, "midassip")
+    midasid = '3A1EE2F169DD3B8CE0531A570681DB5D1491'
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.bagparent = self.tf.mkdir("publish")
+        config = {
+            'working_dir':     self.bagparent,
+            'review_dir':      os.path.join(self.testsip, "review"),
+            'upload_dir':      os.path.join(self.testsip, "upload"),
+            'id_registry_dir': self.bagparent,
+            'async_server':    { "workers": 2 }
+        }
+        self.server = asrv.AsyncMetadataServer((SERVER_ADDR, 0), config)
+        self.port = self.server.server_address[1]
+        self.server.reqlim = 1
+        self.server_thread = threading.Thread(
+                                 target=self.server.handle_limited_requests)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.server_thread.join()
+        self.server.server_close()
+        self.tf.clean()
+
+    def test_good_id(self):
+        conn = httplib.HTTPConnection(SERVER_ADDR, self.port)
+        conn.request("GET", "/midas/"+self.midasid)
+        resp = conn.getresponse()
+        self.assertEqual(resp.status, 200)
+
+        data = json.loads(resp.read())
+        self.assertEqual(data['ediid'], self.midasid)
+        self.assertEqual(len(data['components']), 8)
+
+    def test_outside_base_path(self):
+        conn = httplib.HTTPConnection(SERVER_ADDR, self.port)
+        conn.request("GET", "/"+self.midasid)
+        resp = conn.getresponse()
+        self.assertEqual(resp.status, 404)
+
+
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,82 @@
+import os, sys, pdb, json
+import unittest as test
+
+import nistoar.pdr.publish.mdserv.cache as cache
+
+class TestResponseCache(test.TestCase):
+
+    def test_ctor(self):
+        c = cache.ResponseCache()
+        self.assertEqual(c.max_entries, cache.DEF_MAX_ENTRIES)
+        self.assertEqual(c.max_bytes, cache.DEF_MAX_BYTES)
+        self.assertFalse(c.compress)
+        self.assertEqual(c.stats(), {"hits": 0, "misses": 0, "entries": 0,
+                                     "bytes": 0})
+
+    def test_get_put(self):
+        c = cache.ResponseCache({"max_entries": 2})
+        self.assertIsNone(c.get(("a", "1")))
+        c.put(("a", "1"), "goob")
+        self.assertEqual(c.get(("a", "1")), "goob")
+        self.assertEqual((c.hits, c.misses), (1, 1))
+
+        # a new fingerprint replaces the old
+        c.put(("a", "2"), "gurn")
+        self.assertIsNone(c.get(("a", "1")))
+        self.assertEqual(c.get(("a", "2")), "gurn")
+        self.assertEqual(len(c), 1)
+
+        # least recently used is evicted
+        c.put(("b", "1"), "foo")
+        c.get(("a", "2"))
+        c.put(("c", "1"), "bar")
+        self.assertEqual(len(c), 2)
+        self.assertIsNone(c.get(("b", "1")))
+        self.assertEqual(c.get(("a", "2")), "gurn")
+        self.assertEqual(c.stats()['bytes'], 7)
+
+        c.invalidate("a")
+        self.assertIsNone(c.get(("a", "2")))
+        c.clear()
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.stats()['bytes'], 0)
+
+    def test_max_bytes(self):
+        c = cache.ResponseCache({"max_bytes": 10})
+        c.put(("a", "1"), "x" * 6)
+        c.put(("b", "1"), "y" * 6)
+        self.assertIsNone(c.get(("a", "1")))
+        self.assertEqual(c.get(("b", "1")), "y" * 6)
+        c.put(("c", "1"), "z" * 11)
+        self.assertIsNone(c.get(("c", "1")))
+
+    def test_compress(self):
+        body = json.dumps({"goob": ["gurn"] * 1000})
+        c = cache.ResponseCache({"compress": True})
+        c.put(("a", "1"), body)
+        self.assertLess(c.stats()['bytes'], len(body))
+        self.assertEqual(c.get(("a", "1")), body)
+        self.assertEqual(cache.gzip_decompress(cache.gzip_compress(body)), body)
+
+    def test_encodings(self):
+        c = cache.ResponseCache()
+        c.put(("a", "1"), "goob")
+        self.assertIsNone(c.get(("a", "1"), "gzip"))
+        c.put(("a", "1"), "GOOB", "gzip")
+        self.assertEqual(c.get(("a", "1"), "gzip"), "GOOB")
+        self.assertEqual(c.get(("a", "1")), "goob")
+        self.assertEqual(len(c), 2)
+
+        c.put(("a", "2"), "gurn")
+        self.assertIsNone(c.get(("a", "1"), "gzip"))
+        self.assertEqual(len(c), 1)
+
+        # a compressing cache can serve gzip from its stored form
+        body = json.dumps({"goob": ["gurn"] * 1000})
+        c = cache.ResponseCache({"compress": True})
+        c.put(("a", "1"), body)
+        self.assertEqual(cache.gzip_decompress(c.get(("a", "1"), "gzip")), body)
+        self.assertIsNone(c.get(("a", "1"), "deflate"))
+
+if __name__ == '__main__':
+    test.main()
@@ -1,4 +1,4 @@
-import os, sys, pdb, shutil, logging, json
+import os, sys, pdb, shutil, logging, json, time, threading, filelock
 from cStringIO import StringIO
 from io import BytesIO
 import warnings as warn
@@ -198,6 +198,50 @@ class TestPrePubMetadataService(test.TestCase):
         with self.assertRaises(serv.SIPDirectoryNotFound):
             self.srv.resolve_id("asldkfjsdalfk")
 
+    def test_stream_id(self):
+        mdata = self.srv.resolve_id(self.midasid)
+        chunks = list(self.srv.stream_id(self.midasid))
+        self.assertEqual(json.loads("".join(chunks)), mdata)
+
+        with self.assertRaises(serv.SIPDirectoryNotFound):
+            self.srv.stream_id("asldkfjsdalfk")
+
+    def test_not_found_cache(self):
+        revdir = self.tf.mkdir("review")
+        upldir = self.tf.mkdir("upload")
+        srv = serv.PrePubMetadataService({ 'working_dir': self.workdir,
+                                           'review_dir': revdir,
+                                           'upload_dir': upldir })
+        try:
+            srv.resolve_id("goob")
+            self.fail("SIPDirectoryNotFound not raised")
+        except serv.SIPDirectoryNotFound, ex:
+            first = ex
+        self.assertIn("goob", srv._notfound)
+
+        # the answer is remembered
+        with self.assertRaises(serv.SIPDirectoryNotFound) as cm:
+            srv.locate_data_file("goob", "trial1.json")
+        self.assertIs(cm.exception, first)
+
+        # a change to a parent directory forgets it
+        os.mkdir(os.path.join(upldir, "gurn"))
+        os.utime(upldir, (time.time()+5, time.time()+5))
+        with self.assertRaises(serv.SIPDirectoryNotFound) as cm:
+            srv.resolve_id("goob")
+        self.assertIsNot(cm.exception, first)
+
+        # as does the passing of time
+        srv.cfg['notfound_ttl'] = 0.1
+        srv._notfound.clear()
+        with self.assertRaises(serv.SIPDirectoryNotFound) as cm:
+            srv.resolve_id("goob")
+        first = cm.exception
+        time.sleep(0.2)
+        with self.assertRaises(serv.SIPDirectoryNotFound) as cm:
+            srv.resolve_id("goob")
+        self.assertIsNot(cm.exception, first)
+
     def test_locate_data_file(self):
         loc = self.srv.locate_data_file(self.midasid, 'trial3/trial3a.json')
         self.assertEquals(len(loc), 2)
@@ -211,6 +255,168 @@ class TestPrePubMetadataService(test.TestCase):
                                                'trial1.json'))
         self.assertEquals(loc[1], "application/json")
 
+    def test_single_flight(self):
+        calls = []
+        prepare = self.srv._prepare_metadata_bag
+        def slow_prepare(id):
+            calls.append(id)
+            time.sleep(0.5)
+            return prepare(id)
+        self.srv._prepare_metadata_bag = slow_prepare
+
+        results = []
+        def resolve():
+            results.append(self.srv.prepare_metadata_bag(self.midasid))
+        threads = [threading.Thread(target=resolve) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all([r is results[0] for r in results]))
+        self.assertEqual(self.srv._flights, {})
+
+        with self.assertRaises(serv.SIPDirectoryNotFound):
+            self.srv.prepare_metadata_bag("asldkfjsdalfk")
+        self.assertEqual(self.srv._flights, {})
+
+    def test_reuse_concurrent_preparation(self):
+        self.srv.cfg['sip_fingerprint'] = False
+        self.srv.prepare_metadata_bag(self.midasid)
+        stampfile = self.bagdir + ".prepared"
+        self.assertTrue(os.path.exists(stampfile))
+
+        # pretend that another process is preparing the bag
+        lock = filelock.FileLock(self.bagdir + ".lock")
+        lock.acquire()
+        results = []
+        t = threading.Thread(target=lambda:
+                      results.append(self.srv.prepare_metadata_bag(self.midasid)))
+        t.start()
+        time.sleep(0.3)
+        os.utime(stampfile, (time.time()+10, time.time()+10))
+        lock.release()
+        t.join()
+
+        bagger = results[0]
+        self.assertIsNone(bagger.datafile_changes)
+        self.assertIn("trial1.json", bagger.datafiles)
+
+    def test_preparation_timeout(self):
+        self.srv.cfg['sip_fingerprint'] = False
+        self.srv.cfg['prepare_lock_timeout'] = 0.2
+
+        # pretend that another process is stuck preparing the bag
+        lock = filelock.FileLock(self.bagdir + ".lock")
+        lock.acquire()
+        try:
+            with self.assertRaises(serv.PreparationTimeout):
+                self.srv.prepare_metadata_bag(self.midasid)
+        finally:
+            lock.release()
+        self.assertEqual(self.srv._flights, {})
+
+        self.assertIn("trial1.json",
+                      self.srv.prepare_metadata_bag(self.midasid).datafiles)
+
+    def test_fingerprint(self):
+        mdata = self.srv.resolve_id(self.midasid)
+        fpfile = self.bagdir + ".fingerprint"
+        self.assertTrue(os.path.exists(fpfile))
+        self.assertTrue(os.path.exists(self.bagdir + ".record.json"))
+
+        # an unchanged SIP is neither prepared nor assembled again
+        bagger = self.srv.prepare_metadata_bag(self.midasid)
+        self.assertIsNone(bagger.datafile_changes)
+        self.assertIn("trial1.json", bagger.datafiles)
+        make_nerdm_record = self.srv.make_nerdm_record
+        self.srv.make_nerdm_record = None
+        self.assertEqual(self.srv.resolve_id(self.midasid), mdata)
+
+        # nor is a bagger needed to serve it
+        create_bagger = self.srv._create_bagger
+        self.srv._create_bagger = None
+        self.assertEqual(self.srv.resolve_id(self.midasid), mdata)
+        fp = self.srv.current_fingerprint(self.midasid)
+        self.assertEqual(self.srv.fingerprinted_record(self.midasid, fp),
+                         (mdata, fp))
+        self.assertIsNotNone(self.srv.get_component(self.midasid,
+                                                    "trial1.json", fp))
+        self.assertEqual(self.srv.list_components(self.midasid,
+                                                  fingerprint=fp)['total'],
+                         len(mdata['components']))
+        self.assertIsNotNone(
+            self.srv.locate_data_file(self.midasid, "trial1.json")[0])
+        self.srv._create_bagger = create_bagger
+
+        # a different fingerprint forces preparation
+        self.srv.make_nerdm_record = make_nerdm_record
+        with open(fpfile, 'w') as fd:
+            fd.write("goob")
+        bagger = self.srv.prepare_metadata_bag(self.midasid)
+        self.assertIsNotNone(bagger.datafile_changes)
+        with open(fpfile) as fd:
+            self.assertNotEqual(fd.read(), "goob")
+        self.assertEqual(self.srv.resolve_id(self.midasid), mdata)
+
+    def test_locate_data_file_prepared(self):
+        loc = self.srv.locate_data_file(self.midasid, 'trial1.json')
+        self.assertTrue(os.path.exists(self.bagdir + ".fingerprint"))
+
+        # an unchanged SIP need not be prepared again to locate its files
+        self.srv.prepare_metadata_bag = None
+        self.assertEqual(self.srv.locate_data_file(self.midasid,'trial1.json'),
+                         loc)
+        self.assertIn(self.midasid, self.srv._datafiles)
+        self.assertEqual(self.srv.locate_data_file(self.midasid, 'trial3/trial3a.json'),
+                         (os.path.join(self.upldir, self.midasid[32:],
+                                       'trial3/trial3a.json'),
+                          "application/json"))
+        self.assertEqual(self.srv.locate_data_file(self.midasid, 'goob.json'),
+                         (None, None))
+
+    def test_list_components(self):
+        rec = self.srv.resolve_id(self.midasid)
+        page = self.srv.list_components(self.midasid)
+        self.assertEqual(page['total'], len(rec['components']))
+        self.assertEqual(page['offset'], 0)
+        self.assertIsNone(page['limit'])
+        self.assertEqual(sorted([c['@id'] for c in page['components']]),
+                         sorted([c['@id'] for c in rec['components']]))
+
+        fps = [c['filepath'] for c in page['components'] if 'filepath' in c]
+        self.assertEqual(fps, sorted(fps))
+
+        page = self.srv.list_components(self.midasid, 1, 2)
+        self.assertEqual(page['total'], len(rec['components']))
+        self.assertEqual(len(page['components']), 2)
+        self.assertEqual(page['components'],
+                    self.srv.list_components(self.midasid)['components'][1:3])
+
+        page = self.srv.list_components(self.midasid, subcoll="trial3")
+        self.assertEqual([c['filepath'] for c in page['components']],
+                         ["trial3/trial3a.json"])
+        page = self.srv.list_components(self.midasid, subcoll="")
+        self.assertIn("trial3", [c['filepath'] for c in page['components']])
+        self.assertNotIn("trial3/trial3a.json",
+                         [c['filepath'] for c in page['components']])
+
+    def test_get_component(self):
+        comp = self.srv.get_component(self.midasid, "trial3/trial3a.json")
+        self.assertEqual(comp['filepath'], "trial3/trial3a.json")
+        self.assertEqual(comp['mediaType'], "application/json")
+        self.assertIsNone(self.srv.get_component(self.midasid, "goob.json"))
+        self.assertIsNone(self.srv.get_component(self.midasid, ""))
+
+        # paths may not lead outside of the component metadata
+        self.assertIsNone(self.srv.get_component(self.midasid,
+                                                 "trial3/../trial1.json"))
+        self.assertIsNone(self.srv.get_component(self.midasid,
+                                       "../../"+self.midasid+"/metadata"))
+        self.assertIsNone(self.srv.get_component(self.midasid, "metadata"))
+
     def test_no_locate_data_file(self):
         loc = self.srv.locate_data_file(self.midasid, 'goober/trial3a.json')
         self.assertEquals(len(loc), 2)
@@ -1,4 +1,4 @@
-import os, sys, pdb, shutil, logging, json
+import os, sys, pdb, shutil, logging, json, zlib, filelock
 import unittest as test
 from nistoar.testing import *
 from nistoar.pdr import def_jq_libdir
@@ -88,6 +88,199 @@ class TestApp(test.TestCase):
         self.assertEqual(data['ediid'], '3A1EE2F169DD3B8CE0531A570681DB5D1491')
         self.assertEqual(len(data['components']), 8)
         
+    def test_cached_response(self):
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
+            'REQUEST_METHOD': 'GET'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(self.svc.resp_cache.stats()['misses'], 1)
+        self.assertEqual(len(self.svc.resp_cache), 1)
+
+        self.resp = []
+        body2 = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(body2, body)
+        self.assertEqual(self.svc.resp_cache.hits, 1)
+        self.assertIn("Content-Length: {0}".format(len(body[0])), self.resp)
+
+    def test_one_fingerprint_per_request(self):
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
+            'REQUEST_METHOD': 'GET'
+        }
+        self.svc(req, self.start)
+        self.svc.resp_cache.clear()
+
+        checks = []
+        current_fingerprint = self.svc.mdsvc.current_fingerprint
+        def spy(id):
+            checks.append(id)
+            return current_fingerprint(id)
+        self.svc.mdsvc.current_fingerprint = spy
+
+        self.resp = []
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(len(checks), 1)
+
+        checks[:] = []
+        self.resp = []
+        req['PATH_INFO'] += '/_comps/trial1.json'
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(len(checks), 1)
+
+    def test_conditional_get(self):
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
+            'REQUEST_METHOD': 'GET'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        etag = [h for h in self.resp if h.startswith("ETag: ")]
+        self.assertEqual(len(etag), 1)
+        etag = etag[0][len("ETag: "):]
+        lastmod = [h for h in self.resp if h.startswith("Last-Modified: ")]
+        self.assertEqual(len(lastmod), 1)
+        lastmod = lastmod[0][len("Last-Modified: "):]
+
+        self.resp = []
+        req['HTTP_IF_NONE_MATCH'] = etag
+        body = self.svc(req, self.start)
+        self.assertIn("304", self.resp[0])
+        self.assertIn("ETag: "+etag, self.resp)
+        self.assertEqual(body, [])
+
+        self.resp = []
+        req['HTTP_IF_NONE_MATCH'] = '"goob"'
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertGreater(len(body), 0)
+
+        self.resp = []
+        del req['HTTP_IF_NONE_MATCH']
+        req['HTTP_IF_MODIFIED_SINCE'] = lastmod
+        body = self.svc(req, self.start)
+        self.assertIn("304", self.resp[0])
+
+    def test_compressed_response(self):
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
+            'REQUEST_METHOD': 'GET'
+        }
+        plain = self.svc(req, self.start)[0]
+
+        self.resp = []
+        req['HTTP_ACCEPT_ENCODING'] = 'gzip, deflate'
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertIn("Content-Encoding: gzip", self.resp)
+        self.assertIn("Vary: Accept-Encoding", self.resp)
+        self.assertEqual(zlib.decompress("".join(body), 16+zlib.MAX_WBITS),
+                         plain)
+        etag = [h for h in self.resp if h.startswith("ETag: ")][0][6:]
+        self.assertTrue(etag.endswith('-gzip"'))
+
+        self.resp = []
+        req['HTTP_ACCEPT_ENCODING'] = 'deflate'
+        body = self.svc(req, self.start)
+        self.assertIn("Content-Encoding: deflate", self.resp)
+        self.assertEqual(zlib.decompress("".join(body)), plain)
+
+        # large responses are compressed as they are sent
+        self.svc.compression['stream_size'] = 0
+        self.svc.resp_cache.clear()
+        self.resp = []
+        req['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        body = self.svc(req, self.start)
+        self.assertEqual(len([h for h in self.resp
+                              if h.startswith("Content-Length:")]), 0)
+        self.assertEqual(zlib.decompress("".join(body), 16+zlib.MAX_WBITS),
+                         plain)
+        self.assertIsNotNone(self.svc.resp_cache.get(
+            (self.midasid, self.svc.mdsvc.current_fingerprint(self.midasid)),
+            "gzip"))
+
+    def test_streamed_response(self):
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
+            'REQUEST_METHOD': 'GET'
+        }
+        plain = self.svc(req, self.start)[0]
+
+        self.svc.stream_records = True
+        self.svc.resp_cache.clear()
+        self.resp = []
+        body = "".join(self.svc(req, self.start))
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(len([h for h in self.resp
+                              if h.startswith("Content-Length:")]), 0)
+        self.assertEqual(len([h for h in self.resp if h.startswith("ETag:")]),
+                         1)
+        self.assertEqual(json.loads(body), json.loads(plain))
+
+        # the streamed response was cached
+        self.resp = []
+        self.assertEqual(self.svc(req, self.start), [body])
+        self.assertIn("Content-Length: {0}".format(len(body)), self.resp)
+
+        self.svc.resp_cache.clear()
+        self.resp = []
+        req['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        body = self.svc(req, self.start)
+        self.assertIn("Content-Encoding: gzip", self.resp)
+        self.assertEqual(json.loads(zlib.decompress("".join(body),
+                                                    16+zlib.MAX_WBITS)),
+                         json.loads(plain))
+
+    def test_components(self):
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491/_comps',
+            'QUERY_STRING': 'offset=1&limit=2',
+            'REQUEST_METHOD': 'GET'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        page = json.loads(body[0])
+        self.assertEqual(page['offset'], 1)
+        self.assertEqual(page['limit'], 2)
+        self.assertEqual(len(page['components']), 2)
+        self.assertGreater(page['total'], 2)
+
+        self.resp = []
+        req['QUERY_STRING'] = 'subcoll=trial3'
+        body = self.svc(req, self.start)
+        page = json.loads(body[0])
+        self.assertEqual([c['filepath'] for c in page['components']],
+                         ["trial3/trial3a.json"])
+
+        self.resp = []
+        req['QUERY_STRING'] = 'limit=-1'
+        body = self.svc(req, self.start)
+        self.assertIn("400", self.resp[0])
+
+        self.resp = []
+        req['PATH_INFO'] += '/trial3/trial3a.json'
+        req['QUERY_STRING'] = ''
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(json.loads(body[0])['filepath'],
+                         "trial3/trial3a.json")
+
+        self.resp = []
+        req['PATH_INFO'] = '/3A1EE2F169DD3B8CE0531A570681DB5D1491/_comps/goob'
+        body = self.svc(req, self.start)
+        self.assertIn("404", self.resp[0])
+
+        # another dataset's metadata cannot be reached through a component
+        self.resp = []
+        req['PATH_INFO'] = '/3A1EE2F169DD3B8CE0531A570681DB5D1491/_comps/' + \
+                           '../../3A1EE2F169DD3B8CE0531A570681DB5D1491/metadata'
+        body = self.svc(req, self.start)
+        self.assertIn("404", self.resp[0])
+
     def test_head_good_id(self):
         req = {
             'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
@@ -99,6 +292,25 @@ class TestApp(test.TestCase):
         self.assertIn("200", self.resp[0])
         self.assertEquals(len(body), 0)
         
+    def test_preparation_timeout(self):
+        self.svc.mdsvc.cfg['prepare_lock_timeout'] = 0.2
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
+            'REQUEST_METHOD': 'GET'
+        }
+
+        # pretend that another process is stuck preparing the bag
+        lock = filelock.FileLock(self.bagdir + ".lock")
+        lock.acquire()
+        try:
+            body = self.svc(req, self.start)
+        finally:
+            lock.release()
+
+        self.assertGreater(len(self.resp), 0)
+        self.assertIn("503", self.resp[0])
+        self.assertEqual(body, [])
+
     def test_bad_meth(self):
         req = {
             'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491',
@@ -134,6 +346,58 @@ class TestApp(test.TestCase):
         redirect = [r for r in self.resp if "X-Accel-Redirect:" in r]
         self.assertGreater(len(redirect), 0)
         self.assertEqual(redirect[0],"X-Accel-Redirect: /midasdata/upload_dir/1491/trial3/trial3a.json")
+
+    def test_stream_datafile(self):
+        self.svc.filemap = {}
+        dfile = os.path.join(self.revdir, "1491", "trial1.json")
+        with open(dfile, 'rb') as fd:
+            content = fd.read()
+        req = {
+            'PATH_INFO': '/3A1EE2F169DD3B8CE0531A570681DB5D1491/trial1.json',
+            'REQUEST_METHOD': 'GET'
+        }
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual("".join(body), content)
+        self.assertIn("Content-Length: {0}".format(len(content)), self.resp)
+        self.assertIn("Accept-Ranges: bytes", self.resp)
+        self.assertEqual(len([r for r in self.resp
+                              if "X-Accel-Redirect:" in r]), 0)
+
+        self.resp = []
+        req['REQUEST_METHOD'] = 'HEAD'
+        body = self.svc(req, self.start)
+        self.assertIn("200", self.resp[0])
+        self.assertEqual(body, [])
+        self.assertIn("Content-Length: {0}".format(len(content)), self.resp)
+
+        self.resp = []
+        req['REQUEST_METHOD'] = 'GET'
+        req['HTTP_RANGE'] = 'bytes=2-11'
+        body = self.svc(req, self.start)
+        self.assertIn("206", self.resp[0])
+        self.assertEqual("".join(body), content[2:12])
+        self.assertIn("Content-Range: bytes 2-11/{0}".format(len(content)),
+                      self.resp)
+        self.assertIn("Content-Length: 10", self.resp)
+
+        self.resp = []
+        req['HTTP_RANGE'] = 'bytes=0-1,-5'
+        body = "".join(self.svc(req, self.start))
+        self.assertIn("206", self.resp[0])
+        ctype = [r for r in self.resp if r.startswith("Content-Type:")][0]
+        self.assertIn("multipart/byteranges; boundary=", ctype)
+        self.assertIn("Content-Length: {0}".format(len(body)), self.resp)
+        self.assertIn(content[:2], body)
+        self.assertIn(content[-5:], body)
+        self.assertIn("Content-Range: bytes {0}-{1}/{2}".
+                      format(len(content)-5, len(content)-1, len(content)),
+                      body)
+
+        self.resp = []
+        req['HTTP_RANGE'] = 'bytes=1000-'
+        body = self.svc(req, self.start)
+        self.assertIn("416", self.resp[0])
         
 
         
@@ -0,0 +1,271 @@
+import os, sys, pdb, json, subprocess, hashlib
+import unittest as test
+
+from nistoar.testing import *
+import nistoar.pdr.checksum as cksum
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+testdatadir = os.path.join(testdir, 'preserv', 'data', 'simplesip')
+
+datafiles = [ os.path.join(testdatadir, f) for f in
+              "trial1.json trial2.json trial3/trial3a.json _pod.json".split() ]
+
+def syssum(filepath):
+    cmd = ["sha256sum", filepath]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+    (out, err) = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(err + "\nFailed sha256sum command: " +
+                           " ".join(cmd))
+    return out.split()[0]
+
+class TestChecksumEngine(test.TestCase):
+
+    def test_ctor(self):
+        eng = cksum.ChecksumEngine()
+        self.assertEqual(eng.workers, 1)
+        self.assertEqual(eng.pool_type, "thread")
+        self.assertEqual(eng.max_inflight, cksum.DEF_MAX_INFLIGHT_BYTES)
+
+        eng = cksum.ChecksumEngine({"workers": 4, "pool_type": "process",
+                                    "max_inflight_bytes": 100})
+        self.assertEqual(eng.workers, 4)
+        self.assertEqual(eng.pool_type, "process")
+        self.assertEqual(eng.max_inflight, 100)
+
+        with self.assertRaises(ValueError):
+            cksum.ChecksumEngine({"pool_type": "goober"})
+
+    def test_serial(self):
+        eng = cksum.ChecksumEngine()
+        self.assertEqual(eng.checksums_of(datafiles),
+                         [syssum(f) for f in datafiles])
+        self.assertEqual(eng.checksums_of([]), [])
+
+    def test_threads(self):
+        eng = cksum.ChecksumEngine({"workers": 3})
+        self.assertEqual(eng.checksums_of(datafiles),
+                         [syssum(f) for f in datafiles])
+
+        # force only one file to be read at a time
+        eng = cksum.ChecksumEngine({"workers": 3, "max_inflight_bytes": 1})
+        results = list(eng.iter_checksums(datafiles))
+        self.assertEqual([r[0] for r in results], datafiles)
+        self.assertEqual([r[1] for r in results],
+                         [syssum(f) for f in datafiles])
+
+    def test_processes(self):
+        eng = cksum.ChecksumEngine({"workers": 2, "pool_type": "process"})
+        self.assertEqual(eng.checksums_of(datafiles),
+                         [syssum(f) for f in datafiles])
+
+    def test_digests(self):
+        algs = ["sha256", "md5", "sha512"]
+        need = []
+        for f in datafiles:
+            with open(f) as fd:
+                data = fd.read()
+            need.append(dict([(a, hashlib.new(a, data).hexdigest())
+                              for a in algs]))
+
+        eng = cksum.ChecksumEngine({"workers": 2}, algorithms=algs)
+        self.assertEqual(eng.algorithms, algs)
+        self.assertEqual([d for f, d in eng.iter_digests(datafiles)], need)
+        self.assertEqual(eng.digests_of(datafiles[0]), need[0])
+        self.assertEqual(eng.digests_of(datafiles[0], ["md5"]),
+                         {"md5": need[0]["md5"]})
+        self.assertEqual(eng.checksums_of(datafiles),
+                         [d["sha256"] for d in need])
+
+        eng = cksum.ChecksumEngine({"workers": 2, "pool_type": "process"})
+        self.assertEqual([d for f, d in eng.iter_digests(datafiles, algs)],
+                         need)
+
+        with self.assertRaises(ValueError):
+            cksum.ChecksumEngine(algorithms=["goob"])
+
+    def test_missing_file(self):
+        eng = cksum.ChecksumEngine({"workers": 2})
+        with self.assertRaises(OSError):
+            eng.checksums_of(datafiles + [os.path.join(testdatadir,"goob")])
+
+    def test_cached(self):
+        tf = Tempfiles()
+        try:
+            cache = cksum.ChecksumCache(tf.track("cs.sqlite"))
+            eng = cksum.ChecksumEngine({"workers": 2}, cache)
+            self.assertEqual(eng.checksums_of(datafiles),
+                             [syssum(f) for f in datafiles])
+            self.assertEqual(len(cache), len(datafiles))
+            self.assertEqual(eng.checksum_of(datafiles[0]), syssum(datafiles[0]))
+            self.assertEqual(len(cache), len(datafiles))
+        finally:
+            tf.clean()
+
+    def test_copy_file(self):
+        tf = Tempfiles()
+        try:
+            src = datafiles[0]
+            dest = tf.track("copy.json")
+            cache = cksum.ChecksumCache(tf.track("cs.sqlite"))
+            eng = cksum.ChecksumEngine({}, cache)
+
+            (digests, size, head) = eng.copy_file(src, dest)
+            hash = digests['sha256']
+            self.assertEqual(hash, syssum(src))
+            self.assertEqual(size, os.stat(src).st_size)
+            with open(src, 'rb') as fd:
+                self.assertEqual(head, fd.read(512))
+            self.assertEqual(syssum(dest), hash)
+
+            # both files are now in the cache
+            self.assertEqual(cache.get(src), hash)
+            self.assertEqual(cache.get(dest), hash)
+        finally:
+            tf.clean()
+
+class TestTreeHash(test.TestCase):
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.datafile = self.tf.track("data.bin")
+        with open(self.datafile, 'wb') as fd:
+            fd.write("".join([chr(i % 256) for i in range(1000)]))
+
+    def tearDown(self):
+        self.tf.clean()
+
+    def test_chunk_ranges(self):
+        self.assertEqual(cksum.chunk_ranges(1000, 300),
+                         [(0, 300), (300, 300), (600, 300), (900, 100)])
+        self.assertEqual(cksum.chunk_ranges(600, 300), [(0, 300), (300, 300)])
+        self.assertEqual(cksum.chunk_ranges(0, 300), [])
+        with self.assertRaises(ValueError):
+            cksum.chunk_ranges(100, 0)
+
+    def test_tree_root(self):
+        chunks = [hashlib.sha256(c).hexdigest() for c in "abc"]
+        self.assertEqual(cksum.tree_root(chunks[:1]), chunks[0])
+        ab = hashlib.sha256(hashlib.sha256("a").digest() +
+                            hashlib.sha256("b").digest()).hexdigest()
+        self.assertEqual(cksum.tree_root(chunks[:2]), ab)
+        self.assertEqual(cksum.tree_root(chunks),
+                         hashlib.sha256(ab.decode('hex') +
+                                        hashlib.sha256("c").digest()).hexdigest())
+        self.assertEqual(cksum.tree_root([]), hashlib.sha256("").hexdigest())
+
+    def test_tree_digests_of(self):
+        digests, tree = cksum.tree_digests_of(self.datafile, 300,
+                                              ["sha256", "md5"])
+        self.assertEqual(digests["sha256"], syssum(self.datafile))
+        self.assertIn("md5", digests)
+        self.assertEqual(tree['size'], 1000)
+        self.assertEqual(tree['chunkSize'], 300)
+        self.assertEqual(len(tree['chunks']), 4)
+        self.assertEqual(tree['chunks'][3],
+                         cksum.chunk_digest(self.datafile, 900, 100))
+        self.assertEqual(tree['root'], cksum.tree_root(tree['chunks']))
+
+        # agrees with the parallel calculation
+        eng = cksum.ChecksumEngine({"workers": 3})
+        self.assertEqual(eng.tree_hash_of(self.datafile, 300), tree)
+        self.assertEqual(cksum.tree_digests_of(self.datafile, 500)[1],
+                         eng.tree_hash_of(self.datafile, 500))
+
+    def test_verify_tree_hash(self):
+        eng = cksum.ChecksumEngine({"workers": 3})
+        tree = eng.tree_hash_of(self.datafile, 300)
+        self.assertEqual(eng.verify_tree_hash(self.datafile, tree), [])
+
+        with open(self.datafile, 'r+b') as fd:
+            fd.seek(650)
+            fd.write('x')
+        self.assertEqual(eng.verify_tree_hash(self.datafile, tree), [(600, 300)])
+        self.assertEqual(cksum.ChecksumEngine().verify_tree_hash(self.datafile,
+                                                                 tree),
+                         [(600, 300)])
+
+        with open(self.datafile, 'ab') as fd:
+            fd.write('x')
+        self.assertEqual(eng.verify_tree_hash(self.datafile, tree), [(0, 1001)])
+
+class TestChecksumCache(test.TestCase):
+
+    def setUp(self):
+        self.tf = Tempfiles()
+        self.dbfile = self.tf.track("cs.sqlite")
+        self.cache = cksum.ChecksumCache(self.dbfile)
+        self.datafile = self.tf.track("data.txt")
+        with open(self.datafile, 'w') as fd:
+            fd.write("hello\n")
+
+    def tearDown(self):
+        self.tf.clean()
+
+    def test_ctor(self):
+        self.assertEqual(self.cache.dbfile, self.dbfile)
+        self.assertTrue(os.path.exists(self.dbfile))
+        self.assertEqual(self.cache.max_entries, cksum.DEF_CACHE_MAX_ENTRIES)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(self.datafile))
+        self.cache.put(self.datafile, "goob")
+        self.assertEqual(self.cache.get(self.datafile), "goob")
+        self.assertIsNone(self.cache.get(self.datafile, "md5"))
+
+        # the cache is persistent
+        cache = cksum.ChecksumCache(self.dbfile)
+        self.assertEqual(cache.get(self.datafile), "goob")
+
+        # a change to the file invalidates the entry
+        with open(self.datafile, 'a') as fd:
+            fd.write("world\n")
+        self.assertIsNone(self.cache.get(self.datafile))
+
+    def test_checksum_of(self):
+        hash = syssum(self.datafile)
+        self.assertEqual(self.cache.checksum_of(self.datafile), hash)
+        self.assertEqual(self.cache.get(self.datafile), hash)
+
+        # prove we're not re-reading the file
+        self.cache.put(self.datafile, "goob")
+        self.assertEqual(self.cache.checksum_of(self.datafile), "goob")
+
+        os.utime(self.datafile, (1000000000, 1000000000))
+        self.assertEqual(self.cache.checksum_of(self.datafile), hash)
+
+        self.assertEqual(self.cache.checksum_of(self.datafile, "md5"),
+                         hashlib.md5("hello\n").hexdigest())
+        with self.assertRaises(ValueError):
+            self.cache.checksum_of(self.datafile, "goob")
+
+    def test_digests_of(self):
+        need = { "sha256": syssum(self.datafile),
+                 "md5": hashlib.md5("hello\n").hexdigest() }
+        self.assertIsNone(self.cache.get_digests(self.datafile, need.keys()))
+        self.assertEqual(self.cache.digests_of(self.datafile, need.keys()), need)
+        self.assertEqual(self.cache.get_digests(self.datafile, need.keys()),
+                         need)
+        self.assertIsNone(self.cache.get_digests(self.datafile,
+                                                 ["md5", "sha512"]))
+
+    def test_evict(self):
+        for f in datafiles:
+            self.cache.put(f, "goob")
+        self.assertEqual(len(self.cache), len(datafiles))
+        self.cache.evict(2)
+        self.assertEqual(len(self.cache), 2)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+        cache = cksum.ChecksumCache(self.dbfile, {"max_entries": 2,
+                                                  "evict_check_interval": 1})
+        for f in datafiles:
+            cache.put(f, "goob")
+        self.assertEqual(len(cache), 2)
+        
+
+if __name__ == '__main__':
+    test.main()
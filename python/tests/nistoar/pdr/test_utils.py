@@ -1,4 +1,4 @@
-import os, sys, pdb, json, subprocess
+import os, sys, pdb, json, subprocess, hashlib
 import unittest as test
 
 from nistoar.testing import *
@@ -48,6 +48,21 @@ class TestMimeTypeLoading(test.TestCase):
         self.assertEquals(map['xml'], "application/xml")
         self.assertEquals(map['xsd'], "application/xml")
 
+    def test_sniff_media_type(self):
+        self.assertEqual(utils.sniff_media_type("%PDF-1.4\n%\xe2\xe3"),
+                         "application/pdf")
+        self.assertEqual(utils.sniff_media_type("\x89HDF\r\n\x1a\n\x00\x00"),
+                         "application/x-hdf5")
+        self.assertEqual(utils.sniff_media_type("\x1f\x8b\x08\x00"),
+                         "application/gzip")
+        self.assertEqual(utils.sniff_media_type("time,temp\n0,23.4\n"),
+                         "text/plain")
+        self.assertEqual(utils.sniff_media_type("\x00\x01\x02\xff"),
+                         "application/octet-stream")
+        self.assertEqual(utils.sniff_media_type("\x00\x01", "goob"), "goob")
+        self.assertEqual(utils.sniff_media_type(""),
+                         "application/octet-stream")
+
 class TestChecksum(test.TestCase):
 
     def test_checksum_of(self):
@@ -58,6 +73,17 @@ class TestChecksum(test.TestCase):
         dfile = os.path.join(testdatadir2,"trial3/trial3a.json")
         self.assertEqual(utils.checksum_of(dfile), self.syssum(dfile))
 
+    def test_digests_of(self):
+        dfile = os.path.join(testdatadir2,"trial1.json")
+        with open(dfile) as fd:
+            data = fd.read()
+        self.assertEqual(utils.digests_of(dfile),
+                         {"sha256": self.syssum(dfile)})
+        self.assertEqual(utils.digests_of(dfile, ["sha256", "md5", "sha512"]),
+                         {"sha256": self.syssum(dfile),
+                          "md5": hashlib.md5(data).hexdigest(),
+                          "sha512": hashlib.sha512(data).hexdigest()})
+
     def syssum(self, filepath):
         cmd = ["sha256sum", filepath]
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
@@ -0,0 +1,120 @@
+import os, sys, pdb, time, zlib
+import unittest as test
+
+from nistoar.testing import *
+
+import nistoar.pdr.wsgiutils as wu
+
+def setUpModule():
+    ensure_tmpdir()
+
+def tearDownModule():
+    rmtmpdir()
+
+class TestConditional(test.TestCase):
+
+    def test_make_etag(self):
+        etag = wu.make_etag("goob", 1.5)
+        self.assertTrue(etag.startswith('"'))
+        self.assertTrue(etag.endswith('"'))
+        self.assertEqual(len(etag), 34)
+        self.assertEqual(etag, wu.make_etag("goob", 1.5))
+        self.assertNotEqual(etag, wu.make_etag("goob", 1.6))
+
+    def test_http_date(self):
+        t = 1500000000
+        self.assertEqual(wu.http_date(t), "Fri, 14 Jul 2017 02:40:00 GMT")
+        self.assertEqual(wu.parse_http_date(wu.http_date(t)), t)
+        self.assertIsNone(wu.parse_http_date("goob"))
+
+    def test_not_modified(self):
+        etag = wu.make_etag("goob")
+        t = time.time()
+        self.assertFalse(wu.not_modified({}, etag, t))
+        self.assertTrue(wu.not_modified({'HTTP_IF_NONE_MATCH': etag}, etag))
+        self.assertTrue(wu.not_modified({'HTTP_IF_NONE_MATCH':
+                                         '"abc", W/'+etag}, etag))
+        self.assertTrue(wu.not_modified({'HTTP_IF_NONE_MATCH': '*'}, etag))
+        self.assertFalse(wu.not_modified({'HTTP_IF_NONE_MATCH': '"abc"'},
+                                         etag))
+        self.assertFalse(wu.not_modified({'HTTP_IF_NONE_MATCH': etag}))
+
+        env = {'HTTP_IF_MODIFIED_SINCE': wu.http_date(t)}
+        self.assertTrue(wu.not_modified(env, etag, t))
+        self.assertFalse(wu.not_modified(env, etag, t+5))
+        self.assertFalse(wu.not_modified(env, etag))
+
+        # If-None-Match takes precedence
+        env['HTTP_IF_NONE_MATCH'] = '"abc"'
+        self.assertFalse(wu.not_modified(env, etag, t))
+
+class TestRanges(test.TestCase):
+
+    def test_parse_range(self):
+        self.assertIsNone(wu.parse_range(None, 100))
+        self.assertIsNone(wu.parse_range("lines=1-2", 100))
+        self.assertIsNone(wu.parse_range("bytes=5-2", 100))
+        self.assertIsNone(wu.parse_range("bytes=a-b", 100))
+        self.assertEqual(wu.parse_range("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(wu.parse_range("bytes=90-", 100), [(90, 99)])
+        self.assertEqual(wu.parse_range("bytes=90-200", 100), [(90, 99)])
+        self.assertEqual(wu.parse_range("bytes=-10", 100), [(90, 99)])
+        self.assertEqual(wu.parse_range("bytes=-200", 100), [(0, 99)])
+        self.assertEqual(wu.parse_range("bytes=0-1, 5-6", 100),
+                         [(0, 1), (5, 6)])
+        self.assertEqual(wu.parse_range("bytes=100-", 100), [])
+        self.assertEqual(wu.parse_range("bytes=-0", 100), [])
+
+    def test_iter_file(self):
+        tf = Tempfiles()
+        try:
+            path = tf.track("iter_file.txt")
+            with open(path, 'wb') as fd:
+                fd.write("0123456789" * 10)
+
+            self.assertEqual("".join(wu.iter_file(path)), "0123456789" * 10)
+            self.assertEqual(len(list(wu.iter_file(path, blocksize=30))), 4)
+            self.assertEqual("".join(wu.iter_file(path, 5, 10, 3)),
+                             "5678901234")
+            self.assertEqual("".join(wu.iter_file(path, 95, 10)), "56789")
+        finally:
+            tf.clean()
+class TestEncoding(test.TestCase):
+
+    def test_choose_encoding(self):
+        self.assertIsNone(wu.choose_encoding({}))
+        self.assertEqual(wu.choose_encoding({'HTTP_ACCEPT_ENCODING':
+                                             'gzip, deflate'}), "gzip")
+        self.assertEqual(wu.choose_encoding({'HTTP_ACCEPT_ENCODING':
+                                             'deflate'}), "deflate")
+        self.assertEqual(wu.choose_encoding({'HTTP_ACCEPT_ENCODING':
+                                        'gzip;q=0.2, deflate;q=0.5'}),
+                         "deflate")
+        self.assertEqual(wu.choose_encoding({'HTTP_ACCEPT_ENCODING': '*'}),
+                         "gzip")
+        self.assertIsNone(wu.choose_encoding({'HTTP_ACCEPT_ENCODING':
+                                              'gzip;q=0, br'}))
+        self.assertIsNone(wu.choose_encoding({'HTTP_ACCEPT_ENCODING':
+                                              'identity'}))
+
+    def test_compress(self):
+        body = "goober " * 1000
+        self.assertEqual(zlib.decompress(wu.compress(body, "gzip"),
+                                         16 + zlib.MAX_WBITS), body)
+        self.assertEqual(zlib.decompress(wu.compress(body, "deflate")), body)
+        with self.assertRaises(ValueError):
+            wu.compress(body, "br")
+
+        out = list(wu.iter_compressed(body, "gzip", blocksize=100))
+        self.assertEqual(zlib.decompress("".join(out), 16 + zlib.MAX_WBITS),
+                         body)
+        out = wu.iter_compressed(iter(["goober "] * 1000), "deflate")
+        self.assertEqual(zlib.decompress("".join(out)), body)
+
+    def test_variant_etag(self):
+        self.assertEqual(wu.variant_etag('"abc"', "gzip"), '"abc-gzip"')
+        self.assertEqual(wu.variant_etag('"abc"', None), '"abc"')
+        self.assertIsNone(wu.variant_etag(None, "gzip"))
+
+if __name__ == '__main__':
+    test.main()